@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+# asyncio variant of the module that interfaces the PTZ camera
+
+
+import asyncio
+import logging
+import commands
+from message_type import *
+from reply_framer import *
+from open_command_table import TIMEOUT
+from retransmission import classify, retransmit_policies
+import sys
+sys.path.append('..')
+import globals
+import log
+
+logger = log.get_logger("camera")
+packet_logger = log.get_logger("camera.packets")
+
+class PendingCommand:
+  """
+  A command that has been sent to the camera with AsyncCamera.send_command.
+  The futures ack and completion can be awaited separately, completion resolves
+  to the processed result (or True for commands without return value, None on errors),
+  both resolve to TIMEOUT if there is no reply until the deadline of the command.
+  They are cancelled if the camera is closed or its sequence number is reset.
+  """
+  def __init__(self, loop, command_name, sequence_no, process_return_value):
+    self.command_name = command_name
+    self.sequence_no = sequence_no
+    self.process_return_value = process_return_value
+    self.ack = loop.create_future()
+    self.completion = loop.create_future()
+    self.payload = None
+    self.payload_message = ""
+
+    # handle of the call at the deadline, see AsyncCamera.expire
+    self.timer = None
+
+  def __await__(self):
+    return self.completion.__await__()
+
+class ViscaProtocol(asyncio.DatagramProtocol):
+  """
+  Datagram protocol that forwards every received reply to the AsyncCamera.
+  """
+  def __init__(self, camera):
+    self.camera = camera
+
+  def datagram_received(self, data, addr):
+    self.camera.handle_reply(data)
+
+  def error_received(self, exc):
+    logger.error("VISCA-over-IP socket error: %s", exc)
+
+class AsyncCamera:
+  """
+  This class provides an asyncio interface to the Marshall PTZ camera.
+  It speaks the same VISCA over IP protocol as camera.Camera, but all replies are
+  handled by the event loop instead of a receive thread.
+  """
+  def __init__(self, ip_address, port=52381):
+    self.ip_address = ip_address
+    self.port = port
+    self.sequence_no = 1
+    self.open_commands = {}
+    self.transport = None
+    self.framer = ReplyFramer()
+
+  async def open(self):
+    """
+    Create the UDP endpoint and reset the sequence number of the camera.
+    """
+    logger.info("initialize asyncio VISCA-over-IP, IP address: %s, port: %s", self.ip_address, self.port)
+    loop = asyncio.get_running_loop()
+    self.transport, protocol = await loop.create_datagram_endpoint(
+      lambda: ViscaProtocol(self), remote_addr=(self.ip_address, self.port))
+    self.reset_sequence_no()
+    return self
+
+  def close(self):
+    if self.transport is not None:
+      self.transport.close()
+      self.transport = None
+
+    # nobody will resolve the open commands anymore
+    self.cancel_open_commands()
+
+  def cancel_open_commands(self):
+    for pending in self.open_commands.values():
+      pending.timer.cancel()
+      for future in (pending.ack, pending.completion):
+        if not future.done():
+          future.cancel()
+    self.open_commands = {}
+
+  async def __aenter__(self):
+    return await self.open()
+
+  async def __aexit__(self, *exc_info):
+    self.close()
+
+  def reset_sequence_no(self):
+    """
+    Reset the sequence number of the camera. The replies of the open commands could not be told apart
+    from the replies of the new ones anymore, so the open commands are cancelled.
+    """
+    self.transport.sendto(bytes.fromhex('02 00 00 01 00 00 00 01 01'))
+    self.sequence_no = 1
+    self.cancel_open_commands()
+
+  def send_message(self, message_type, message_payload):
+    self.transport.sendto(compose_message(message_type, self.sequence_no, message_payload))
+    self.sequence_no += 1
+    return self.sequence_no - 1
+
+  def send_command(self, command_name, *args, timeout=None):
+    """
+    Send a command from the commands table without waiting for the reply.
+    :param timeout: time in seconds after which the command is completed with TIMEOUT, None uses the
+                    timeout of the retransmit policy of the command class
+    :return: PendingCommand whose ack and completion futures can be awaited, None if the command is unknown
+    """
+    if command_name not in commands.commands:
+      logger.error("send_command(%s): error, no such command name", command_name)
+      return None
+
+    command = commands.commands[command_name]
+    command_packet = command["command_packet"](args)
+    if timeout is None:
+      timeout = retransmit_policies[classify(command_name, args, command["message_type"])].timeout
+
+    loop = asyncio.get_running_loop()
+    pending = PendingCommand(loop, command_name, self.sequence_no, command.get("process_return_value"))
+    pending.timer = loop.call_later(timeout, self.expire, pending)
+    self.open_commands[self.sequence_no] = pending
+
+    packet_logger.debug("> send command \"%s\", seq. no. %s", command_name, self.sequence_no)
+
+    self.send_message(command["message_type"], command_packet)
+    return pending
+
+  async def command(self, command_name, *args, timeout=None):
+    """
+    Send a command and wait until it has completed.
+    :param timeout: time in seconds after which the command is completed with TIMEOUT, None uses the
+                    timeout of the retransmit policy of the command class
+    :return: the processed result, e.g. (x,y) for "Pan-tiltPosInq", TIMEOUT if there was no reply in time
+    """
+    pending = self.send_command(command_name, *args, timeout=timeout)
+    if pending is None:
+      return None
+    return await pending.completion
+
+  def finish(self, pending, result):
+    """
+    Resolve the futures of a pending command with the result and remove it from the open commands.
+    """
+    pending.timer.cancel()
+    if not pending.ack.done():
+      pending.ack.set_result(True if result is not TIMEOUT else TIMEOUT)
+    if not pending.completion.done():
+      pending.completion.set_result(result)
+    if self.open_commands.get(pending.sequence_no) is pending:
+      del self.open_commands[pending.sequence_no]
+
+  def expire(self, pending):
+    """
+    Complete a command without reply at its deadline, e.g. because a datagram was lost.
+    """
+    logger.warning("Command \"%s\" with seq. no. %s timed out.", pending.command_name, pending.sequence_no)
+    self.finish(pending, TIMEOUT)
+
+  def handle_reply(self, message):
+    """
+    Parse one received datagram and resolve the futures of the corresponding commands.
+    """
+    for payload_type, sequence_no, payload, payload_message in self.framer.parse(message):
+      if packet_logger.isEnabledFor(logging.DEBUG):
+        packet_logger.debug("< recv %s, seq. no. %s, payload: %s (%s)",
+          payload_type_names.get(payload_type, "unknown"), sequence_no, payload.hex(), payload_message)
+
+      # replies to control commands do not belong to a VISCA command
+      if payload_type != VISCA_REPLY:
+
+        # the camera rejected a sequence number, e.g. after it was restarted
+        if payload_message == "Abnormality in the sequence number.":
+          self.reset_sequence_no()
+        continue
+
+      pending = self.open_commands.get(sequence_no)
+      if pending is None:
+        continue
+      pending.payload = payload
+      pending.payload_message = payload_message
+
+      if payload_message == "Ack":
+        if not pending.ack.done():
+          pending.ack.set_result(True)
+        continue
+
+      result = None
+      if not payload_message.startswith("Error"):
+        result = True
+        if pending.process_return_value:
+          try:
+            result = pending.process_return_value(payload)
+          except:
+            logger.warning("Could not process return value %s for command %s.", payload.hex(), pending.command_name)
+            result = None
+
+      self.finish(pending, result)
+
+async def main():
+  async with AsyncCamera(globals.ptz_camera_ip_address) as camera:
+    print("camera is on: {}".format(await camera.command("CAM_PowerInq")))
+
+    pending = camera.send_command("Pan-tiltDrive_Home")
+    await pending.ack
+    await pending.completion
+
+    print("Pan-tiltPos: {}".format(await camera.command("Pan-tiltPosInq")))
+    print("zoom: {}".format(await camera.command("CAM_OpticalZoomPosInq")))
+
+if __name__ == "__main__":
+  asyncio.run(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+# module that benchmarks the control path of the camera module against the simulated camera
+
+import argparse
+import collections
+import datetime
+import json
+import platform
+import sys
+import time
+import timeit
+sys.path.append('..')
+import log
+
+# log to stderr, the results are written to stdout
+log.setup(stream=sys.stderr)
+
+import commands
+import metrics
+from message_type import *
+from reply_framer import *
+from open_command_table import TIMEOUT
+from simulator import CameraSimulator
+from camera import Camera
+
+# commands of the round trip benchmark, with their arguments
+round_trip_cases = [
+  ("Pan-tiltDrive", (1, 1, 0.5, 0.5)),
+  ("Pan-tiltDrive_Stop", ()),
+  ("CAM_Zoom_Tele_Variable", (3,)),
+  ("CAM_Zoom_Stop", ()),
+  ("Tally_Mode", ()),
+  ("Pan-tiltPosInq", ()),
+  ("CAM_OpticalZoomPosInq", ()),
+]
+
+# datagrams of the parser benchmark
+parser_cases = [
+  ("ack", bytes.fromhex('01 11 00 03 00 00 00 05 90 41 FF')),
+  ("completion", bytes.fromhex('01 11 00 03 00 00 00 05 90 51 FF')),
+  ("ack_and_completion", bytes.fromhex('01 11 00 06 00 00 00 05 90 41 FF 90 51 FF')),
+  ("pan_tilt_position", bytes.fromhex('01 11 00 0B 00 00 00 05 90 50 0F 0A 0B 0C 0F 0E 0D 0C FF')),
+  ("control_reply", bytes.fromhex('02 01 00 01 00 00 00 01 01')),
+]
+
+def benchmark_round_trip(camera, iterations):
+  """
+  Measure the time from send_command until the ack and until the completion, for each command of round_trip_cases.
+  """
+  results = {}
+  for command_name, args in round_trip_cases:
+    ack_times = []
+    completion_times = []
+    for i in range(iterations):
+      start = time.perf_counter()
+      sequence_no = camera.send_command(command_name, *args)
+      if camera.open_commands.get(sequence_no).command_type != MessageType.VISCA_INQUIRY:
+        camera.wait_for_ack(sequence_no)
+        ack_times.append(time.perf_counter() - start)
+      result = camera.wait_for_result(sequence_no)
+      if result is not None and result is not TIMEOUT:
+        completion_times.append(time.perf_counter() - start)
+    results[command_name] = {"ack": metrics.percentiles(ack_times), "completion": metrics.percentiles(completion_times)}
+  return results
+
+def benchmark_inquiry_rate(camera, number, window=32):
+  """
+  Send the given number of inquiries with at most window of them outstanding and measure how many
+  complete per second, the scheduler keeps the allowed number of inquiries in flight.
+  The window has to be smaller than the capacity of the open commands table.
+  """
+  outstanding = collections.deque()
+  completed = 0
+  start = time.perf_counter()
+  for i in range(number):
+    if len(outstanding) >= window:
+      if camera.wait_for_result(outstanding.popleft()):
+        completed += 1
+    outstanding.append(camera.send_command("Pan-tiltPosInq"))
+  while outstanding:
+    if camera.wait_for_result(outstanding.popleft()):
+      completed += 1
+  elapsed = time.perf_counter() - start
+  return {"inquiries": number, "window": window, "completed": completed, "seconds": elapsed,
+          "inquiries_per_second": completed / elapsed}
+
+def benchmark_parser(number):
+  """
+  :return: dict of the datagram name to the time per ReplyFramer.parse call in seconds, the fastest of three runs
+  """
+  framer = ReplyFramer()
+  results = {}
+  for name, datagram in parser_cases:
+    results[name] = min(timeit.repeat(lambda: framer.parse(datagram), number=number, repeat=3)) / number
+  return results
+
+def run(iterations=200, inquiries=1000, number=100000, port=52399, latency=0.0, seed=1):
+  """
+  Run all benchmarks.
+  :return: dict with the results, in seconds per call for the codecs and the parser
+  """
+  results = {
+    "time": datetime.datetime.now().isoformat(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "parameters": {"iterations": iterations, "inquiries": inquiries, "number": number, "latency": latency, "seed": seed},
+  }
+
+  results["codecs"] = commands.benchmark(number)
+  results["parser"] = benchmark_parser(number)
+
+  simulator = CameraSimulator(port=port, latency=latency, seed=seed).start()
+  camera = Camera("127.0.0.1", port)
+  try:
+    results["round_trip"] = benchmark_round_trip(camera, iterations)
+    results["inquiry_rate"] = benchmark_inquiry_rate(camera, inquiries)
+  finally:
+    camera.close()
+    simulator.stop()
+
+  return results
+
+def compare(results, baseline, threshold):
+  """
+  Compare the per-call times and the median latencies with a baseline.
+  :return: list of (name, baseline value, value) of the results that are slower than the baseline by more than the threshold factor
+  """
+  regressions = []
+  def check(name, baseline_value, value):
+    if baseline_value and value > baseline_value * threshold:
+      regressions.append((name, baseline_value, value))
+
+  for section in ("codecs", "parser"):
+    for name, value in results[section].items():
+      check("{}.{}".format(section, name), baseline.get(section, {}).get(name), value)
+  for command_name, latencies in results["round_trip"].items():
+    for kind in ("ack", "completion"):
+      baseline_value = baseline.get("round_trip", {}).get(command_name, {}).get(kind, {}).get("p50_ms")
+      check("round_trip.{}.{}".format(command_name, kind), baseline_value, latencies[kind].get("p50_ms", 0))
+  baseline_rate = baseline.get("inquiry_rate", {}).get("inquiries_per_second")
+  if baseline_rate and results["inquiry_rate"]["inquiries_per_second"] * threshold < baseline_rate:
+    regressions.append(("inquiry_rate", baseline_rate, results["inquiry_rate"]["inquiries_per_second"]))
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark of the camera control path against the simulated camera")
+  parser.add_argument("--output", help="file to write the JSON results to, default is stdout")
+  parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+  parser.add_argument("--threshold", type=float, default=1.5, help="factor by which a result may be slower than the baseline")
+  parser.add_argument("--iterations", type=int, default=200, help="round trips per command")
+  parser.add_argument("--inquiries", type=int, default=1000, help="inquiries of the inquiry rate benchmark")
+  parser.add_argument("--number", type=int, default=100000, help="calls per codec and parser benchmark")
+  parser.add_argument("--port", type=int, default=52399, help="port of the simulated camera")
+  parser.add_argument("--latency", type=float, default=0.0, help="latency of the simulated camera in seconds")
+  args = parser.parse_args()
+
+  results = run(args.iterations, args.inquiries, args.number, args.port, args.latency)
+  output = json.dumps(results, indent=2)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(output + "\n")
+  else:
+    print(output)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for name, baseline_value, value in regressions:
+      print("regression: {}: {:.6g} -> {:.6g}".format(name, baseline_value, value), file=sys.stderr)
+    sys.exit(1 if regressions else 0)
@@ -3,237 +3,454 @@
 
 
 import socket
+import selectors
 import time
 import commands
 import threading
-import datetime
+import logging
 from message_type import *
+from reply_framer import *
+from open_command_table import *
+from retransmission import *
+from scheduler import *
+import capture
 import sys
-import traceback
 sys.path.append('..')
 import globals
+import log
+import metrics
+
+logger = log.get_logger("camera")
+
+# every sent and received message, switched off unless the level of "camera.packets" is DEBUG
+packet_logger = log.get_logger("camera.packets")
+
+# retransmissions come in bursts when the network loses packets
+retransmit_logger = log.get_logger("camera.retransmit", rate_limit=1.0)
+
+# send errors repeat for every message while the network is down
+send_error_logger = log.get_logger("camera.send", rate_limit=1.0)
+
+# counters and round trip times of the commands, by camera and command name
+commands_sent = metrics.Counter("camera_commands_sent_total", "Commands and inquiries sent, without retransmissions", ("camera", "command"))
+retransmissions = metrics.Counter("camera_retransmissions_total", "Commands and inquiries sent again", ("camera", "command"))
+acks = metrics.Counter("camera_acks_total", "Acks received", ("camera", "command"))
+completions = metrics.Counter("camera_completions_total", "Completions received", ("camera", "command"))
+errors = metrics.Counter("camera_errors_total", "Error replies received, by error class", ("camera", "command", "error"))
+sequence_resets = metrics.Counter("camera_sequence_resets_total", "Resets after the camera rejected a sequence number", ("camera",))
+ack_seconds = metrics.Histogram("camera_ack_seconds", "Time from the first transmission of a command to its ack", ("camera", "command"))
+completion_seconds = metrics.Histogram("camera_completion_seconds", "Time from the first transmission of a command to its completion", ("camera", "command"))
 
 class Camera:
   """
   This class provides an interface to the Marshall PTZ camera.
   It executes given commands on the camera using the VISCA over IP interface
   """  
-  sequence_no = 1
-  open_commands = {}
-    
-  def __init__(self, ip_address, port=52381):
-    print("initialize VISCA-over-IP, IP address: {}, port: {}".format(ip_address, port))
+  def __init__(self, ip_address, port=52381, open_commands_capacity=256, sockets=2, group=None):
+    """
+    :param group: CameraGroup whose socket and receive thread are used, None opens a socket and starts a receive thread for this camera
+    """
+    logger.info("initialize VISCA-over-IP, IP address: %s, port: %s", ip_address, port)
     
     self.ip_address = ip_address
     self.port = port
+    self.group = group
+    self.sequence_no = 1
+    
+    # ring of the commands that have been sent, the oldest are evicted
+    self.open_commands = OpenCommandTable(open_commands_capacity, name=ip_address)
+    
+    # latest continuous motion or stop command of each axis group, older ones are not retransmitted
+    self.latest_commands = {}
+    
+    # newest continuous motion command of each axis group that waits for the ack of the previous one
+    self.coalesced_commands = {}
+    
+    # admission control for the command sockets of the camera
+    self.scheduler = CommandScheduler(sockets)
+    
+    # last pan, tilt and zoom position and the pose inquiry in flight, shared by all callers of get_pose()
+    self.pose_lock = threading.Lock()
+    self.pose = None
+    self.pose_time = None
+    self.pose_inquiry = None
+    
+    # optional background recorder of the pose, see start_telemetry()
+    self.telemetry = None
+    
+    # optional recorder of the sent and received datagrams, see start_capture()
+    self.capture = None
+    self.capture_address = None
+    
+    # lock that serializes sequence number allocation and sending
+    self.send_lock = threading.Lock()
+    self.receive_deadline = None
+    self.is_running = True
+    
+    # cameras of a group share its socket, the group receives the replies and passes them to handle_reply()
+    if group is not None:
+      self.socket = group.socket
+      self.wakeup_sender = group.wakeup_sender
+      self.reset_sequence_no()
+      return
     
     # open socket for UDP communication
     self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.socket.setblocking(False)
+    
+    # socket pair to wake up the receive thread on close() or when an earlier deadline was added
+    self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+    self.wakeup_receiver.setblocking(False)
+    
+    # the receive thread blocks in the selector until a datagram arrives
+    self.selector = selectors.DefaultSelector()
+    self.selector.register(self.socket, selectors.EVENT_READ)
+    self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
     
     self.reset_sequence_no()
     
     # start receive thread
-    self.receiving_thread = threading.Thread(target=self.receive_loop).start()
+    self.receiving_thread = threading.Thread(target=self.receive_loop, daemon=True)
+    self.receiving_thread.start()
+
+  def close(self):
+    """
+    Stop the receive thread and close the socket.
+    """
+    if self.telemetry is not None:
+      self.telemetry.stop()
+    
+    # the socket and receive thread of a group are closed by the group
+    if self.group is not None:
+      self.is_running = False
+      self.stop_capture()
+      return
+    self.is_running = False
+    self.wakeup_sender.send(b"\0")
+    self.receiving_thread.join()
+    self.stop_capture()
+    self.selector.close()
+    self.socket.close()
+    self.wakeup_receiver.close()
+    self.wakeup_sender.close()
+
+  def start_telemetry(self, rate=10.0, capacity=4096):
+    """
+    Start polling the pose at the given rate into the ring buffer of self.telemetry,
+    see telemetry.PoseTelemetry for the queries.
+    """
+    # telemetry needs numpy, which is not required for the rest of the camera module
+    import telemetry
+    
+    if self.telemetry is None:
+      self.telemetry = telemetry.PoseTelemetry(self, rate, capacity)
+      self.telemetry.start()
+    return self.telemetry
+
+  def start_capture(self, path):
+    """
+    Write every sent and received datagram to a new capture file at path, see capture.py for the replay.
+    """
+    if self.capture is None:
+      self.capture_address = (socket.gethostbyname(self.ip_address), self.port)
+      self.capture = capture.CaptureWriter(path)
+    return self.capture
+  
+  def stop_capture(self):
+    """
+    Stop recording and write the remaining records of the capture file.
+    """
+    capture_writer, self.capture = self.capture, None
+    if capture_writer is not None:
+      capture_writer.close()
 
   def receive_loop(self):
-    received_message = bytes()
-    bufsize = 4096
-    payload = None
+    framer = ReplyFramer()
     
-    while True:
+    while self.is_running:
       try:
-        # receive UDP message
-        b = self.socket.recv(bufsize, socket.MSG_DONTWAIT)
-        received_message += b
-        #print("< recv [{}]".format(received_message.hex()))
+        # block until the socket is readable or the next open command expires, without any polling
+        time_to_next_deadline = self.service()
+        if time_to_next_deadline == 0:
+          continue
         
-        # if the received message could already be complete
-        if len(received_message) >= 8:
-          # parse payload type
-          payload_type = received_message[0:2]
-          
-          payload_type_str = "unknown ({})".format(payload_type)
-          if payload_type == bytearray.fromhex("0111"):
-            payload_type_str = "VISCA reply"
-          elif payload_type == bytearray.fromhex("0201"):
-            payload_type_str = "Control reply"
-          
-          # parse other fields and payload
-          payload_length = int.from_bytes(received_message[2:4], byteorder='big')
-          sequence_no = int.from_bytes(received_message[4:8], byteorder='big')
-          payload = received_message[8:]
-          
-          # if the anounced number of bytes have been recived, end waiting loop
-          if len(received_message) == 8+payload_length:
-              
-            # check if reply contained an error and completion notice
-            payload_message = ""
-            
-            message_is_complete = True
-            if payload == bytearray.fromhex("90 41 FF"):
-              payload_message = "Ack"
-            
-            elif payload == bytearray.fromhex("90 51 FF"):
-              payload_message = "Completion (commands)"
-            
-            elif payload == bytearray.fromhex("90 60 02 FF"):
-              payload_message = "Error: Syntax Error"
-              
-            elif payload == bytearray.fromhex("90 60 03 FF"):
-              payload_message = "Error: Command buffer full"
-              
-            elif payload == bytearray.fromhex("90 60 04 FF"):
-              payload_message = "Error: Command cancelled (socket no. 0)"
-            
-            elif payload == bytearray.fromhex("90 61 04 FF"):
-              payload_message = "Error: Command cancelled (socket no. 1)"
-            
-            elif payload == bytearray.fromhex("90 62 04 FF"):
-              payload_message = "Error: Command cancelled (socket no. 2)"
-            
-            elif payload == bytearray.fromhex("90 60 05 FF"):
-              payload_message = "Error: No socket (to be cancelled, socket no. 0)"
-            
-            elif payload == bytearray.fromhex("90 61 05 FF"):
-              payload_message = "Error: No socket (to be cancelled, socket no. 1)"
-            
-            elif payload == bytearray.fromhex("90 62 05 FF"):
-              payload_message = "Error: No socket (to be cancelled, socket no. 2)"
-            
-            elif payload == bytearray.fromhex("90 60 41 FF"):
-              payload_message = "Error: Command not executable (socket no. 0)"
-            
-            elif payload == bytearray.fromhex("90 61 41 FF"):
-              payload_message = "Error: Command not executable  (socket no. 1)"
-            
-            elif payload == bytearray.fromhex("90 62 41 FF"):
-              payload_message = "Error: Command not executable  (socket no. 2)"
-            
-            elif payload == bytearray.fromhex("01"):
-              payload_message = "Reset sequence number."
-            
-            elif payload == bytearray.fromhex("0F 01"):
-              payload_message = "Abnormality in the sequence number."
-            
-            elif payload == bytearray.fromhex("0F 01"):
-              payload_message = "Abnormality in the message (message type)."
-            
-            # if there was a special reply
-            if payload_message != "":
-              
-              # clear received message
-              received_message = bytes()
-            
-            # if there was a normal reply
-            else:
-              # find end of payload
-              position_ff = received_message.find(bytearray.fromhex("FF"))
-              
-              # if the end was not yet contained
-              if position_ff == -1:
-                message_is_complete = False
-              
-              # if the end was found
-              else:
-                
-                # extract payload
-                payload = received_message[8:position_ff+1]
-                if len(payload) >= 2 and payload[0:2] == bytearray.fromhex("90 50"):
-                  payload_message = "Completion (inquiries)"
-                
-                # remove payload, rest of received message is handled in next iteration
-                received_message = received_message[position_ff+1:]
-            
-            # output message
-            print("[{:%M:%S}] < recv {}, seq. no. {}, payload (length {}): {} ({})".format(
-              datetime.datetime.now(), payload_type_str, sequence_no, payload_length, payload.hex(), payload_message))
-              
-            # store message
-            if sequence_no not in self.open_commands:
-              self.open_commands[sequence_no] = {}
-            
-            # add items
-            self.open_commands[sequence_no]["payload"] = payload
-            self.open_commands[sequence_no]["payload_type"] = payload_type
-            self.open_commands[sequence_no]["payload_message"] = payload_message
-            self.open_commands[sequence_no]["result"] = None
-            
-            # process the return value, if a function was specified
-            if "process_return_value" in self.open_commands[sequence_no]:
-              try:
-                result = self.open_commands[sequence_no]["process_return_value"](payload)
-                self.open_commands[sequence_no]["result"] = result
-                print("  Processed result is {}".format(result))
-              except:
-                if payload:
-                  print("  Could not process return value {} for command {}.".format(payload.hex(), self.open_commands[sequence_no]["command_name"]))
-                  #traceback.print_exc()
-                else:
-                  print("  Could not process return value.")
-                  #traceback.print_exc()
-            else:
-              # set result to True if there is no process_return_value command and the command has terminated
-              self.open_commands[sequence_no]["result"] = True
+        if time_to_next_deadline is None:
+          self.receive_deadline = None
+        else:
+          self.receive_deadline = time.monotonic() + time_to_next_deadline
+        ready = [key.fileobj for key, mask in self.selector.select(time_to_next_deadline)]
+        
+        # drain the wakeup socket
+        if self.wakeup_receiver in ready:
+          self.wakeup_receiver.recv(4096)
+        if self.socket not in ready:
+          continue
+        
+        # receive UDP message and split it into single replies
+        replies = framer.receive(self.socket)
+        capture_writer = self.capture
+        if capture_writer is not None:
+          capture_writer.record(capture.RECEIVED, self.capture_address, framer.view[:framer.nbytes])
+        for payload_type, sequence_no, payload, payload_message in replies:
+          self.handle_reply(payload_type, sequence_no, payload, payload_message)
             
-      # if nothing is received, continue
+      # if the datagram was consumed already, continue
       except BlockingIOError:
         continue
         
-      # if there was a different error, print stacktrace
+      # if there was a different error, log stacktrace
       except:
-        print(sys.exc_info()[0])
-        traceback.print_exc()
-      
-      # wait short time and then continue receiving
-      time.sleep(0.01)
+        logger.exception("error in the receive loop")
       
-  def reset_sequence_no(self):
-    message = bytearray.fromhex('02 00 00 01 00 00 00 01 01')
-    self.socket.sendto(message,(self.ip_address, self.port))
-    self.sequence_no = 1
-    self.open_commands = {}
-  
-  def send_message(self, message_type, message_payload):
+  def service(self):
+    """
+    Time out and retransmit the open commands that are due and send the queued commands that can be sent now.
+    Called by the receive thread before it blocks.
+    :return: time in seconds until service() has to be called again, 0 if it has to be called again right away,
+             None if there is no deadline
+    """
+    retransmit, time_to_next_deadline = self.open_commands.expire()
+    for open_command in retransmit:
+      self.retransmit(open_command)
+    
+    # acks, completions, timeouts and superseded commands may have released queued commands
+    self.dispatch_queued_commands()
+    if retransmit:
+      return 0
+    
+    # after a full command buffer, wake up when the queued and coalesced commands may be sent again,
+    # and time out the queued commands at their deadlines
+    with self.send_lock:
+      time_to_unblock = self.scheduler.time_to_unblock(has_waiting=bool(self.coalesced_commands))
+      queued_deadlines = [open_command.deadline for open_command in self.coalesced_commands.values()]
+      queued_deadlines += [open_command.deadline for queue in self.scheduler.queues for open_command in queue]
+    for time_to_wakeup in [time_to_unblock] + [deadline - time.monotonic() for deadline in queued_deadlines]:
+      if time_to_wakeup is not None and (time_to_next_deadline is None or time_to_wakeup < time_to_next_deadline):
+        time_to_next_deadline = time_to_wakeup
     
-    # compose payload type
-    message_payload_type = bytes()
-    if message_type == MessageType.VISCA_COMMAND:
-      message_payload_type = bytearray.fromhex('01 00')
+    if time_to_next_deadline is None:
+      return None
+    return max(time_to_next_deadline, 0.001)
+    
+  def handle_reply(self, payload_type, sequence_no, payload, payload_message):
+    """
+    Store a single reply in the open_commands entry of its sequence number and wake up waiting threads.
+    """
+    # output message
+    if packet_logger.isEnabledFor(logging.DEBUG):
+      packet_logger.debug("< recv %s, seq. no. %s, payload (length %s): %s (%s)",
+        payload_type_names.get(payload_type, "unknown ({:04x})".format(payload_type)),
+        sequence_no, len(payload), payload.hex(), payload_message)
+    
+    # replies to control commands do not belong to a VISCA command
+    if payload_type != VISCA_REPLY:
+      
+      # the camera rejected a sequence number, reset it and send the commands in flight again
+      if payload_message == "Abnormality in the sequence number.":
+        sequence_resets.inc(self.ip_address)
+        self.reset_sequence_no(rejected_sequence_no=sequence_no)
+      return
       
-    elif message_type == MessageType.VISCA_INQUIRY:
-      message_payload_type = bytearray.fromhex('01 10')
+    # find the sent command
+    open_command = self.open_commands.get(sequence_no)
+    if open_command is None:
+      logger.warning("No open command with seq. no. %s.", sequence_no)
+      return
+
+    # the camera cancels a command that was retransmitted after its ack got lost, when it executes the retransmission
+    if payload_message.startswith("Error: Command cancelled") and sequence_no != open_command.sequence_no:
+      return
+
+    # add items
+    open_command.payload = payload
+    open_command.payload_type = payload_type
+    open_command.payload_message = payload_message
+    
+    if payload_message.startswith("Error"):
+      errors.inc(self.ip_address, open_command.command_name, error_classes.get(payload[2] if len(payload) > 2 else None, "other"))
     
-    elif message_type == MessageType.VISCA_DEVICE_SETTING_COMMAND:
-      message_payload_type = bytearray.fromhex('01 20')
+    # an accepted motion or stop command ends the older drives of its axis group, which would otherwise
+    # occupy a socket of the scheduler until their deadline, e.g. after their retransmissions were lost
+    if open_command.axis_group is not None and not payload_message.startswith("Error"):
+      self.supersede_older_drives(open_command)
     
-    elif message_type == MessageType.CONTROL_COMMAND:
-      message_payload_type = bytearray.fromhex('02 00')
+    # an ack only wakes up threads waiting for the ack, the command does not have to be retransmitted anymore
+    if payload_message == "Ack":
+      acks.inc(self.ip_address, open_command.command_name)
+      if not open_command.acknowledged.is_set():
+        ack_seconds.observe(time.monotonic() - open_command.sent_time, self.ip_address, open_command.command_name)
+      open_command.retransmit_at = None
+      if open_command.process_return_value is None:
+        open_command.result = True
+      open_command.acknowledged.set()
+      return
     
+    # the command was not accepted, queue it again unless it is superseded or out of retries
+    if payload_message == "Error: Command buffer full":
+      self.scheduler.on_buffer_full()
+      if not self.is_superseded(open_command) and open_command.retries > 0:
+        open_command.retries -= 1
+        open_command.retransmit_at = None
+        with self.send_lock:
+          self.open_commands.withdraw(open_command)
+          self.scheduler.on_withdraw(open_command)
+          if open_command.command_class == "drive":
+            self.coalesced_commands[open_command.axis_group] = open_command
+          else:
+            self.scheduler.enqueue(open_command, front=True)
+        return
+    
+    if not payload_message.startswith("Error"):
+      completions.inc(self.ip_address, open_command.command_name)
+      if not open_command.completed.is_set():
+        completion_seconds.observe(time.monotonic() - open_command.sent_time, self.ip_address, open_command.command_name)
+    
+    result = None
+    
+    # errors complete the command without result
+    if payload_message.startswith("Error"):
+      pass
+    
+    # process the return value, if a function was specified
+    elif open_command.process_return_value is not None:
+      try:
+        result = open_command.process_return_value(payload)
+        packet_logger.debug("Processed result is %s", result)
+      except:
+        logger.warning("Could not process return value %s for command %s.", payload.hex(), open_command.command_name)
     else:
-      message_payload_type = bytearray.fromhex('00 00')
+      # set result to True if there is no process_return_value command and the command has terminated
+      result = True
     
-    # compose payload and length
-    message_payload_length = len(message_payload).to_bytes(2, 'big')
-    message_sequence_no = self.sequence_no.to_bytes(4, 'big')
+    # wake up threads waiting for this sequence number
+    self.open_commands.complete(open_command, result)
+      
+  def reset_sequence_no(self, rejected_sequence_no=None):
+    """
+    Reset the sequence number of the camera to 1. Commands in flight that have not been acknowledged
+    are sent again with new sequence numbers, except superseded continuous motion and commands that
+    must not be executed twice. The latter are only sent again if the camera rejected their sequence number.
+    :param rejected_sequence_no: sequence number of the message the camera replied with "Abnormality in the sequence number." to
+    """
+    message = bytearray.fromhex('02 00 00 01 00 00 00 01 01')
+    with self.send_lock:
+      self.sequence_no = 1
+      try:
+        self.socket.sendto(message,(self.ip_address, self.port))
+      except OSError as exc:
+        # at boot the network may not be up yet, the camera then rejects the first command and is reset again on that reply
+        logger.warning("Could not reset the sequence number of %s: %s", self.ip_address, exc)
+      capture_writer = self.capture
+      if capture_writer is not None:
+        capture_writer.record(capture.SENT, self.capture_address, message)
+      
+      for open_command in self.open_commands.in_flight():
+        if open_command.acknowledged.is_set():
+          continue
+        if self.is_superseded(open_command):
+          self.open_commands.complete(open_command, SUPERSEDED)
+        elif retransmit_policies[open_command.command_class].retries == 0 and open_command.sequence_no != rejected_sequence_no:
+          continue
+        else:
+          retransmit_logger.info("Resend command \"%s\", seq. no. %s", open_command.command_name, open_command.sequence_no)
+          self.resend(open_command)
+  
+  def is_superseded(self, open_command):
+    """
+    Check if a newer continuous motion or stop command has been sent or queued for the axis group of a continuous motion command.
+    """
+    if open_command.command_class != "drive":
+      return False
+    return self.latest_commands.get(open_command.axis_group) is not open_command or open_command.axis_group in self.coalesced_commands
+  
+  def supersede_older_drives(self, open_command):
+    """
+    Complete the pending continuous motion commands of the axis group of the command that were sent before it with SUPERSEDED.
+    """
+    for older in self.open_commands.in_flight():
+      if older is not open_command and older.command_class == "drive" and older.axis_group == open_command.axis_group \
+          and older.sent_time <= open_command.sent_time:
+        self.open_commands.complete(older, SUPERSEDED)
+  
+  def release_lost_drive(self, axis_group):
+    """
+    Complete the unacknowledged continuous motion command of the axis group with SUPERSEDED if its retransmissions
+    are used up, a newer one would otherwise wait until its deadline. The caller has to hold the send_lock.
+    """
+    in_flight = self.latest_commands.get(axis_group)
+    if in_flight is not None and in_flight.command_class == "drive" and not in_flight.acknowledged.is_set() \
+        and in_flight.retransmit_at is None and in_flight.retries <= 0:
+      self.open_commands.complete(in_flight, SUPERSEDED)
+  
+  def resend(self, open_command):
+    """
+    Send a pending command again with the next sequence number, the caller has to hold the send_lock.
+    """
+    retransmissions.inc(self.ip_address, open_command.command_name)
+    self.open_commands.rekey(open_command, self.sequence_no)
+    self.send_message(open_command.command_type, open_command.command_packet)
+  
+  def retransmit(self, open_command):
+    """
+    Retransmit a command that did not get a reply in time, according to the retransmit policy of its command class.
+    """
+    if self.is_superseded(open_command):
+      self.open_commands.complete(open_command, SUPERSEDED)
+      return
     
-    # compose message
-    message = message_payload_type + message_payload_length + message_sequence_no + message_payload
+    if open_command.retries <= 0:
+      open_command.retransmit_at = None
+      return
+    
+    open_command.retries -= 1
+    open_command.retransmit_at = time.monotonic() + retransmit_policies[open_command.command_class].reply_timeout
+    
+    with self.send_lock:
+      retransmit_logger.info("Retransmit command \"%s\", seq. no. %s", open_command.command_name, open_command.sequence_no)
+      self.resend(open_command)
+  
+  def send_message(self, message_type, message_payload):
+    """
+    Send a message with the next sequence number. If it cannot be sent, e.g. while the network is down, the
+    sequence number is used up anyway, the open command keeps it and is sent again by the retransmit timer
+    or completed with TIMEOUT at its deadline.
+    """
     
-    #print("> send [{}], seq. no. {}".format(message.hex(), self.sequence_no))
+    # compose message
+    message = compose_message(message_type, self.sequence_no, message_payload)
     
     # send message with UDP
-    self.socket.sendto(message, (self.ip_address, self.port))
+    try:
+      self.socket.sendto(message, (self.ip_address, self.port))
+      capture_writer = self.capture
+      if capture_writer is not None:
+        capture_writer.record(capture.SENT, self.capture_address, message)
+    except OSError as exc:
+      send_error_logger.warning("Could not send seq. no. %s to %s: %s", self.sequence_no, self.ip_address, exc)
     
     # increment sequence number
     self.sequence_no += 1
     
     return self.sequence_no - 1
   
-  def send_command(self, command_name, *args):
+  def send_command(self, command_name, *args, timeout=None, priority=None):
+    """
+    Send a command of the commands table.
+    Commands are queued by the scheduler if the sockets of the camera are occupied, and sent in the
+    order of their priority class: stop, operator motion, automation, inquiries.
+    Continuous motion commands (class "drive") are coalesced: while a drive command of the same axis group
+    has not been acknowledged, a new one is not sent but queued, replacing any queued older value.
+    Stop commands are never coalesced and discard the queued drive command of their axis group.
+    :param timeout: time in seconds after which the command is completed with TIMEOUT, None uses the
+                    timeout of the retransmit policy of the command class
+    :param priority: priority class of scheduler.py, None uses the default of the command class
+    :return: the sequence number of the sent message, a negative ticket number if the command has been
+             queued (both can be used with get_result and wait_for_result), None if the command does not exist
+    """
     
     # check if command exists in the dict of commands
     if command_name not in commands.commands:
-      print("> send_command([]): error, no such command name".format(command_name))
+      logger.error("send_command(%s): error, no such command name", command_name)
       return None
     
     # get the message type (either MessageType.INQUIRY or MessageType.COMMAND)
@@ -241,33 +458,189 @@ class Camera:
     
     # get the binary packet to send for this command
     command_packet = commands.commands[command_name]["command_packet"](args)
+    
+    # get the function to process the return value, if there is one
+    process_return_value = commands.commands[command_name].get("process_return_value")
+    
+    # get the retransmit policy
+    command_class = classify(command_name, args, message_type_value)
+    if timeout is None:
+      timeout = retransmit_policies[command_class].timeout
+    
+    open_command = self.open_commands.create(command_name, message_type_value, command_packet,
+                                             process_return_value, timeout)
+    open_command.command_class = command_class
+    open_command.axis_group = axis_groups.get(command_name)
+    open_command.retries = retransmit_policies[command_class].retries
+    open_command.priority = command_class_priorities[command_class] if priority is None else priority
+    axis_group = open_command.axis_group
+    ticket = None
 
-    self.open_commands[self.sequence_no] = {
-      "command_packet": command_packet,
-      "command_name": command_name,
-      "command_type": message_type_value,
-      "result": None,
-    }
-    
-    # if there is a function to process the return value, add it to the open_commands queue
-    if "process_return_value" in commands.commands[command_name]:
-      if commands.commands[command_name]["process_return_value"]:
-        self.open_commands[self.sequence_no]["process_return_value"] = commands.commands[command_name]["process_return_value"]
+    with self.send_lock:
+      if command_class == "drive":
+        self.release_lost_drive(axis_group)
         
+        # queue continuous motion behind the unacknowledged one of the same axis group, or while no socket is free
+        in_flight = self.latest_commands.get(axis_group)
+        if (in_flight is not None and in_flight.command_class == "drive" and not in_flight.acknowledged.is_set()) \
+            or axis_group in self.coalesced_commands or not self.scheduler.can_admit(open_command):
+          superseded = self.coalesced_commands.get(axis_group)
+          self.coalesced_commands[axis_group] = open_command
+          if superseded is not None:
+            superseded.complete(SUPERSEDED)
+          ticket = self.open_commands.enqueue(open_command)
+      
+      else:
+        # a stop supersedes the queued continuous motion
+        if axis_group is not None:
+          superseded = self.coalesced_commands.pop(axis_group, None)
+          if superseded is not None:
+            superseded.complete(SUPERSEDED)
+        
+        # queue the command if it does not get a socket or commands of the same or a higher priority are waiting
+        if self.scheduler.has_queued(open_command.priority) or not self.scheduler.can_admit(open_command):
+          self.scheduler.enqueue(open_command)
+          ticket = self.open_commands.enqueue(open_command)
+      
+      if ticket is None:
+        retransmit_at = self.transmit(open_command)
+    
+    # a queued command is sent by the receive thread, which may be blocked without a deadline
+    if ticket is not None:
+      self.wakeup_sender.send(b"\0")
+      return ticket
+    
+    # wake up the receive thread, if it would not wake up before the deadline of the new command
+    receive_deadline = self.receive_deadline
+    if receive_deadline is None or retransmit_at < receive_deadline:
+      self.wakeup_sender.send(b"\0")
+    return open_command.first_sequence_no
+  
+  def transmit(self, open_command):
+    """
+    Store the open command record with the next sequence number and send the message, the caller has to hold the send_lock.
+    :return: the time at which the command is retransmitted if there is no reply
+    """
+    self.open_commands.add(self.sequence_no, open_command)
+    commands_sent.inc(self.ip_address, open_command.command_name)
+    open_command.sent_time = time.monotonic()
+    retransmit_at = open_command.sent_time + retransmit_policies[open_command.command_class].reply_timeout
+    open_command.retransmit_at = retransmit_at
+    self.scheduler.on_transmit(open_command)
+    
+    # continuous motion and stop commands supersede the previous ones of the same axis group
+    if open_command.axis_group is not None:
+      self.latest_commands[open_command.axis_group] = open_command
+      
     # debugging output
-    print("[{:%M:%S}] > send command \"{}\", seq. no. {}".format(
-      datetime.datetime.now(), command_name, self.sequence_no))
+    packet_logger.debug("> send command \"%s\", seq. no. %s", open_command.command_name, self.sequence_no)
     
     # send actual message
-    return self.send_message(message_type_value, command_packet)
+    self.send_message(open_command.command_type, open_command.command_packet)
+    return retransmit_at
+  
+  def dispatch_queued_commands(self):
+    """
+    Send the queued commands that can be sent now: first the continuous motion commands whose axis group
+    has no unacknowledged drive command anymore, then the commands queued by the scheduler.
+    Queued commands whose deadline has passed are completed with TIMEOUT.
+    """
+    if not self.coalesced_commands and not len(self.scheduler):
+      return
+    now = time.monotonic()
+    with self.send_lock:
+      for axis_group in list(self.coalesced_commands):
+        open_command = self.coalesced_commands[axis_group]
+        if open_command.deadline <= now:
+          del self.coalesced_commands[axis_group]
+          self.open_commands.time_out(open_command)
+          continue
+        in_flight = self.latest_commands.get(axis_group)
+        if (in_flight is None or in_flight is open_command or in_flight.acknowledged.is_set()) \
+            and self.scheduler.can_admit(open_command):
+          del self.coalesced_commands[axis_group]
+          self.transmit(open_command)
+      
+      for open_command in self.scheduler.admissible():
+        if open_command.completed.is_set():
+          continue
+        if open_command.deadline <= now:
+          self.open_commands.time_out(open_command)
+          continue
+        self.transmit(open_command)
     
   def get_result(self, sequence_no):
-    return self.open_commands[sequence_no]["result"]
+    """
+    :return: the result of the command, None if it is still pending or has been evicted, TIMEOUT if it timed out
+    """
+    open_command = self.open_commands.get(sequence_no)
+    if open_command is None:
+      return None
+    return open_command.result
+    
+  def wait_for_ack(self, sequence_no, timeout=None):
+    """
+    Block until the camera has acknowledged the command with the given sequence number.
+    :param timeout: maximum time in seconds to wait, None waits until the deadline of the command
+    :return: True if the command was acknowledged (or already completed), False on timeout
+    """
+    open_command = self.open_commands.get(sequence_no)
+    if open_command is None:
+      return False
+    return open_command.acknowledged.wait(timeout)
+    
+  def wait_for_result(self, sequence_no, timeout=None):
+    """
+    Block until the command with the given sequence number has completed, failed or timed out.
+    :param timeout: maximum time in seconds to wait, None waits until the deadline of the command
+    :return: the processed result, TIMEOUT if the deadline of the command has passed,
+             None if the timeout elapsed before, the command failed or the return value could not be processed
+    """
+    open_command = self.open_commands.get(sequence_no)
+    if open_command is None:
+      return None
+    open_command.completed.wait(timeout)
+    return open_command.result
     
-  def wait_for_result(self, sequence_no):
-    while self.open_commands[sequence_no]["result"] is None:
-      time.sleep(0.001)
-    return self.open_commands[sequence_no]["result"]
+  def get_pose(self, max_age=0.0, timeout=None):
+    """
+    Get the current pan, tilt and zoom position of the camera.
+    Both inquiries are sent at once, concurrent callers share the inquiry that is already in flight,
+    and a cached pose is returned if it is recent enough.
+    :param max_age: maximum age in seconds of a cached pose, 0 always asks the camera
+    :param timeout: maximum time in seconds to wait for the replies, None waits until the deadline of the inquiries
+    :return: tuple (x, y, zoom) with x,y in [-1,1] and zoom in [0,1], None if the camera did not reply
+    """
+    with self.pose_lock:
+      if self.pose is not None and time.monotonic() - self.pose_time <= max_age:
+        return self.pose
+      
+      # send the inquiries, unless another thread already did
+      if self.pose_inquiry is None:
+        request_time = time.monotonic()
+        pan_tilt_inquiry = self.open_commands.get(self.send_command("Pan-tiltPosInq"))
+        zoom_inquiry = self.open_commands.get(self.send_command("CAM_OpticalZoomPosInq"))
+        self.pose_inquiry = (pan_tilt_inquiry, zoom_inquiry, request_time)
+      pose_inquiry = self.pose_inquiry
+    
+    pan_tilt_inquiry, zoom_inquiry, request_time = pose_inquiry
+    if not pan_tilt_inquiry.completed.wait(timeout) or not zoom_inquiry.completed.wait(timeout):
+      return None
+    pos_xy = pan_tilt_inquiry.result
+    pos_zoom = zoom_inquiry.result
+    is_valid = bool(pos_xy) and pos_zoom is not None and pos_zoom is not TIMEOUT
+    
+    with self.pose_lock:
+      # the first caller that sees the replies stores them, the pose is as old as the inquiry
+      if self.pose_inquiry is pose_inquiry:
+        self.pose_inquiry = None
+        if is_valid:
+          self.pose = (pos_xy[0], pos_xy[1], pos_zoom)
+          self.pose_time = request_time
+    
+    if not is_valid:
+      return None
+    return (pos_xy[0], pos_xy[1], pos_zoom)
     
 if __name__ == "__main__":
 
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+# module that interfaces several PTZ cameras over one socket and one receive thread
+
+import collections
+import socket
+import selectors
+import time
+import threading
+from reply_framer import *
+from camera import Camera
+import capture
+import sys
+sys.path.append('..')
+import globals
+import log
+import runtime
+
+logger = log.get_logger("camera")
+
+class CameraGroup:
+  """
+  Drives several cameras from one UDP socket and one receive thread.
+  Every camera keeps its own sequence numbers, open commands and scheduler, the replies are
+  passed to the camera whose address they came from. Adding cameras does not add threads.
+  """
+  def __init__(self, ip_addresses, port=52381, open_commands_capacity=256, sockets=2):
+    """
+    :param ip_addresses: list of IP addresses, or (IP address, port) tuples, of the cameras
+    :param port: VISCA-over-IP port of the cameras that are given without port
+    """
+    # open socket for UDP communication with all cameras
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.socket.setblocking(False)
+
+    # socket pair to wake up the receive thread on close() or when an earlier deadline was added
+    self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+    self.wakeup_receiver.setblocking(False)
+    self.is_running = True
+
+    # function that is called with the error when the receive loop gives up, see receive_loop()
+    self.on_failure = None
+
+    self.selector = selectors.DefaultSelector()
+    self.selector.register(self.socket, selectors.EVENT_READ)
+    self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+
+    # cameras in the given order and by the source address of their replies
+    self.cameras = []
+    self.cameras_by_address = {}
+    for ip_address in ip_addresses:
+      camera_port = port
+      if isinstance(ip_address, tuple):
+        ip_address, camera_port = ip_address
+      camera = Camera(ip_address, camera_port, open_commands_capacity, sockets, group=self)
+      self.cameras.append(camera)
+      self.cameras_by_address[(socket.gethostbyname(ip_address), camera_port)] = camera
+
+    # start receive thread
+    self.receiving_thread = threading.Thread(target=self.receive_loop, daemon=True)
+    self.receiving_thread.start()
+
+  def __len__(self):
+    return len(self.cameras)
+
+  def __getitem__(self, index):
+    return self.cameras[index]
+
+  def __iter__(self):
+    return iter(self.cameras)
+
+  def close(self):
+    """
+    Stop the receive thread and close the socket of all cameras.
+    """
+    for camera in self.cameras:
+      camera.close()
+    self.is_running = False
+    self.wakeup_sender.send(b"\0")
+    self.receiving_thread.join()
+    self.selector.close()
+    self.socket.close()
+    self.wakeup_receiver.close()
+    self.wakeup_sender.close()
+
+  def receive_loop(self, max_errors=10, error_window=1.0):
+    """
+    Receive and dispatch the replies until close(). The loop gives up after max_errors errors within
+    error_window seconds, e.g. of a broken socket, instead of spinning, so that it can be restarted.
+    """
+    framer = ReplyFramer()
+    error_times = collections.deque(maxlen=max_errors)
+
+    while self.is_running:
+      try:
+        # service all cameras, then block until a reply arrives or the earliest deadline of any camera
+        time_to_next_deadline = None
+        for camera in self.cameras:
+          time_to_camera_deadline = camera.service()
+          if time_to_camera_deadline is not None and (time_to_next_deadline is None or time_to_camera_deadline < time_to_next_deadline):
+            time_to_next_deadline = time_to_camera_deadline
+        if time_to_next_deadline == 0:
+          continue
+
+        receive_deadline = None
+        if time_to_next_deadline is not None:
+          receive_deadline = time.monotonic() + time_to_next_deadline
+        for camera in self.cameras:
+          camera.receive_deadline = receive_deadline
+        ready = [key.fileobj for key, mask in self.selector.select(time_to_next_deadline)]
+
+        # drain the wakeup socket
+        if self.wakeup_receiver in ready:
+          self.wakeup_receiver.recv(4096)
+        if self.socket not in ready:
+          continue
+
+        # receive UDP message and pass the replies to the camera that sent it
+        address, replies = framer.receive_from(self.socket)
+        camera = self.cameras_by_address.get(address)
+        if camera is None:
+          logger.warning("Reply from unknown address %s:%s", *address)
+          continue
+        capture_writer = camera.capture
+        if capture_writer is not None:
+          capture_writer.record(capture.RECEIVED, camera.capture_address, framer.view[:framer.nbytes])
+        for payload_type, sequence_no, payload, payload_message in replies:
+          camera.handle_reply(payload_type, sequence_no, payload, payload_message)
+
+      # if the datagram was consumed already, continue
+      except BlockingIOError:
+        continue
+
+      # if there was a different error, log stacktrace
+      except:
+        logger.exception("error in the receive loop")
+        error_times.append(time.monotonic())
+        if len(error_times) == max_errors and error_times[-1] - error_times[0] < error_window:
+          logger.error("%s errors in %.3f s, stopping the receive loop", max_errors, error_times[-1] - error_times[0])
+          if self.on_failure is not None:
+            self.on_failure(sys.exc_info()[1])
+          return
+
+  def send_command_all(self, command_name, *args, timeout=None, priority=None):
+    """
+    Send the same command to all cameras in one pass, e.g. Tally_Mode or Pan-tiltDrive_Home.
+    See Camera.send_command for the parameters.
+    :return: list of the sequence numbers (or ticket numbers) of the command, in the order of the cameras
+    """
+    return [camera.send_command(command_name, *args, timeout=timeout, priority=priority) for camera in self.cameras]
+
+  def wait_for_result_all(self, sequence_nos, timeout=None):
+    """
+    Block until the commands returned by send_command_all have completed, failed or timed out.
+    :param timeout: maximum time in seconds to wait for all commands together, None waits until their deadlines
+    :return: list of the results, in the order of the cameras
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    results = []
+    for camera, sequence_no in zip(self.cameras, sequence_nos):
+      remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+      results.append(camera.wait_for_result(sequence_no, remaining))
+    return results
+
+class CameraGroupComponent(runtime.Component):
+  """
+  The cameras of a CameraGroup for runtime.Runtime. A restart creates a new CameraGroup with new sockets
+  and a new receive thread, the components that require it get the new cameras from group.
+  """
+  def __init__(self, ip_addresses, name="cameras"):
+    super().__init__(name)
+    self.ip_addresses = list(ip_addresses)
+    self.group = None
+
+  def start(self):
+    self.group = CameraGroup(self.ip_addresses)
+    self.group.on_failure = self.report_fault
+
+  def stop(self):
+    self.group.close()
+    self.group = None
+
+  def is_healthy(self):
+    return self.group is not None and self.group.receiving_thread.is_alive()
+
+if __name__ == "__main__":
+
+  group = CameraGroup(globals.ptz_camera_ip_addresses)
+
+  # set the tally mode and move all cameras to their home position
+  group.wait_for_result_all(group.send_command_all("Tally_Mode"))
+  results = group.wait_for_result_all(group.send_command_all("Pan-tiltDrive_Home"))
+  print("home: {}".format(results))
+
+  for camera in group:
+    print("{}: {}".format(camera.ip_address, camera.get_pose()))
+
+  group.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+# module that records VISCA-over-IP traffic to a binary capture file and replays it
+
+import collections
+import datetime
+import heapq
+import selectors
+import socket
+import struct
+import threading
+import time
+from reply_framer import *
+
+# the file starts with the magic, the format version, the wall clock time and the monotonic time at its creation
+file_magic = b"VISCACAP"
+file_header_struct = struct.Struct("<8sBdd")
+file_version = 1
+
+# each record: monotonic time, direction, IPv4 address and port of the camera, sequence number, length of the datagram,
+# followed by the datagram with its VISCA-over-IP header
+record_header_struct = struct.Struct("<dB4sHIH")
+
+SENT = 0
+RECEIVED = 1
+
+Record = collections.namedtuple("Record", ["time", "direction", "address", "sequence_no", "datagram"])
+
+class CaptureWriter:
+  """
+  Writer of a capture file, an existing file is replaced, because the record times are relative to the one
+  header of the file. The records go through a large write buffer, so recording a datagram costs one
+  struct.pack and one buffered write, the file is only written when the buffer is full.
+  Records after close() are dropped, so a thread can record while another one stops the capture.
+  """
+  def __init__(self, path, buffer_size=1 << 16):
+    self.path = path
+    self.lock = threading.Lock()
+    self.file = open(path, "wb", buffering=buffer_size)
+    self.file.write(file_header_struct.pack(file_magic, file_version, time.time(), time.monotonic()))
+
+  def record(self, direction, address, datagram):
+    """
+    Append a sent or received datagram.
+    :param direction: SENT or RECEIVED
+    :param address: tuple (IPv4 address, port) of the camera
+    """
+    sequence_no = int.from_bytes(datagram[4:8], "big") if len(datagram) >= 8 else 0
+    record = record_header_struct.pack(time.monotonic(), direction, socket.inet_aton(address[0]), address[1],
+                                       sequence_no, len(datagram)) + datagram
+    with self.lock:
+      if not self.file.closed:
+        self.file.write(record)
+
+  def flush(self):
+    with self.lock:
+      if not self.file.closed:
+        self.file.flush()
+
+  def close(self):
+    with self.lock:
+      self.file.close()
+
+def read_capture(path):
+  """
+  Read the records of a capture file.
+  :return: tuple (wall clock time of the start of the capture, list of Record), the record times are in seconds since the start
+  """
+  with open(path, "rb") as f:
+    data = f.read()
+  magic, version, start_wall_time, start_time = file_header_struct.unpack_from(data)
+  if magic != file_magic or version != file_version:
+    raise ValueError("{} is not a VISCA capture file of version {}".format(path, file_version))
+
+  records = []
+  position = file_header_struct.size
+  while position + record_header_struct.size <= len(data):
+    t, direction, ip_address, port, sequence_no, length = record_header_struct.unpack_from(data, position)
+    position += record_header_struct.size
+    datagram = data[position:position+length]
+    position += length
+    records.append(Record(t - start_time, direction, (socket.inet_ntoa(ip_address), port), sequence_no, datagram))
+  return start_wall_time, records
+
+def replay_parse(records, speed=None):
+  """
+  Feed the received datagrams of a capture through the reply parser.
+  :param speed: 1 replays with the recorded timing, 2 twice as fast etc., None as fast as possible
+  :return: tuple (number of datagrams, number of replies, seconds spent in the parser)
+  """
+  framer = ReplyFramer()
+  datagrams = 0
+  replies = 0
+  parse_time = 0.0
+  start = time.monotonic()
+  for record in records:
+    if record.direction != RECEIVED:
+      continue
+    if speed is not None:
+      delay = start + record.time / speed - time.monotonic()
+      if delay > 0:
+        time.sleep(delay)
+    t = time.perf_counter()
+    replies += len(framer.parse(record.datagram))
+    parse_time += time.perf_counter() - t
+    datagrams += 1
+  return datagrams, replies, parse_time
+
+class ReplayCamera:
+  """
+  Fake camera that answers with the replies of a capture: every received message is matched with the next
+  recorded message of the same payload, and the replies that were recorded for it are sent back with the
+  sequence number of the received message, with their recorded delays divided by speed (None sends them at once).
+  Messages that do not occur in the capture anymore are not answered.
+  """
+  def __init__(self, records, host="127.0.0.1", port=52381, speed=1.0):
+    self.speed = speed
+
+    # recorded sent messages with their replies and the delay of each reply
+    self.exchanges = []
+    pending = {}
+    for record in records:
+      if record.direction == SENT:
+        exchange = (record.datagram[:2], record.datagram[8:], [])
+        self.exchanges.append(exchange)
+        pending[record.sequence_no] = (record.time, exchange)
+      elif record.sequence_no in pending:
+        sent_time, exchange = pending[record.sequence_no]
+        exchange[2].append((record.time - sent_time, record.datagram))
+    self.position = 0
+
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.socket.bind((host, port))
+    self.address = self.socket.getsockname()
+    self.outgoing = []
+    self.outgoing_counter = 0
+
+  def find_exchange(self, datagram):
+    """
+    :return: the next recorded exchange whose message equals the datagram (without sequence number), None if there is none
+    """
+    for index in range(self.position, len(self.exchanges)):
+      payload_type, payload, replies = self.exchanges[index]
+      if payload_type == datagram[:2] and payload == datagram[8:]:
+        self.position = index + 1
+        return replies
+    return None
+
+  def serve_forever(self):
+    selector = selectors.DefaultSelector()
+    selector.register(self.socket, selectors.EVENT_READ)
+    while True:
+      timeout = None
+      if self.outgoing:
+        timeout = max(self.outgoing[0][0] - time.monotonic(), 0)
+      if selector.select(timeout):
+        datagram, address = self.socket.recvfrom(4096)
+        replies = self.find_exchange(datagram)
+        for delay, reply in replies or ():
+          due = time.monotonic() + (0 if self.speed is None else delay / self.speed)
+          heapq.heappush(self.outgoing, (due, self.outgoing_counter, reply[:4] + datagram[4:8] + reply[8:], address))
+          self.outgoing_counter += 1
+
+      while self.outgoing and self.outgoing[0][0] <= time.monotonic():
+        due, counter, reply, address = heapq.heappop(self.outgoing)
+        self.socket.sendto(reply, address)
+
+def summary(records):
+  """
+  :return: dict with the number of sent and received datagrams and replies by description
+  """
+  framer = ReplyFramer()
+  replies = collections.Counter()
+  for record in records:
+    if record.direction == RECEIVED:
+      for payload_type, sequence_no, payload, payload_message in framer.parse(record.datagram):
+        replies[payload_message or payload.hex()] += 1
+  return {
+    "sent": sum(1 for record in records if record.direction == SENT),
+    "received": sum(1 for record in records if record.direction == RECEIVED),
+    "seconds": records[-1].time - records[0].time if records else 0,
+    "replies": dict(replies),
+  }
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="Replay of VISCA-over-IP capture files")
+  parser.add_argument("mode", choices=["info", "parse", "serve"],
+                      help="info: summary of the capture, parse: feed the replies through the parser, serve: act as the recorded camera")
+  parser.add_argument("path", help="capture file written by Camera.start_capture")
+  parser.add_argument("--speed", type=float, default=None, help="replay speed, 1 is the recorded timing, default is as fast as possible")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=52381)
+  args = parser.parse_args()
+
+  start_wall_time, records = read_capture(args.path)
+  print("capture of {:%Y-%m-%d %H:%M:%S} with {} records".format(
+    datetime.datetime.fromtimestamp(start_wall_time), len(records)))
+
+  if args.mode == "info":
+    print(summary(records))
+  elif args.mode == "parse":
+    datagrams, replies, parse_time = replay_parse(records, args.speed)
+    print("parsed {} datagrams with {} replies in {:.6f} s, {:.2f} us per datagram".format(
+      datagrams, replies, parse_time, parse_time / max(datagrams, 1) * 1e6))
+  else:
+    replay_camera = ReplayCamera(records, args.host, args.port, args.speed)
+    print("replaying camera on {}:{}".format(*replay_camera.address))
+    replay_camera.serve_forever()
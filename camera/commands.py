@@ -1,23 +1,105 @@
+from message_type import *
+import functools
+import struct
 
+def constant_packet(hex_string):
+  """
+  Compile a command without arguments once, the returned function hands out the prebuilt packet.
+  """
+  packet = bytes.fromhex(hex_string)
+  return lambda *args: packet
 
-from message_type import *
+# binary layouts of the packets with arguments, positions are sent as four nibbles 0p 0q 0r 0s
+zoom_direct_struct = struct.Struct('>9B')
+zoom_direct_speed_struct = struct.Struct('>10B')
+pan_tilt_drive_struct = struct.Struct('>9B')
+pan_tilt_absolute_relative_struct = struct.Struct('>15B')
+
+def encode_nibbles(value):
+  """
+  Encode a 16 bit value as the four nibbles 0p 0q 0r 0s.
+  """
+  return bytes((value >> 12, (value >> 8) & 0x0F, (value >> 4) & 0x0F, value & 0x0F))
+
+def decode_nibbles(data, start):
+  """
+  Decode a 16 bit value that is sent as the four nibbles 0p 0q 0r 0s.
+  """
+  return (data[start] & 0x0F) << 12 | (data[start+1] & 0x0F) << 8 | (data[start+2] & 0x0F) << 4 | (data[start+3] & 0x0F)
+
+# conversion of the pan and tilt positions in [-1,1] to the 16 bit values of the camera and back,
+# the positive and negative ranges have different limits
+def encode_pan(x):
+  if x > 0:
+    return (int)(x*0x6A40)
+  return (int)(0x95C0 + (-x)*(0xFFFF-0x95C0))
+
+def decode_pan(value):
+  if value <= 0x6A40:
+    return value / 0x6A40
+  return -(value - 0x95C0) / (0xFFFF - 0x95C0)
+
+def encode_tilt(y):
+  if y > 0:
+    return (int)(y*0x3840)
+  return (int)(0xED40 + (-y)*(0xFFFF-0xED40))
+
+def decode_tilt(value):
+  if value <= 0x3840:
+    return value / 0x3840
+  return -(value - 0xED40) / (0xFFFF - 0xED40)
+
+def check_range(value, maximum):
+  """
+  Raise a ValueError if a quantized argument does not fit into its field of the packet.
+  """
+  if not 0 <= value <= maximum:
+    raise ValueError("value {} is out of range [0,{}]".format(value, maximum))
 
 def zoom_direct(args):
-  f = args[0]
-  b = int.to_bytes((int)(args[0]*16384), length=2, byteorder='big')
-  return bytearray.fromhex('81 01 04 47 0{} 0{} 0{} 0{} FF'.format(b.hex()[0], b.hex()[1], b.hex()[2], b.hex()[3]))
+  z = (int)(args[0]*16384)
+  check_range(z, 0xFFFF)
+  return zoom_direct_struct.pack(0x81, 0x01, 0x04, 0x47, z >> 12, (z >> 8) & 0x0F, (z >> 4) & 0x0F, z & 0x0F, 0xFF)
 
 def zoom_direct_speed(args):
   f = args[0]
   speed = (int)(args[1]*7)
-  b = int.to_bytes((int)(f*16384), length=2, byteorder='big')
-  return bytearray.fromhex('81 01 04 47 0{} 0{} 0{} 0{} 0{} FF'.format(b.hex()[0], b.hex()[1], b.hex()[2], b.hex()[3], speed))
+  z = (int)(f*16384)
+  check_range(z, 0xFFFF)
+  check_range(speed, 7)
+  return zoom_direct_speed_struct.pack(0x81, 0x01, 0x04, 0x47, z >> 12, (z >> 8) & 0x0F, (z >> 4) & 0x0F, z & 0x0F, speed, 0xFF)
+
+# CAM_Zoom_Tele_Variable and CAM_Zoom_Wide_Variable for the speeds p=0 to 7
+zoom_tele_variable_packets = [bytes((0x81, 0x01, 0x04, 0x07, 0x20 | p, 0xFF)) for p in range(8)]
+zoom_wide_variable_packets = [bytes((0x81, 0x01, 0x04, 0x07, 0x30 | p, 0xFF)) for p in range(8)]
 
 def zoom_tele_variable(args):
-  return bytearray.fromhex('81 01 04 07 2{} FF'.format(args[0]))
+  check_range(args[0], 7)
+  return zoom_tele_variable_packets[args[0]]
 
 def zoom_wide_variable(args):
-  return bytearray.fromhex('81 01 04 07 3{} FF'.format(args[0]))
+  check_range(args[0], 7)
+  return zoom_wide_variable_packets[args[0]]
+
+# direction bytes of Pan-tiltDrive for (x,y), all other combinations stop
+pan_tilt_directions = {
+  (0, 1): (0x03, 0x01),   # up
+  (0, -1): (0x03, 0x02),  # down
+  (-1, 0): (0x01, 0x03),  # left
+  (1, 0): (0x02, 0x03),   # right
+  (-1, 1): (0x01, 0x01),  # up left
+  (1, 1): (0x02, 0x01),   # up right
+  (-1, -1): (0x01, 0x02), # down left
+  (1, -1): (0x02, 0x02),  # down right
+}
+
+@functools.lru_cache(maxsize=1024)
+def pan_tilt_drive_packet(direction0, direction1, speed_x, speed_y):
+  """
+  Pan-tiltDrive packet for already quantized arguments, cached because a drive stream
+  only uses a few different speeds.
+  """
+  return pan_tilt_drive_struct.pack(0x81, 0x01, 0x06, 0x01, speed_x, speed_y, direction0, direction1, 0xFF)
 
 def pan_tilt_drive(args):
   """
@@ -25,34 +107,8 @@ def pan_tilt_drive(args):
   speed vx,vy in [0,1], (vx,vy)=(0,0) equals stop
   """
   x,y,vx,vy = args
-  
-  direction0 = None
-  direction1 = None
-  if x == 0 and y == 1:  # up
-    direction0, direction1 = "3", "1"
-  elif x == 0 and y == -1:  # down
-    direction0, direction1 = "3", "2"
-  elif x == -1 and y == 0:  # left
-    direction0, direction1 = "1", "3"
-  elif x == 1 and y == 0:  # right
-    direction0, direction1 = "2", "3"
-  elif x == -1 and y == 1:  # up left
-    direction0, direction1 = "1", "1"
-  elif x == 1 and y == 1:  # up right
-    direction0, direction1 = "2", "1"
-  elif x == -1 and y == -1:  # down left
-    direction0, direction1 = "1", "2"
-  elif x == 1 and y == -1:  # down right
-    direction0, direction1 = "2", "2"
-  else: # stop
-    direction0, direction1 = "3", "3"
-
-  # speed
-  vx_binary = int.to_bytes((int)(vx*0x18), length=1, byteorder='big')
-  vy_binary = int.to_bytes((int)(vy*0x18), length=1, byteorder='big')
-  
-  return bytearray.fromhex('81 01 06 01 {} {} 0{} 0{} FF'.format(
-    vx_binary.hex(), vy_binary.hex(), direction0, direction1))
+  direction0, direction1 = pan_tilt_directions.get((x, y), (0x03, 0x03))
+  return pan_tilt_drive_packet(direction0, direction1, (int)(vx*0x18), (int)(vy*0x18))
 
 def pan_tilt_absolute(args):
   return pan_tilt_absolute_relative(args, True)
@@ -68,96 +124,67 @@ def pan_tilt_absolute_relative(args, is_absolute):
   x,y,vx,vy = args
   
   if is_absolute:
-    relative_absolute_digit = "2"
+    relative_absolute_digit = 0x02
   else:
-    relative_absolute_digit = "3"
+    relative_absolute_digit = 0x03
   
-  # speed
-  vx_binary = int.to_bytes((int)(vx*0x18), length=1, byteorder='big')
-  vy_binary = int.to_bytes((int)(vy*0x18), length=1, byteorder='big')
+  pos_x = encode_pan(x)
+  pos_y = encode_tilt(y)
+  check_range(pos_x, 0xFFFF)
+  check_range(pos_y, 0xFFFF)
   
-  # x position (pan)
-  if x > 0:
-    pos_x = int.to_bytes((int)(x*0x6A40), length=2, byteorder='big')
-  else:
-    pos_x = int.to_bytes((int)(0x95C0 + (-x)*(0xFFFF-0x95C0)), 
-                         length=2, byteorder='big')
-
-  # y position (tilt)
-  if y > 0:
-    pos_y = int.to_bytes((int)(y*0x3840), length=2, byteorder='big')
-  else:
-    pos_y = int.to_bytes((int)(0xED40 + (-y)*(0xFFFF-0xED40)), 
-                         length=2, byteorder='big')
-
-  return bytearray.fromhex('81 01 06 0{} {} {} 0{} 0{} 0{} 0{} 0{} 0{} 0{} 0{} FF'.format(
-    relative_absolute_digit, vx_binary.hex(), vy_binary.hex(), 
-    pos_x.hex()[0], pos_x.hex()[1], pos_x.hex()[2], pos_x.hex()[3], 
-    pos_y.hex()[0], pos_y.hex()[1], pos_y.hex()[2], pos_y.hex()[3]))
+  return pan_tilt_absolute_relative_struct.pack(
+    0x81, 0x01, 0x06, relative_absolute_digit, (int)(vx*0x18), (int)(vy*0x18),
+    pos_x >> 12, (pos_x >> 8) & 0x0F, (pos_x >> 4) & 0x0F, pos_x & 0x0F,
+    pos_y >> 12, (pos_y >> 8) & 0x0F, (pos_y >> 4) & 0x0F, pos_y & 0x0F, 0xFF)
 
 def get_optical_zoom_position(data):
-  data = data.hex()
-  print('get {}{}{}{}'.format(data[5], data[7], data[9], data[11]))
-  zoom_bytes = bytes.fromhex('{}{}{}{}'.format(data[5], data[7], data[9], data[11]))
-  return int.from_bytes(zoom_bytes, byteorder="big") / 0x4000
+  """
+  Zoom position of the reply 90 50 0p 0q 0r 0s FF, in [0,1].
+  """
+  return decode_nibbles(data, 2) / 0x4000
 
 def get_xy_position(data):
-  data = data.hex()
-  #print("data in get_xy_position: {}".format(data))
-  
-  # x position (pan)
-  x_bytes = bytes.fromhex('{}{}{}{}'.format(data[5], data[7], data[9], data[11]))
-  x_int = int.from_bytes(x_bytes, byteorder="big")
-  
-  x_pos = 0
-  if x_int <= 0x6A40:
-    x_pos = x_int / 0x6A40
-  else:
-    x_pos = -(x_int - 0x95C0) / (0xFFFF - 0x95C0)
-  
-  #print("  -> x: {}{} {}{}  ->  {}  ->  {}  ->  {}".format(data[2], data[3], data[4], data[5], x_bytes.hex(), x_int, x_pos))
-  
-  # y position (tilt)
-  y_bytes = bytes.fromhex('{}{} {}{}'.format(data[13], data[15], data[17], data[19]))
-  y_int = int.from_bytes(y_bytes, byteorder="big")
-  
-  y_pos = 0
-  if y_int <= 0x3840:
-    y_pos = y_int / 0x3840
-  else:
-    y_pos = -(y_int - 0xED40) / (0xFFFF - 0xED40)
-    
-  return (x_pos, y_pos)
+  """
+  Pan and tilt position of the reply 90 50 0w 0w 0w 0w 0z 0z 0z 0z FF, in [-1,1].
+  """
+  return (decode_pan(decode_nibbles(data, 2)), decode_tilt(decode_nibbles(data, 6)))
+
+tally_on_packet = bytes.fromhex('81 01 7E 01 0A 00 02 FF')
+tally_off_packet = bytes.fromhex('81 01 7E 01 0A 00 03 FF')
 
 def tally(args):
   if args[0]:
-    return bytearray.fromhex('81 01 7E 01 0A 00 02 FF')
+    return tally_on_packet
   else:    
-    return bytearray.fromhex('81 01 7E 01 0A 00 03 FF')
+    return tally_off_packet
+
+power_on_packet = bytes.fromhex('81 01 04 00 02 FF')
+power_off_packet = bytes.fromhex('81 01 04 00 03 FF')
 
 commands = {
   # VISCA inquiries
   "CAM_PowerInq": {
     "message_type": MessageType.VISCA_INQUIRY,
-    "command_packet": lambda *args: bytearray.fromhex('81 09 04 00 FF'),
+    "command_packet": constant_packet('81 09 04 00 FF'),
     "process_return_value": lambda data: data[2] == 0x02,
   },
   
   "CAM_VersionInq": {
     "message_type": MessageType.VISCA_INQUIRY,
-    "command_packet": lambda *args: bytearray.fromhex('81 09 00 02 FF'),
+    "command_packet": constant_packet('81 09 00 02 FF'),
     "process_return_value": lambda data: None,
   },
   
   "CAM_OpticalZoomPosInq": {
     "message_type": MessageType.VISCA_INQUIRY,
-    "command_packet": lambda *args: bytearray.fromhex('81 09 04 47 FF'),
+    "command_packet": constant_packet('81 09 04 47 FF'),
     "process_return_value": get_optical_zoom_position,
   },
   
   "Pan-tiltPosInq": {
     "message_type": MessageType.VISCA_INQUIRY,
-    "command_packet": lambda *args: bytearray.fromhex('81 09 06 12 FF'),
+    "command_packet": constant_packet('81 09 06 12 FF'),
     "process_return_value": get_xy_position,
   },
   
@@ -165,37 +192,37 @@ commands = {
   # CAM_PowerOn(bool on)
   "CAM_PowerOn": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 04 00 02 FF') if args[0] else bytearray.fromhex('81 01 04 00 03 FF')
+    "command_packet": lambda args: power_on_packet if args[0] else power_off_packet
   },
   
   # CAM_Zoom_Stop
   "CAM_Zoom_Stop": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 04 07 00 FF')
+    "command_packet": constant_packet('81 01 04 07 00 FF')
   },
   
   # CAM_Zoom_Tele
   "CAM_Zoom_Tele": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 04 07 02 FF')
+    "command_packet": constant_packet('81 01 04 07 02 FF')
   },
   
   # CAM_Zoom_Wide
   "CAM_Zoom_Wide": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 04 07 03 FF')
+    "command_packet": constant_packet('81 01 04 07 03 FF')
   },
   
   # CAM_Zoom_Tele_Step
   "CAM_Zoom_Tele_Step": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 04 07 04 FF')
+    "command_packet": constant_packet('81 01 04 07 04 FF')
   },
   
   # CAM_Zoom_Wide_Step
   "CAM_Zoom_Wide_Step": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 04 07 05 FF')
+    "command_packet": constant_packet('81 01 04 07 05 FF')
   },
   
   # CAM_Zoom_Tele_Variable(int p), speed p=0 (Low) to 7 (High)
@@ -231,7 +258,7 @@ commands = {
   # Pan-tiltDrive_Stop
   "Pan-tiltDrive_Stop": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 06 01 0C 0C 03 03 FF')
+    "command_packet": constant_packet('81 01 06 01 0C 0C 03 03 FF')
   },
   
   # Pan-tiltDrive_relative(x,y,vx,vy), position x,y in [-1,1], speed vx,vy in [0,1]
@@ -248,20 +275,20 @@ commands = {
   # Pan-tiltDrive_Home
   "Pan-tiltDrive_Home": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 06 04 FF')
+    "command_packet": constant_packet('81 01 06 04 FF')
   },
   
   # Pan-tiltDrive_Reset
   "Pan-tiltDrive_Reset": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 06 05 FF')
+    "command_packet": constant_packet('81 01 06 05 FF')
   },
   
   # Tally mode
   # Pan-tiltDrive_Reset
   "Tally_Mode": {
     "message_type": MessageType.VISCA_COMMAND,
-    "command_packet": lambda *args: bytearray.fromhex('81 01 7E 01 0A 01 04 FF')
+    "command_packet": constant_packet('81 01 7E 01 0A 01 04 FF')
   },    
     
  # TallyOn 
@@ -270,3 +297,37 @@ commands = {
     "command_packet": tally,
   },
 }
+
+def benchmark(number=100000):
+  """
+  Measure the time per call, the fastest of three runs, of the packet builders of the commands that are sent at high rates
+  and of the decoders of the position inquiries.
+  :return: dict of the name of the command or decoder to the time per call in seconds
+  """
+  import timeit
+  
+  cases = [
+    ("Pan-tiltDrive", (1, -1, 0.5, 0.25)),
+    ("Pan-tiltDrive_Stop", ()),
+    ("Pan-tiltDrive_absolute", (-0.7, -0.1, 0.8, 0.8)),
+    ("CAM_Zoom_Direct_Speed", (0.3, 0.8)),
+    ("CAM_Zoom_Tele_Variable", (5,)),
+  ]
+  results = {}
+  
+  for command_name, args in cases:
+    command_packet = commands[command_name]["command_packet"]
+    results[command_name] = min(timeit.repeat(lambda: command_packet(args), number=number, repeat=3)) / number
+  
+  # replies of Pan-tiltPosInq and CAM_OpticalZoomPosInq
+  decoder_cases = [
+    ("get_xy_position", get_xy_position, bytes.fromhex('90 50 0F 0A 0B 0C 0F 0E 0D 0C FF')),
+    ("get_optical_zoom_position", get_optical_zoom_position, bytes.fromhex('90 50 01 02 03 04 FF')),
+  ]
+  for decoder_name, decoder, data in decoder_cases:
+    results[decoder_name] = min(timeit.repeat(lambda: decoder(data), number=number, repeat=3)) / number
+  return results
+
+if __name__ == "__main__":
+  for name, t in benchmark().items():
+    print("{:<26} {:6.2f} us/call".format(name, t*1e6))
@@ -9,3 +9,18 @@ class MessageType(Enum):
   CONTROL_COMMAND = auto(),
   CONTROL_REPLY = auto(),
   OTHER = auto()
+
+# payload type field of the VISCA-over-IP header for each type of sent message
+payload_types = {
+  MessageType.VISCA_COMMAND: bytes.fromhex('01 00'),
+  MessageType.VISCA_INQUIRY: bytes.fromhex('01 10'),
+  MessageType.VISCA_DEVICE_SETTING_COMMAND: bytes.fromhex('01 20'),
+  MessageType.CONTROL_COMMAND: bytes.fromhex('02 00'),
+}
+
+def compose_message(message_type, sequence_no, message_payload):
+  """
+  Prepend the 8 byte VISCA-over-IP header (payload type, payload length, sequence number) to a payload.
+  """
+  message_payload_type = payload_types.get(message_type, bytes.fromhex('00 00'))
+  return message_payload_type + len(message_payload).to_bytes(2, 'big') + sequence_no.to_bytes(4, 'big') + message_payload
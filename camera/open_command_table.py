@@ -0,0 +1,276 @@
+# module that keeps track of the commands that have been sent to the camera
+
+import threading
+import time
+import sys
+sys.path.append('..')
+import log
+import metrics
+
+logger = log.get_logger("camera")
+
+timeouts = metrics.Counter("camera_timeouts_total", "Commands that were not completed before their deadline", ("camera", "command"))
+
+class CommandStatus:
+  """
+  Type of the special results of commands that did not complete normally, e.g. TIMEOUT.
+  """
+  def __init__(self, name):
+    self.name = name
+
+  def __repr__(self):
+    return self.name
+
+  def __bool__(self):
+    return False
+
+# the command was not completed before its deadline
+TIMEOUT = CommandStatus("TIMEOUT")
+
+# the command was lost and a newer command of the same axis group was sent instead
+SUPERSEDED = CommandStatus("SUPERSEDED")
+
+class OpenCommand:
+  """
+  Record of one sent command, stored in the slot of its sequence number.
+  When the command is retransmitted, it gets a new sequence number but can still be found
+  by the sequence number that was returned to the caller (first_sequence_no).
+  Commands that are queued before they are sent have no sequence number yet, they are
+  found by a negative ticket number instead, which is their first_sequence_no.
+  """
+  __slots__ = ("sequence_no", "first_sequence_no", "command_name", "command_type", "command_packet",
+               "process_return_value", "payload", "payload_type", "payload_message", "result", "deadline",
+               "command_class", "axis_group", "priority", "retries", "retransmit_at", "sent_time", "acknowledged", "completed")
+
+  def __init__(self, sequence_no, command_name=None, command_type=None, command_packet=None,
+               process_return_value=None, deadline=None):
+    self.sequence_no = sequence_no
+    self.first_sequence_no = sequence_no
+    self.command_name = command_name
+    self.command_type = command_type
+    self.command_packet = command_packet
+    self.process_return_value = process_return_value
+    self.payload = None
+    self.payload_type = None
+    self.payload_message = ""
+    self.result = None
+    self.deadline = deadline
+    self.command_class = None
+    self.axis_group = None
+    self.priority = None
+    self.retries = 0
+    self.retransmit_at = None
+    self.sent_time = None
+    self.acknowledged = threading.Event()
+    self.completed = threading.Event()
+
+  def complete(self, result):
+    """
+    Store the final result and wake up all waiting threads.
+    """
+    self.result = result
+    self.acknowledged.set()
+    self.completed.set()
+
+class OpenCommandTable:
+  """
+  Fixed-capacity ring of OpenCommand records, indexed by sequence number modulo the capacity.
+  A record stays available after completion until its slot is reused, records whose deadline has passed
+  are completed with TIMEOUT. A record that is still pending when its slot is reused, e.g. of a long move,
+  is kept aside until it completes, so its command is neither completed early nor forgotten by the scheduler.
+  This keeps the memory bounded by the commands within their deadlines, no matter how many commands are sent.
+  """
+  def __init__(self, capacity=256, default_timeout=10.0, name=""):
+    """
+    :param name: name of the camera in the metrics
+    """
+    self.capacity = capacity
+    self.name = name
+    self.default_timeout = default_timeout
+    self.slots = [None] * capacity
+    self.ticket_slots = [None] * capacity
+    self.next_ticket = -1
+    self.pending = {}
+
+    # pending records whose slot has been reused, by their current and first sequence number
+    self.displaced = {}
+    self.lock = threading.Lock()
+
+  def create(self, command_name=None, command_type=None, command_packet=None,
+             process_return_value=None, timeout=None):
+    """
+    Create the record of a new command, which has no sequence number until it is stored.
+    :param timeout: time in seconds until the command is considered lost, None uses the default timeout
+    """
+    if timeout is None:
+      timeout = self.default_timeout
+    return OpenCommand(None, command_name, command_type, command_packet,
+                       process_return_value, time.monotonic() + timeout)
+
+  def add(self, sequence_no, open_command):
+    """
+    Store the record of a command that is sent with the given sequence number, evicting the
+    record that occupied its slot before.
+    """
+    open_command.sequence_no = sequence_no
+    if open_command.first_sequence_no is None:
+      open_command.first_sequence_no = sequence_no
+    evicted = self.store(open_command)
+    if evicted is not None:
+      self.time_out(evicted)
+    return open_command
+
+  def enqueue(self, open_command):
+    """
+    Give a record that is queued before it is sent a negative ticket number, so it can be found by get().
+    :return: the ticket number
+    """
+    with self.lock:
+      ticket = self.next_ticket
+      self.next_ticket -= 1
+      open_command.first_sequence_no = ticket
+      self.ticket_slots[-ticket % self.capacity] = open_command
+    return ticket
+
+  def store(self, open_command):
+    """
+    Put the record into the slot of its current sequence number and mark it as pending.
+    :return: the pending record that had to be evicted from the slot, None if there was none
+    """
+    with self.lock:
+      index = open_command.sequence_no % self.capacity
+      evicted = self.slots[index]
+      self.slots[index] = open_command
+      self.pending[open_command.sequence_no] = open_command
+
+      if evicted is None or evicted is open_command:
+        return None
+
+      # a command that is still running keeps its socket on the camera, it can be found until it completes
+      if self.pending.get(evicted.sequence_no) is evicted and evicted.deadline > time.monotonic():
+        self.displaced[evicted.sequence_no] = evicted
+        self.displaced[evicted.first_sequence_no] = evicted
+        return None
+
+      # the slot may only hold an alias of a retransmitted record, which is still pending under its new number
+      if evicted.sequence_no % self.capacity != index:
+        return None
+      if self.pending.get(evicted.sequence_no) is evicted:
+        del self.pending[evicted.sequence_no]
+      if evicted.completed.is_set():
+        return None
+      return evicted
+
+  def withdraw(self, open_command):
+    """
+    Stop tracking the deadline of a sent command, because it is queued to be sent again.
+    """
+    with self.lock:
+      if self.pending.get(open_command.sequence_no) is open_command:
+        del self.pending[open_command.sequence_no]
+
+  def rekey(self, open_command, sequence_no):
+    """
+    Move a pending record to a new sequence number, used for retransmissions.
+    """
+    self.withdraw(open_command)
+    open_command.sequence_no = sequence_no
+    evicted = self.store(open_command)
+    if evicted is not None:
+      self.time_out(evicted)
+
+  def get(self, sequence_no):
+    """
+    :return: the record of the sequence number (or ticket number), None if it is unknown or has been evicted
+    """
+    if sequence_no is None:
+      return None
+    if sequence_no < 0:
+      open_command = self.ticket_slots[-sequence_no % self.capacity]
+      if open_command is None or open_command.first_sequence_no != sequence_no:
+        return None
+      return open_command
+    open_command = self.slots[sequence_no % self.capacity]
+    if open_command is None or (open_command.sequence_no != sequence_no and open_command.first_sequence_no != sequence_no):
+      open_command = self.displaced.get(sequence_no) if self.displaced else None
+    return open_command
+
+  def complete(self, open_command, result):
+    """
+    Mark the command as completed with the given result, unless it has been completed before.
+    """
+    with self.lock:
+      if self.pending.get(open_command.sequence_no) is not open_command:
+        return
+      del self.pending[open_command.sequence_no]
+    open_command.complete(result)
+
+  def time_out(self, open_command):
+    """
+    Complete a command that is no longer pending in the table, or was never sent, with TIMEOUT.
+    """
+    timeouts.inc(self.name, open_command.command_name)
+    open_command.complete(TIMEOUT)
+
+  def in_flight(self):
+    """
+    :return: list of the pending records, ordered by sequence number
+    """
+    with self.lock:
+      return [self.pending[sequence_no] for sequence_no in sorted(self.pending)]
+
+  def expire(self, now=None):
+    """
+    Complete all pending commands whose deadline has passed with TIMEOUT and collect the
+    commands that are due for retransmission.
+    :return: tuple (list of records to retransmit, time in seconds until the next deadline
+             or retransmission, None if no command is pending)
+    """
+    if now is None:
+      now = time.monotonic()
+    expired = []
+    retransmit = []
+    next_deadline = None
+    with self.lock:
+      for sequence_no, open_command in list(self.pending.items()):
+        if open_command.deadline <= now:
+          expired.append(self.pending.pop(sequence_no))
+          continue
+
+        deadline = open_command.deadline
+        retransmit_at = open_command.retransmit_at
+        if retransmit_at is not None:
+          if retransmit_at <= now:
+            retransmit.append(open_command)
+          elif retransmit_at < deadline:
+            deadline = retransmit_at
+        if next_deadline is None or deadline < next_deadline:
+          next_deadline = deadline
+
+      for sequence_no, open_command in list(self.displaced.items()):
+        if self.pending.get(open_command.sequence_no) is not open_command:
+          del self.displaced[sequence_no]
+
+    for open_command in expired:
+      logger.warning("Command \"%s\", seq. no. %s timed out.", open_command.command_name, open_command.sequence_no)
+      self.time_out(open_command)
+
+    if next_deadline is None:
+      return retransmit, None
+    return retransmit, next_deadline - now
+
+  def clear(self):
+    """
+    Evict all records, pending commands are completed with TIMEOUT.
+    """
+    with self.lock:
+      pending = list(self.pending.values())
+      self.slots = [None] * self.capacity
+      self.ticket_slots = [None] * self.capacity
+      self.pending = {}
+      self.displaced = {}
+    for open_command in pending:
+      open_command.complete(TIMEOUT)
+
+  def __len__(self):
+    return len(self.pending)
@@ -0,0 +1,202 @@
+# module that keeps the preset positions of the camera in memory and persists them in the background
+
+import atexit
+import os
+import pickle
+import struct
+import threading
+import time
+import sys
+sys.path.append('..')
+import log
+
+logger = log.get_logger("camera.presets")
+
+# the file holds the magic, the format version and the number of slots, followed by one record per slot:
+# flag if the slot is set, pan, tilt and zoom position
+file_header_struct = struct.Struct("<4sBH")
+file_magic = b"PRST"
+file_version = 1
+slot_struct = struct.Struct("<?fff")
+
+class PresetRecall:
+  """
+  The two moves of a recalled preset, pan/tilt and zoom, which run at the same time on the camera.
+  """
+  def __init__(self, camera, pan_tilt_sequence_no, zoom_sequence_no):
+    self.pan_tilt_command = camera.open_commands.get(pan_tilt_sequence_no)
+    self.zoom_command = camera.open_commands.get(zoom_sequence_no)
+
+  def done(self):
+    """
+    :return: True if both moves have completed, failed or timed out
+    """
+    return all(command is None or command.completed.is_set() for command in (self.pan_tilt_command, self.zoom_command))
+
+  def wait(self, timeout=None):
+    """
+    Block until both moves have completed, failed or timed out.
+    :param timeout: maximum time in seconds to wait for both moves together, None waits until their deadlines
+    :return: True if both moves completed successfully
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for command in (self.pan_tilt_command, self.zoom_command):
+      if command is None:
+        return False
+      remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+      if not command.completed.wait(remaining):
+        return False
+    return bool(self.pan_tilt_command.result) and bool(self.zoom_command.result)
+
+class PresetBank:
+  """
+  Fixed number of preset slots with a camera pose (x, y, zoom) each, held in memory.
+  Storing a preset only changes the memory and wakes up a writer thread, which writes the whole bank
+  after write_delay seconds to a temporary file and renames it over the preset file, so the file is
+  never half written and several stores in a row cost one write.
+  """
+  def __init__(self, path="presets.bin", slots=16, write_delay=0.5, legacy_paths=()):
+    """
+    :param legacy_paths: position files of older versions, e.g. ("pos1", "pos2"), which are read into the first slots
+                         if there is no preset file, they belong to one camera
+    """
+    self.path = path
+    self.write_delay = write_delay
+    self.presets = [None] * slots
+    self.load(legacy_paths)
+
+    self.condition = threading.Condition()
+    self.write_lock = threading.Lock()
+    self.version = 0
+    self.written_version = 0
+    self.is_closed = False
+    self.thread = threading.Thread(target=self.write_loop, daemon=True)
+    self.thread.start()
+    atexit.register(self.flush)
+
+  def __len__(self):
+    return len(self.presets)
+
+  def load(self, legacy_paths=()):
+    """
+    Read the preset file, or the position files of older versions into the first slots if there is none.
+    A file that cannot be read leaves the slots empty, it is replaced with the next store.
+    """
+    if not os.path.exists(self.path):
+      for slot, legacy_path in enumerate(legacy_paths):
+        if slot < len(self.presets) and os.path.exists(legacy_path):
+          try:
+            with open(legacy_path, "rb") as f:
+              (pos_xy, pos_zoom) = pickle.load(f)
+            self.presets[slot] = (pos_xy[0], pos_xy[1], pos_zoom)
+          except Exception as exc:
+            logger.warning("Could not read the position file %s: %s", legacy_path, exc)
+      return
+
+    try:
+      with open(self.path, "rb") as f:
+        data = f.read()
+      magic, version, count = file_header_struct.unpack_from(data)
+      if magic != file_magic or version != file_version:
+        logger.warning("%s is not a preset file of version %s, starting with empty presets", self.path, file_version)
+        return
+      if len(data) < file_header_struct.size + count * slot_struct.size:
+        logger.warning("%s is truncated, starting with empty presets", self.path)
+        return
+      presets = [None] * len(self.presets)
+      for slot in range(min(count, len(self.presets))):
+        is_set, x, y, zoom = slot_struct.unpack_from(data, file_header_struct.size + slot * slot_struct.size)
+        if is_set:
+          presets[slot] = (x, y, zoom)
+      self.presets = presets
+    except (OSError, struct.error) as exc:
+      logger.warning("Could not read the preset file %s, starting with empty presets: %s", self.path, exc)
+
+  def get(self, slot):
+    """
+    :return: the pose (x, y, zoom) of the slot, None if it is not set
+    """
+    return self.presets[slot]
+
+  def store(self, slot, pose):
+    """
+    Set the pose (x, y, zoom) of a slot, it is written to the file in the background.
+    """
+    self.presets[slot] = tuple(pose)
+    with self.condition:
+      self.version += 1
+      self.condition.notify_all()
+
+  def recall(self, camera, slot, speed=0.8):
+    """
+    Move the camera to the pose of a slot, pan/tilt and zoom are sent at once and move at the same time.
+    :param speed: speed of both moves in [0,1]
+    :return: PresetRecall, whose wait() blocks until both moves have completed, None if the slot is not set
+    """
+    pose = self.presets[slot]
+    if pose is None:
+      return None
+    x, y, zoom = pose
+
+    # Pan-tiltDrive_absolute(x,y,vx,vy), CAM_Zoom_Direct_Speed(float f, float speed)
+    pan_tilt_sequence_no = camera.send_command("Pan-tiltDrive_absolute", x, y, speed, speed)
+    zoom_sequence_no = camera.send_command("CAM_Zoom_Direct_Speed", zoom, speed)
+    return PresetRecall(camera, pan_tilt_sequence_no, zoom_sequence_no)
+
+  def write(self):
+    """
+    Write all slots to a temporary file and replace the preset file with it.
+    """
+    data = bytearray(file_header_struct.pack(file_magic, file_version, len(self.presets)))
+    for pose in list(self.presets):
+      data += slot_struct.pack(False, 0, 0, 0) if pose is None else slot_struct.pack(True, *pose)
+
+    temporary_path = self.path + ".tmp"
+    with open(temporary_path, "wb") as f:
+      f.write(data)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temporary_path, self.path)
+
+  def write_loop(self):
+    """
+    Write the bank some time after it has been changed, until it is closed.
+    """
+    while True:
+      with self.condition:
+        self.condition.wait_for(lambda: self.version != self.written_version or self.is_closed)
+        if self.is_closed:
+          return
+        # a close() during the delay writes at once
+        self.condition.wait_for(lambda: self.is_closed, self.write_delay)
+      self.write_pending()
+
+  def write_pending(self):
+    # the disk is written outside of the condition, so store() never waits for it
+    with self.write_lock:
+      version = self.version
+      if version == self.written_version:
+        return
+      try:
+        self.write()
+      except OSError:
+        logger.exception("Could not write the presets to %s", self.path)
+      # a failed write is not retried at once, the next store writes the bank again
+      self.written_version = version
+
+  def flush(self):
+    """
+    Write the pending changes now.
+    """
+    self.write_pending()
+
+  def close(self):
+    """
+    Stop the writer thread and write the pending changes.
+    """
+    with self.condition:
+      self.is_closed = True
+      self.condition.notify_all()
+    self.thread.join()
+    self.flush()
+    atexit.unregister(self.flush)
@@ -0,0 +1,122 @@
+# module that splits received VISCA-over-IP datagrams into single replies
+
+# payload types of the VISCA-over-IP header of received messages
+VISCA_REPLY = 0x0111
+CONTROL_REPLY = 0x0201
+
+payload_type_names = {
+  VISCA_REPLY: "VISCA reply",
+  CONTROL_REPLY: "Control reply",
+}
+
+def compile_reply_messages():
+  """
+  Build the lookup table from the complete payload of a fixed-size reply to its description.
+  The table is built once at import time, so the parser only needs one dict lookup per reply.
+  """
+  reply_messages = {
+    bytes.fromhex("90 60 02 FF"): "Error: Syntax Error",
+    bytes.fromhex("90 60 03 FF"): "Error: Command buffer full",
+    bytes.fromhex("01"): "Reset sequence number.",
+    bytes.fromhex("0F 01"): "Abnormality in the sequence number.",
+    bytes.fromhex("0F 02"): "Abnormality in the message (message type).",
+  }
+  for socket_no in range(3):
+    if socket_no > 0:
+      reply_messages[bytes([0x90, 0x40 | socket_no, 0xFF])] = "Ack"
+      reply_messages[bytes([0x90, 0x50 | socket_no, 0xFF])] = "Completion (commands)"
+    reply_messages[bytes([0x90, 0x60 | socket_no, 0x04, 0xFF])] = "Error: Command cancelled (socket no. {})".format(socket_no)
+    reply_messages[bytes([0x90, 0x60 | socket_no, 0x05, 0xFF])] = "Error: No socket (to be cancelled, socket no. {})".format(socket_no)
+    reply_messages[bytes([0x90, 0x60 | socket_no, 0x41, 0xFF])] = "Error: Command not executable (socket no. {})".format(socket_no)
+  return reply_messages
+
+reply_messages = compile_reply_messages()
+
+# error class of the error replies 90 6z ee FF by their error code ee
+error_classes = {
+  0x02: "syntax_error",
+  0x03: "buffer_full",
+  0x04: "cancelled",
+  0x05: "no_socket",
+  0x41: "not_executable",
+}
+
+def describe_payload(payload):
+  """
+  Get the description of a single reply payload, e.g. "Ack" or "Completion (inquiries)".
+  """
+  payload_message = reply_messages.get(payload)
+  if payload_message is not None:
+    return payload_message
+  if len(payload) > 3 and payload[0] == 0x90 and payload[1] & 0xF0 == 0x50:
+    return "Completion (inquiries)"
+  return ""
+
+class ReplyFramer:
+  """
+  Receives datagrams into a preallocated buffer and splits them into single replies.
+  One datagram can contain several VISCA-over-IP messages back to back, and the payload of a
+  VISCA reply can contain several VISCA messages, each terminated by 0xFF.
+  """
+  def __init__(self, bufsize=4096):
+    self.buffer = bytearray(bufsize)
+    self.view = memoryview(self.buffer)
+
+    # length of the last received datagram, which is self.view[:self.nbytes]
+    self.nbytes = 0
+
+  def receive(self, sock):
+    """
+    Receive one datagram from the socket.
+    :return: list of (payload_type, sequence_no, payload, payload_message) tuples
+    """
+    self.nbytes = sock.recv_into(self.buffer)
+    return self.parse(self.buffer, self.nbytes, self.view)
+
+  def receive_from(self, sock):
+    """
+    Receive one datagram from a socket that is shared by several cameras.
+    :return: tuple (source address, list of (payload_type, sequence_no, payload, payload_message) tuples)
+    """
+    self.nbytes, address = sock.recvfrom_into(self.buffer)
+    return address, self.parse(self.buffer, self.nbytes, self.view)
+
+  def parse(self, data, nbytes=None, view=None):
+    """
+    Split a received datagram into replies.
+    :param data: bytes or bytearray that contains the datagram
+    :param nbytes: number of valid bytes in data, defaults to the whole data
+    :param view: memoryview of data, to avoid creating it for every datagram
+    :return: list of (payload_type, sequence_no, payload, payload_message) tuples
+    """
+    if nbytes is None:
+      nbytes = len(data)
+    if view is None:
+      view = memoryview(data)
+    replies = []
+    position = 0
+
+    # each VISCA-over-IP message has an 8 byte header: payload type, payload length, sequence number
+    while position + 8 <= nbytes:
+      payload_type = (data[position] << 8) | data[position+1]
+      payload_length = (data[position+2] << 8) | data[position+3]
+      sequence_no = int.from_bytes(view[position+4:position+8], byteorder='big')
+      start = position + 8
+      end = min(start + payload_length, nbytes)
+      position = start + payload_length
+
+      if payload_type != VISCA_REPLY:
+        payload = bytes(view[start:end])
+        replies.append((payload_type, sequence_no, payload, describe_payload(payload)))
+        continue
+
+      # split the payload at the terminators of the VISCA messages
+      while start < end:
+        terminator = data.find(0xFF, start, end)
+        if terminator == -1:
+          terminator = end - 1
+        payload = bytes(view[start:terminator+1])
+        replies.append((payload_type, sequence_no, payload, describe_payload(payload)))
+        start = terminator + 1
+
+    return replies
@@ -0,0 +1,74 @@
+# module that defines how lost commands are retransmitted, depending on the class of the command
+
+from collections import namedtuple
+from message_type import *
+
+# reply_timeout: time in seconds to wait for the first reply (ack, or completion of inquiries) before retransmitting
+# retries: maximum number of retransmissions
+# timeout: time in seconds after which the command is completed with TIMEOUT
+RetransmitPolicy = namedtuple("RetransmitPolicy", ["reply_timeout", "retries", "timeout"])
+
+# policies for each command class, can be changed at runtime
+retransmit_policies = {
+  # stop commands are retransmitted until they are acknowledged
+  "stop": RetransmitPolicy(reply_timeout=0.1, retries=5, timeout=2.0),
+
+  # continuous motion, only the latest drive command of an axis group is retransmitted
+  "drive": RetransmitPolicy(reply_timeout=0.1, retries=2, timeout=2.0),
+
+  # inquiries have no side effects and can be retried freely
+  "inquiry": RetransmitPolicy(reply_timeout=0.1, retries=3, timeout=1.0),
+
+  # moves to a target, the completion is only sent when the target is reached
+  "move": RetransmitPolicy(reply_timeout=0.2, retries=2, timeout=20.0),
+
+  # commands that must not be executed twice are never retransmitted
+  "not_idempotent": RetransmitPolicy(reply_timeout=0.2, retries=0, timeout=20.0),
+
+  "other": RetransmitPolicy(reply_timeout=0.2, retries=2, timeout=5.0),
+}
+
+# axis group that is moved by the continuous motion and stop commands
+axis_groups = {
+  "Pan-tiltDrive": "pan_tilt",
+  "Pan-tiltDrive_Stop": "pan_tilt",
+  "CAM_Zoom_Stop": "zoom",
+  "CAM_Zoom_Tele": "zoom",
+  "CAM_Zoom_Wide": "zoom",
+  "CAM_Zoom_Tele_Variable": "zoom",
+  "CAM_Zoom_Wide_Variable": "zoom",
+}
+
+command_classes = {
+  "Pan-tiltDrive_Stop": "stop",
+  "CAM_Zoom_Stop": "stop",
+  "Pan-tiltDrive": "drive",
+  "CAM_Zoom_Tele": "drive",
+  "CAM_Zoom_Wide": "drive",
+  "CAM_Zoom_Tele_Variable": "drive",
+  "CAM_Zoom_Wide_Variable": "drive",
+  "Pan-tiltDrive_absolute": "move",
+  "Pan-tiltDrive_Home": "move",
+  "Pan-tiltDrive_Reset": "move",
+  "CAM_Zoom_Direct": "move",
+  "CAM_Zoom_Direct_Speed": "move",
+  "Pan-tiltDrive_relative": "not_idempotent",
+  "CAM_Zoom_Tele_Step": "not_idempotent",
+  "CAM_Zoom_Wide_Step": "not_idempotent",
+  "Tally_Mode": "not_idempotent",
+}
+
+def classify(command_name, args, message_type):
+  """
+  Get the command class of a command, i.e. the key of its retransmit policy.
+  """
+  if message_type == MessageType.VISCA_INQUIRY:
+    return "inquiry"
+
+  # Pan-tiltDrive without direction or speed equals stop
+  if command_name == "Pan-tiltDrive":
+    x,y,vx,vy = args
+    if (x == 0 and y == 0) or (vx == 0 and vy == 0):
+      return "stop"
+
+  return command_classes.get(command_name, "other")
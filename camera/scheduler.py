@@ -0,0 +1,130 @@
+# module that decides when a command may be sent to the camera
+
+import collections
+import time
+
+# priority classes, lower values are sent first
+PRIORITY_STOP = 0
+PRIORITY_OPERATOR = 1
+PRIORITY_AUTOMATION = 2
+PRIORITY_INQUIRY = 3
+
+# default priority of each command class of retransmission.py
+command_class_priorities = {
+  "stop": PRIORITY_STOP,
+  "drive": PRIORITY_OPERATOR,
+  "inquiry": PRIORITY_INQUIRY,
+  "move": PRIORITY_AUTOMATION,
+  "not_idempotent": PRIORITY_AUTOMATION,
+  "other": PRIORITY_AUTOMATION,
+}
+
+class CommandScheduler:
+  """
+  Admission control for the command sockets of the camera.
+  A VISCA camera executes at most two commands at the same time, each one occupies a socket from
+  its ack until its completion (or error). Further commands are answered with "Command buffer full".
+  The scheduler counts the commands in flight and queues commands that would not get a socket,
+  in the order of their priority class. Stop commands are never queued, unless the camera reported
+  a full buffer, in which case all commands wait for a short backoff time.
+  Inquiries do not occupy a socket, only the number of inquiries in flight is limited.
+  """
+  def __init__(self, sockets=2, max_inquiries_in_flight=2, buffer_full_backoff=0.05):
+    self.sockets = sockets
+    self.max_inquiries_in_flight = max_inquiries_in_flight
+    self.buffer_full_backoff = buffer_full_backoff
+    self.queues = [collections.deque() for priority in range(PRIORITY_INQUIRY+1)]
+    self.commands_in_flight = []
+    self.inquiries_in_flight = []
+    self.blocked_until = 0
+
+  def update(self):
+    """
+    Forget the commands in flight that have completed, failed or timed out.
+    """
+    self.commands_in_flight = [c for c in self.commands_in_flight if not c.completed.is_set()]
+    self.inquiries_in_flight = [c for c in self.inquiries_in_flight if not c.completed.is_set()]
+
+  def occupied_sockets(self):
+    """
+    :return: list of the socket numbers reported in the acks of the commands that have not completed yet
+    """
+    self.update()
+    return [c.payload[1] & 0x0F for c in self.commands_in_flight
+            if c.acknowledged.is_set() and c.payload is not None and len(c.payload) > 1]
+
+  def can_admit(self, open_command):
+    """
+    Check if the command can be sent now without exceeding the sockets of the camera.
+    """
+    if time.monotonic() < self.blocked_until:
+      return False
+    priority = open_command.priority
+    self.update()
+    if priority == PRIORITY_STOP:
+      return True
+    if priority == PRIORITY_INQUIRY:
+      return len(self.inquiries_in_flight) < self.max_inquiries_in_flight
+    return len(self.commands_in_flight) < self.sockets
+
+  def has_queued(self, priority):
+    """
+    Check if there are queued commands of the same or a higher priority class, which have to be sent first.
+    """
+    if priority == PRIORITY_INQUIRY:
+      return bool(self.queues[PRIORITY_INQUIRY])
+    return any(self.queues[p] for p in range(priority+1))
+
+  def enqueue(self, open_command, front=False):
+    """
+    Queue a command in its priority class, at the front if it has to be sent again.
+    """
+    if front:
+      self.queues[open_command.priority].appendleft(open_command)
+    else:
+      self.queues[open_command.priority].append(open_command)
+
+  def on_transmit(self, open_command):
+    """
+    Count a sent command as in flight.
+    """
+    if open_command.priority == PRIORITY_INQUIRY:
+      self.inquiries_in_flight.append(open_command)
+    else:
+      self.commands_in_flight.append(open_command)
+
+  def on_withdraw(self, open_command):
+    """
+    Stop counting a command as in flight, because the camera did not accept it.
+    """
+    self.commands_in_flight = [c for c in self.commands_in_flight if c is not open_command]
+    self.inquiries_in_flight = [c for c in self.inquiries_in_flight if c is not open_command]
+
+  def on_buffer_full(self):
+    """
+    Stop sending for a short time after the camera reported a full command buffer.
+    """
+    self.blocked_until = time.monotonic() + self.buffer_full_backoff
+
+  def time_to_unblock(self, has_waiting=False):
+    """
+    :param has_waiting: True if commands wait outside of the queues, e.g. coalesced continuous motion of the camera
+    :return: time in seconds until queued commands may be sent after a full command buffer, None if not blocked
+    """
+    if not any(self.queues) and not has_waiting:
+      return None
+    remaining = self.blocked_until - time.monotonic()
+    if remaining <= 0:
+      return None
+    return remaining
+
+  def admissible(self):
+    """
+    Remove and yield the queued commands that can be sent now, in the order of their priority.
+    """
+    for queue in self.queues:
+      while queue and self.can_admit(queue[0]):
+        yield queue.popleft()
+
+  def __len__(self):
+    return sum(len(queue) for queue in self.queues)
@@ -0,0 +1,452 @@
+#!/usr/bin/python3
+# module that simulates a VISCA-over-IP PTZ camera, to run the camera module without the Marshall camera
+
+import socket
+import selectors
+import threading
+import heapq
+import random
+import struct
+import time
+import math
+from reply_framer import *
+from commands import encode_nibbles, decode_nibbles, encode_pan, decode_pan, encode_tilt, decode_tilt
+
+# the simulated camera moves with the speeds that the telemetry assumes for the real one
+from telemetry import max_pan_speed, max_tilt_speed, max_zoom_speed
+
+# accelerations in normalized units per second squared
+pan_tilt_acceleration = 3.0
+zoom_acceleration = 1.5
+
+# zoom change of CAM_Zoom_Tele_Step and CAM_Zoom_Wide_Step
+zoom_step = 1 / 64
+
+# header of the sent VISCA-over-IP messages: payload type, payload length, sequence number
+header_struct = struct.Struct('>HHI')
+
+class Axis:
+  """
+  Kinematics of one axis: the velocity follows the commanded velocity with limited acceleration,
+  moves to a target position brake in time to stop at the target.
+  """
+  def __init__(self, minimum, maximum, acceleration, position=0.0):
+    self.minimum = minimum
+    self.maximum = maximum
+    self.acceleration = acceleration
+    self.position = position
+    self.velocity = 0.0
+    self.target_velocity = 0.0
+    self.target_position = None
+    self.speed = 0.0
+
+  def drive(self, velocity):
+    """
+    Move continuously with the given velocity, 0 stops.
+    """
+    self.target_position = None
+    self.target_velocity = velocity
+
+  def move_to(self, position, speed):
+    """
+    Move to the given position with at most the given speed.
+    """
+    self.target_position = min(max(position, self.minimum), self.maximum)
+    self.speed = speed
+
+  def is_moving(self):
+    return self.velocity != 0 or self.target_velocity != 0 or self.target_position is not None
+
+  def step(self, dt):
+    """
+    Advance the axis by dt seconds.
+    :return: True if the target position of a move has been reached
+    """
+    if self.target_position is not None:
+      distance = self.target_position - self.position
+      braking_speed = math.sqrt(2 * self.acceleration * abs(distance))
+      desired_velocity = math.copysign(min(self.speed, braking_speed), distance)
+    else:
+      desired_velocity = self.target_velocity
+
+    dv = min(max(desired_velocity - self.velocity, -self.acceleration*dt), self.acceleration*dt)
+    self.velocity += dv
+    self.position += self.velocity * dt
+
+    # stop at the mechanical limits
+    if self.position <= self.minimum or self.position >= self.maximum:
+      self.position = min(max(self.position, self.minimum), self.maximum)
+      self.velocity = 0.0
+      if self.target_position is None:
+        self.target_velocity = 0.0
+
+    if self.target_position is not None:
+      # the target is reached when it is close or has been passed in this step
+      if abs(self.target_position - self.position) < 1e-4 or (self.target_position - self.position) * distance <= 0:
+        self.position = self.target_position
+        self.velocity = 0.0
+        self.target_position = None
+        return True
+    return False
+
+class CameraSimulator:
+  """
+  UDP server that behaves like a VISCA-over-IP camera for the commands of commands.py:
+  ack and completion replies on two command sockets, "Command buffer full" if both are occupied,
+  sequence number checking with the reset control command, and pan, tilt and zoom motion with
+  speed and acceleration limits that the position inquiries are answered from.
+  Faults are injected into the network, each with its own probability:
+  drop loses a received message or a reply, duplicate sends a reply twice and reorder delays a reply
+  by reorder_delay, so that later replies overtake it. Every reply is delayed by latency plus a
+  uniformly distributed jitter.
+  """
+  def __init__(self, host="127.0.0.1", port=52381, latency=0.0, jitter=0.0, drop=0.0, duplicate=0.0,
+               reorder=0.0, reorder_delay=0.01, sockets=2, seed=None):
+    self.latency = latency
+    self.jitter = jitter
+    self.drop = drop
+    self.duplicate = duplicate
+    self.reorder = reorder
+    self.reorder_delay = reorder_delay
+    self.sockets = sockets
+    self.random = random.Random(seed)
+
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.socket.bind((host, port))
+    self.socket.setblocking(False)
+    self.address = self.socket.getsockname()
+
+    # camera state
+    self.power = True
+    self.axes = {
+      "x": Axis(-1.0, 1.0, pan_tilt_acceleration),
+      "y": Axis(-1.0, 1.0, pan_tilt_acceleration),
+      "zoom": Axis(0.0, 1.0, zoom_acceleration),
+    }
+    self.last_update = time.monotonic()
+
+    # sequence number of the last accepted message, None after a reset
+    self.last_sequence_no = None
+
+    # commands that occupy a socket until their move is completed, socket number -> (axis group, sequence number, address)
+    self.executing = {}
+
+    # replies that wait for their delivery time, entries (time, counter, message, address)
+    self.outgoing = []
+    self.outgoing_counter = 0
+
+    # counters of the received and sent messages and the injected faults
+    self.statistics = {"received": 0, "sent": 0, "dropped": 0, "duplicated": 0, "reordered": 0,
+                       "buffer_full": 0, "sequence_errors": 0}
+
+    self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+    self.wakeup_receiver.setblocking(False)
+    self.selector = selectors.DefaultSelector()
+    self.selector.register(self.socket, selectors.EVENT_READ)
+    self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+    self.is_running = False
+    self.thread = None
+
+  def start(self):
+    """
+    Serve in a background thread.
+    """
+    self.is_running = True
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.is_running = False
+    self.wakeup_sender.send(b"\0")
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+    self.selector.close()
+    self.socket.close()
+    self.wakeup_receiver.close()
+    self.wakeup_sender.close()
+
+  def pose(self):
+    """
+    :return: tuple (x, y, zoom) of the simulated camera
+    """
+    return (self.axes["x"].position, self.axes["y"].position, self.axes["zoom"].position)
+
+  def run(self):
+    buffer = bytearray(4096)
+    while self.is_running:
+      now = time.monotonic()
+      self.update(now)
+      self.flush(now)
+
+      # wake up for the next delayed reply, and in small steps while the camera moves
+      timeout = None
+      if self.outgoing:
+        timeout = max(self.outgoing[0][0] - now, 0)
+      if any(axis.is_moving() for axis in self.axes.values()):
+        timeout = 0.01 if timeout is None else min(timeout, 0.01)
+
+      for key, mask in self.selector.select(timeout):
+        if key.fileobj is self.wakeup_receiver:
+          self.wakeup_receiver.recv(4096)
+          continue
+        try:
+          nbytes, address = self.socket.recvfrom_into(buffer)
+        except BlockingIOError:
+          continue
+        self.handle_message(bytes(buffer[:nbytes]), address)
+
+  def update(self, now):
+    """
+    Advance the kinematics to the given time and complete the moves that reached their target.
+    """
+    dt = now - self.last_update
+    self.last_update = now
+    if dt <= 0:
+      return
+
+    reached = set()
+    for name, axis in self.axes.items():
+      if axis.step(dt):
+        reached.add("zoom" if name == "zoom" else "pan_tilt")
+
+    for socket_no, (axis_group, sequence_no, address) in list(self.executing.items()):
+      if axis_group in reached and not self.is_axis_group_moving(axis_group):
+        del self.executing[socket_no]
+        self.send_reply(VISCA_REPLY, sequence_no, bytes((0x90, 0x50 | socket_no, 0xFF)), address)
+
+  def is_axis_group_moving(self, axis_group):
+    if axis_group == "zoom":
+      return self.axes["zoom"].target_position is not None
+    return self.axes["x"].target_position is not None or self.axes["y"].target_position is not None
+
+  def send_reply(self, payload_type, sequence_no, payload, address):
+    """
+    Send a reply after the latency and jitter, with the injected faults.
+    """
+    if self.random.random() < self.drop:
+      self.statistics["dropped"] += 1
+      return
+
+    message = header_struct.pack(payload_type, len(payload), sequence_no) + payload
+    delay = self.latency + self.random.uniform(0, self.jitter)
+    if self.random.random() < self.reorder:
+      self.statistics["reordered"] += 1
+      delay += self.reorder_delay
+
+    copies = 1
+    if self.random.random() < self.duplicate:
+      self.statistics["duplicated"] += 1
+      copies = 2
+
+    for copy in range(copies):
+      if delay <= 0 and not self.outgoing:
+        self.socket.sendto(message, address)
+        self.statistics["sent"] += 1
+        continue
+      heapq.heappush(self.outgoing, (time.monotonic() + delay, self.outgoing_counter, message, address))
+      self.outgoing_counter += 1
+
+  def flush(self, now):
+    """
+    Send the delayed replies that are due.
+    """
+    while self.outgoing and self.outgoing[0][0] <= now:
+      due, counter, message, address = heapq.heappop(self.outgoing)
+      self.socket.sendto(message, address)
+      self.statistics["sent"] += 1
+
+  def handle_message(self, message, address):
+    if self.random.random() < self.drop:
+      self.statistics["dropped"] += 1
+      return
+    self.statistics["received"] += 1
+    if len(message) < 8:
+      return
+
+    payload_type, payload_length, sequence_no = header_struct.unpack_from(message)
+    payload = message[8:8+payload_length]
+
+    # control command: reset of the sequence number
+    if payload_type == 0x0200:
+      if payload == b"\x01":
+        self.last_sequence_no = None
+      self.send_reply(CONTROL_REPLY, sequence_no, b"\x01", address)
+      return
+
+    if payload_type not in (0x0100, 0x0110):
+      self.send_reply(CONTROL_REPLY, sequence_no, b"\x0F\x02", address)
+      return
+
+    # sequence numbers have to increase until the next reset, lost messages may leave gaps
+    if self.last_sequence_no is not None and sequence_no <= self.last_sequence_no:
+      self.statistics["sequence_errors"] += 1
+      self.send_reply(CONTROL_REPLY, sequence_no, b"\x0F\x01", address)
+      return
+    self.last_sequence_no = sequence_no
+
+    self.update(time.monotonic())
+    if payload_type == 0x0110:
+      self.handle_inquiry(sequence_no, payload, address)
+    else:
+      self.handle_command(sequence_no, payload, address)
+
+  def handle_inquiry(self, sequence_no, payload, address):
+    """
+    Answer an inquiry right away, it does not occupy a socket.
+    """
+    command = payload[1:4]
+    if command == b"\x09\x04\x00":
+      reply = bytes((0x90, 0x50, 0x02 if self.power else 0x03, 0xFF))
+    elif command == b"\x09\x00\x02":
+      reply = bytes.fromhex("90 50 00 01 05 11 05 00 02 FF")
+    elif command == b"\x09\x04\x47":
+      zoom = min((int)(round(self.axes["zoom"].position*0x4000)), 0x4000)
+      reply = b"\x90\x50" + encode_nibbles(zoom) + b"\xFF"
+    elif command == b"\x09\x06\x12":
+      reply = b"\x90\x50" + encode_nibbles(encode_pan(self.axes["x"].position)) \
+        + encode_nibbles(encode_tilt(self.axes["y"].position)) + b"\xFF"
+    else:
+      reply = bytes.fromhex("90 60 02 FF")
+    self.send_reply(VISCA_REPLY, sequence_no, reply, address)
+
+  def handle_command(self, sequence_no, payload, address):
+    """
+    Acknowledge and execute a command. Moves to a target occupy their socket until the target is reached,
+    a new command for the same axis group cancels them and takes over their socket.
+    """
+    parsed = self.parse_command(payload)
+    if parsed is None:
+      self.send_reply(VISCA_REPLY, sequence_no, bytes.fromhex("90 60 02 FF"), address)
+      return
+    axis_group, execute, is_move = parsed
+
+    if axis_group is not None and not self.power:
+      self.send_reply(VISCA_REPLY, sequence_no, bytes.fromhex("90 60 41 FF"), address)
+      return
+
+    # cancel the running move of the axis group
+    for socket_no, (executing_axis_group, executing_sequence_no, executing_address) in list(self.executing.items()):
+      if axis_group is not None and executing_axis_group == axis_group:
+        del self.executing[socket_no]
+        self.send_reply(VISCA_REPLY, executing_sequence_no, bytes((0x90, 0x60 | socket_no, 0x04, 0xFF)), executing_address)
+
+    free_sockets = [socket_no for socket_no in range(1, self.sockets+1) if socket_no not in self.executing]
+    if not free_sockets:
+      self.statistics["buffer_full"] += 1
+      self.send_reply(VISCA_REPLY, sequence_no, bytes.fromhex("90 60 03 FF"), address)
+      return
+
+    socket_no = free_sockets[0]
+    self.send_reply(VISCA_REPLY, sequence_no, bytes((0x90, 0x40 | socket_no, 0xFF)), address)
+    execute()
+
+    # the completion of a move is sent by update() when the target is reached
+    if is_move and self.is_axis_group_moving(axis_group):
+      self.executing[socket_no] = (axis_group, sequence_no, address)
+    else:
+      self.send_reply(VISCA_REPLY, sequence_no, bytes((0x90, 0x50 | socket_no, 0xFF)), address)
+
+  def parse_command(self, payload):
+    """
+    Decode a command packet of commands.py.
+    :return: tuple (axis group or None, function that executes the command, True if the command moves to a target),
+             None if the command is unknown
+    """
+    if len(payload) < 5 or payload[0] != 0x81 or payload[1] != 0x01:
+      return None
+    x, y, zoom = self.axes["x"], self.axes["y"], self.axes["zoom"]
+    category, command = payload[2], payload[3]
+
+    # zoom
+    if category == 0x04 and command == 0x07:
+      p = payload[4]
+      if p == 0x00:
+        return "zoom", lambda: zoom.drive(0.0), False
+      if p == 0x02:
+        return "zoom", lambda: zoom.drive(max_zoom_speed), False
+      if p == 0x03:
+        return "zoom", lambda: zoom.drive(-max_zoom_speed), False
+      if p == 0x04:
+        return "zoom", lambda: zoom.move_to(zoom.position + zoom_step, max_zoom_speed), True
+      if p == 0x05:
+        return "zoom", lambda: zoom.move_to(zoom.position - zoom_step, max_zoom_speed), True
+      speed = ((p & 0x0F) + 1) / 8 * max_zoom_speed
+      if p & 0xF0 == 0x20:
+        return "zoom", lambda: zoom.drive(speed), False
+      if p & 0xF0 == 0x30:
+        return "zoom", lambda: zoom.drive(-speed), False
+      return None
+
+    if category == 0x04 and command == 0x47 and len(payload) >= 9:
+      target = decode_nibbles(payload, 4) / 0x4000
+      speed = max_zoom_speed
+      if len(payload) >= 10 and payload[8] != 0xFF:
+        speed = (payload[8] + 1) / 8 * max_zoom_speed
+      return "zoom", lambda: zoom.move_to(target, speed), True
+
+    # power
+    if category == 0x04 and command == 0x00:
+      def set_power():
+        self.power = payload[4] == 0x02
+      return None, set_power, False
+
+    # pan and tilt
+    if category == 0x06 and command == 0x01 and len(payload) >= 9:
+      vx = payload[4] / 0x18 * max_pan_speed
+      vy = payload[5] / 0x18 * max_tilt_speed
+      direction_x = {1: -1, 2: 1}.get(payload[6], 0)
+      direction_y = {1: 1, 2: -1}.get(payload[7], 0)
+      def drive():
+        x.drive(direction_x*vx)
+        y.drive(direction_y*vy)
+      return "pan_tilt", drive, False
+
+    if category == 0x06 and command in (0x02, 0x03) and len(payload) >= 15:
+      vx = max(payload[4], 1) / 0x18 * max_pan_speed
+      vy = max(payload[5], 1) / 0x18 * max_tilt_speed
+      target_x = decode_pan(decode_nibbles(payload, 6))
+      target_y = decode_tilt(decode_nibbles(payload, 10))
+      is_relative = command == 0x03
+      def move():
+        x.move_to(target_x + (x.position if is_relative else 0), vx)
+        y.move_to(target_y + (y.position if is_relative else 0), vy)
+      return "pan_tilt", move, True
+
+    if category == 0x06 and command in (0x04, 0x05):
+      def home():
+        x.move_to(0.0, max_pan_speed)
+        y.move_to(0.0, max_tilt_speed)
+      return "pan_tilt", home, True
+
+    # tally and other settings are only acknowledged
+    if category == 0x7E:
+      return None, lambda: None, False
+
+    return None
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="Simulated VISCA-over-IP camera")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=52381)
+  parser.add_argument("--latency", type=float, default=0.0, help="delay of each reply in seconds")
+  parser.add_argument("--jitter", type=float, default=0.0, help="maximum additional random delay in seconds")
+  parser.add_argument("--drop", type=float, default=0.0, help="probability that a message is lost")
+  parser.add_argument("--duplicate", type=float, default=0.0, help="probability that a reply is sent twice")
+  parser.add_argument("--reorder", type=float, default=0.0, help="probability that a reply is overtaken")
+  parser.add_argument("--seed", type=int, default=None)
+  args = parser.parse_args()
+
+  simulator = CameraSimulator(args.host, args.port, args.latency, args.jitter, args.drop, args.duplicate,
+                              args.reorder, seed=args.seed)
+  print("simulated camera listening on {}:{}".format(*simulator.address))
+  simulator.start()
+  try:
+    while True:
+      time.sleep(5)
+      print("pose: ({:.3f}, {:.3f}, {:.3f}), {}".format(*simulator.pose(), simulator.statistics))
+  except KeyboardInterrupt:
+    simulator.stop()
@@ -0,0 +1,147 @@
+# module that records the pose of the camera in the background
+
+import threading
+import time
+import numpy as np
+
+# speeds of the camera at the maximum speed setting, in normalized units per second,
+# i.e. pan and tilt position in [-1,1] and zoom position in [0,1]
+max_pan_speed = 0.6
+max_tilt_speed = 0.6
+max_zoom_speed = 0.3
+
+def drive_velocity(open_command):
+  """
+  Get the velocity (vx, vy, vzoom) that a continuous motion command drives the camera with,
+  decoded from its packet. Stop commands and other commands drive with zero velocity.
+  """
+  packet = open_command.command_packet
+  if open_command.command_name == "Pan-tiltDrive":
+    vx = packet[4] / 0x18 * max_pan_speed
+    vy = packet[5] / 0x18 * max_tilt_speed
+    direction_x = {1: -1, 2: 1}.get(packet[6], 0)
+    direction_y = {1: 1, 2: -1}.get(packet[7], 0)
+    return (direction_x*vx, direction_y*vy, 0.0)
+
+  if open_command.command_name in ("CAM_Zoom_Tele_Variable", "CAM_Zoom_Wide_Variable"):
+    vz = ((packet[4] & 0x0F) + 1) / 8 * max_zoom_speed
+    return (0.0, 0.0, vz if packet[4] & 0xF0 == 0x20 else -vz)
+
+  if open_command.command_name in ("CAM_Zoom_Tele", "CAM_Zoom_Wide"):
+    return (0.0, 0.0, max_zoom_speed if open_command.command_name == "CAM_Zoom_Tele" else -max_zoom_speed)
+
+  return (0.0, 0.0, 0.0)
+
+class PoseTelemetry:
+  """
+  Polls pan, tilt and zoom of the camera at a fixed rate into a preallocated ring buffer
+  with the columns (monotonic time, x, y, zoom). The queries work on the buffer only, so they
+  can be called at any rate without sending inquiries to the camera.
+  """
+  def __init__(self, camera, rate=10.0, capacity=4096):
+    self.camera = camera
+    self.period = 1.0 / rate
+    self.capacity = capacity
+    self.samples = np.zeros((capacity, 4))
+    self.count = 0
+    self.lock = threading.Lock()
+    self.stop_event = threading.Event()
+    self.thread = None
+
+  def start(self):
+    self.stop_event.clear()
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.stop_event.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def run(self):
+    """
+    Polling loop, the next poll is scheduled relative to the previous one, so the rate does not drift.
+    """
+    next_time = time.monotonic()
+    while not self.stop_event.is_set():
+      t = time.monotonic()
+      pose = self.camera.get_pose(max_age=self.period/2, timeout=self.period)
+      if pose is not None:
+        self.add_sample(t, pose)
+
+      next_time += self.period
+      now = time.monotonic()
+      if next_time < now:
+        next_time = now
+      self.stop_event.wait(next_time - now)
+
+  def add_sample(self, t, pose):
+    with self.lock:
+      self.samples[self.count % self.capacity] = (t, pose[0], pose[1], pose[2])
+      self.count += 1
+
+  def history(self, seconds=None):
+    """
+    Get the recorded samples in chronological order.
+    :param seconds: only return the samples of the last seconds, None returns all samples in the buffer
+    :return: array of shape (n, 4) with the columns (monotonic time, x, y, zoom)
+    """
+    with self.lock:
+      if self.count < self.capacity:
+        samples = self.samples[:self.count].copy()
+      else:
+        samples = np.roll(self.samples, -(self.count % self.capacity), axis=0)
+
+    if seconds is not None and len(samples) > 0:
+      samples = samples[samples[:,0] >= time.monotonic() - seconds]
+    return samples
+
+  def velocity(self, seconds=0.5):
+    """
+    Estimate the velocity by a least squares fit over the samples of the last seconds.
+    :return: array (vx, vy, vzoom) in normalized units per second, zero if there are less than two samples
+    """
+    samples = self.history(seconds)
+    if len(samples) < 2:
+      return np.zeros(3)
+    t = samples[:,0] - samples[:,0].mean()
+    denominator = np.dot(t, t)
+    if denominator == 0:
+      return np.zeros(3)
+    return t @ (samples[:,1:] - samples[:,1:].mean(axis=0)) / denominator
+
+  def is_settled(self, seconds=0.5, tolerance=1e-3):
+    """
+    Check if pan, tilt and zoom have not changed by more than the tolerance during the last seconds.
+    """
+    samples = self.history(seconds)
+    if len(samples) < 2:
+      return False
+    return bool(np.all(np.ptp(samples[:,1:], axis=0) <= tolerance))
+
+  def current_pose(self):
+    """
+    Estimate the pose at the current time: the last sample, moved on by the velocity of the last
+    continuous motion commands for the time since the sample (or since the command, if it is newer).
+    :return: array (x, y, zoom), None if there is no sample yet
+    """
+    with self.lock:
+      if self.count == 0:
+        return None
+      sample = self.samples[(self.count-1) % self.capacity].copy()
+
+    now = time.monotonic()
+    pose = sample[1:]
+    for axis_group in ("pan_tilt", "zoom"):
+      open_command = self.camera.latest_commands.get(axis_group)
+      if open_command is None or open_command.sent_time is None:
+        continue
+      
+      # a failed or timed out command did not move the camera
+      if open_command.completed.is_set() and not open_command.result:
+        continue
+      start_time = max(sample[0], open_command.sent_time)
+      pose = pose + np.array(drive_velocity(open_command)) * max(now - start_time, 0.0)
+
+    return np.clip(pose, [-1, -1, 0], [1, 1, 1])
@@ -0,0 +1,146 @@
+# regression tests of the camera, run with: python -m unittest (in the camera directory)
+
+import socket
+import struct
+import threading
+import time
+import unittest
+from camera import Camera
+from open_command_table import OpenCommandTable
+from reply_framer import VISCA_REPLY
+
+header_struct = struct.Struct('>HHI')
+
+class FakeCamera:
+  """
+  Camera on localhost that replies "Command buffer full" to the first Pan-tiltDrive,
+  and ack and completion to all other commands. The messages of drop_count Pan-tiltDrive
+  commands after the first are lost.
+  """
+  def __init__(self):
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.socket.bind(("127.0.0.1", 0))
+    self.socket.settimeout(0.05)
+    self.port = self.socket.getsockname()[1]
+    self.received = []
+    self.is_buffer_full_sent = False
+    self.drop_count = 0
+    self.is_running = True
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.is_running = False
+    self.thread.join()
+    self.socket.close()
+
+  def reply(self, sequence_no, payload, address):
+    self.socket.sendto(header_struct.pack(VISCA_REPLY, len(payload), sequence_no) + payload, address)
+
+  def run(self):
+    while self.is_running:
+      try:
+        message, address = self.socket.recvfrom(1024)
+      except socket.timeout:
+        continue
+      payload_type, payload_length, sequence_no = header_struct.unpack_from(message)
+      payload = message[header_struct.size:]
+      if payload_type != 0x0100:
+        continue
+      self.received.append((time.monotonic(), payload))
+      is_drive = payload.startswith(bytes.fromhex('81 01 06 01')) and payload[6:8] != bytes.fromhex('03 03')
+      if is_drive and not self.is_buffer_full_sent:
+        self.is_buffer_full_sent = True
+        self.reply(sequence_no, bytes.fromhex('90 60 03 FF'), address)
+      elif is_drive and self.drop_count > 0:
+        self.drop_count -= 1
+      else:
+        self.reply(sequence_no, bytes.fromhex('90 41 FF'), address)
+        self.reply(sequence_no, bytes.fromhex('90 51 FF'), address)
+
+class TestBufferFull(unittest.TestCase):
+
+  def setUp(self):
+    self.fake_camera = FakeCamera()
+    self.camera = Camera("127.0.0.1", self.fake_camera.port)
+
+  def tearDown(self):
+    self.camera.close()
+    self.fake_camera.stop()
+
+  def test_drive_is_sent_after_buffer_full(self):
+    self.camera.send_command("Pan-tiltDrive", 1, 1, 0.5, 0.5)
+    deadline = time.monotonic() + 1.0
+    while not self.fake_camera.is_buffer_full_sent and time.monotonic() < deadline:
+      time.sleep(0.001)
+    self.assertTrue(self.fake_camera.is_buffer_full_sent)
+
+    # the next drive of the axis group is coalesced with the rejected one and sent after the backoff
+    ticket = self.camera.send_command("Pan-tiltDrive", -1, 1, 0.25, 0.5)
+    self.assertIs(self.camera.wait_for_result(ticket, timeout=1.0), True)
+    drives = [payload for t, payload in self.fake_camera.received if payload.startswith(bytes.fromhex('81 01 06 01'))]
+    self.assertEqual(len(drives), 2)
+
+class TestSuperseded(unittest.TestCase):
+
+  def setUp(self):
+    self.fake_camera = FakeCamera()
+    self.fake_camera.is_buffer_full_sent = True
+    self.camera = Camera("127.0.0.1", self.fake_camera.port)
+
+  def tearDown(self):
+    self.camera.close()
+    self.fake_camera.stop()
+
+  def test_lost_drive_is_released_by_the_stop(self):
+    # the drive and its retransmissions are lost, the stop of the axis group completes it and frees its socket
+    self.fake_camera.drop_count = 100
+    sequence_no = self.camera.send_command("Pan-tiltDrive", 1, 1, 0.5, 0.5)
+    open_command = self.camera.open_commands.get(sequence_no)
+    deadline = time.monotonic() + 1.0
+    while (open_command.retries > 0 or open_command.retransmit_at is not None) and time.monotonic() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(open_command.retries, 0)
+    self.assertFalse(open_command.completed.is_set())
+
+    self.assertIs(self.camera.wait_for_result(self.camera.send_command("Pan-tiltDrive_Stop"), timeout=1.0), True)
+    self.assertTrue(open_command.completed.wait(0.1))
+    self.assertEqual(repr(open_command.result), "SUPERSEDED")
+    self.assertEqual(len(self.camera.scheduler.occupied_sockets()), 0)
+    self.camera.scheduler.update()
+    self.assertEqual(self.camera.scheduler.commands_in_flight, [])
+
+  def test_lost_drive_is_released_by_the_next_drive(self):
+    # the next drive does not wait for the deadline of a drive whose retransmissions are lost
+    self.fake_camera.drop_count = 3
+    sequence_no = self.camera.send_command("Pan-tiltDrive", 1, 1, 0.5, 0.5)
+    open_command = self.camera.open_commands.get(sequence_no)
+    time.sleep(0.5)
+    self.assertFalse(open_command.completed.is_set())
+
+    start = time.monotonic()
+    ticket = self.camera.send_command("Pan-tiltDrive", -1, 1, 0.5, 0.5)
+    self.assertIs(self.camera.wait_for_result(ticket, timeout=1.0), True)
+    self.assertLess(time.monotonic() - start, 0.1)
+    self.assertEqual(repr(open_command.result), "SUPERSEDED")
+
+class TestOpenCommandTable(unittest.TestCase):
+
+  def test_running_command_survives_the_reuse_of_its_slot(self):
+    table = OpenCommandTable(capacity=4)
+    move = table.add(1, table.create("Pan-tiltDrive_absolute", timeout=20.0))
+    for sequence_no in range(2, 10):
+      table.complete(table.add(sequence_no, table.create("Pan-tiltPosInq", timeout=1.0)), True)
+
+    # the slot of the move has been reused twice, it is still pending and found by its sequence number
+    self.assertFalse(move.completed.is_set())
+    self.assertIs(table.get(1), move)
+    self.assertEqual(table.in_flight(), [move])
+
+    table.complete(move, True)
+    table.expire()
+    self.assertIsNone(table.get(1))
+    self.assertEqual(table.displaced, {})
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,242 @@
+# module that moves the camera along a timed, eased path between two poses
+
+import math
+import threading
+import time
+import numpy as np
+import sys
+sys.path.append('..')
+import log
+import metrics
+from telemetry import max_pan_speed, max_tilt_speed, max_zoom_speed
+from retransmission import command_classes
+from scheduler import PRIORITY_AUTOMATION
+
+logger = log.get_logger("camera.trajectory")
+
+landing_error = metrics.Histogram("camera_trajectory_landing_error", "Largest axis error of a trajectory at the end of its duration",
+                                  buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2))
+missed_ticks = metrics.Counter("camera_trajectory_missed_ticks_total", "Ticks of trajectories that were skipped because the previous tick overran")
+
+max_speeds = np.array([max_pan_speed, max_tilt_speed, max_zoom_speed])
+
+# the minimum jerk profile s(u) = 10u^3 - 15u^4 + 6u^5 reaches its peak velocity 1.875 at u = 0.5
+peak_velocity_factor = 1.875
+
+def plan(start, target, duration, tick):
+  """
+  Precompute the minimum jerk path from start to target, which starts and ends at rest.
+  :param start: pose (x, y, zoom) at the beginning
+  :param target: pose (x, y, zoom) at the end
+  :return: tuple (times, positions, velocities), times of the ticks in seconds since the start,
+           positions and velocities with one row (x, y, zoom) per tick
+  """
+  start = np.asarray(start, dtype=float)
+  distance = np.asarray(target, dtype=float) - start
+  times = np.append(np.arange(0.0, duration, tick), duration)
+  u = times / duration
+  s = u**3 * (10 - 15*u + 6*u**2)
+  ds = 30 * u**2 * (1 - u)**2 / duration
+  return times, start + np.outer(s, distance), np.outer(ds, distance)
+
+def minimum_duration(start, target):
+  """
+  :return: the shortest duration in seconds of a path from start to target within the maximum speeds
+  """
+  distance = np.abs(np.asarray(target, dtype=float) - np.asarray(start, dtype=float))
+  return float(np.max(peak_velocity_factor * distance / max_speeds))
+
+def drive_commands(velocity):
+  """
+  Quantize a velocity (vx, vy, vzoom) to the continuous motion commands of both axis groups,
+  pan/tilt in 0x18 speed steps, zoom in 8 speed steps.
+  :return: dict of axis group to (command name, args)
+  """
+  pan_tilt_steps = np.minimum(np.rint(np.abs(velocity[:2]) / max_speeds[:2] * 0x18), 0x18).astype(int)
+  zoom_steps = min(int(round(abs(velocity[2]) / max_speeds[2] * 8)), 8)
+
+  if pan_tilt_steps[0] == 0 and pan_tilt_steps[1] == 0:
+    pan_tilt = ("Pan-tiltDrive_Stop", ())
+  else:
+    directions = np.where(pan_tilt_steps > 0, np.sign(velocity[:2]), 0).astype(int)
+    pan_tilt = ("Pan-tiltDrive", (int(directions[0]), int(directions[1]),
+                pan_tilt_steps[0] / 0x18, pan_tilt_steps[1] / 0x18))
+
+  if zoom_steps == 0:
+    zoom = ("CAM_Zoom_Stop", ())
+  elif velocity[2] > 0:
+    zoom = ("CAM_Zoom_Tele_Variable", (zoom_steps-1,))
+  else:
+    zoom = ("CAM_Zoom_Wide_Variable", (zoom_steps-1,))
+
+  return {"pan_tilt": pan_tilt, "zoom": zoom}
+
+class TrajectoryMove:
+  """
+  One running move of a TrajectoryEngine.
+  """
+  def __init__(self, target, duration):
+    self.target = np.asarray(target, dtype=float)
+    self.duration = duration
+    self.cancelled = threading.Event()
+    self.finished = threading.Event()
+
+    # largest axis error at the end of the duration, before the final correction, None if the move failed
+    self.error = None
+    self.result = False
+
+  def cancel(self):
+    self.cancelled.set()
+
+  def wait(self, timeout=None):
+    """
+    Block until the move has ended.
+    :return: True if the camera reached the target, False if the move failed or was cancelled, None on timeout
+    """
+    if not self.finished.wait(timeout):
+      return None
+    return self.result
+
+class TrajectoryEngine:
+  """
+  Moves the camera along a precomputed path of pan, tilt and zoom, so all axes start and finish together.
+  On every tick of a fixed schedule on the monotonic clock, the velocity of the path is sent as continuous
+  motion commands, corrected by the difference between the path and the pose reported by the camera.
+  Ticks are scheduled on absolute times, so a late tick does not delay the following ones, and the path
+  is always sampled at the actual elapsed time. At the end, absolute moves to the target remove the
+  remaining error of the quantized speeds.
+  """
+  def __init__(self, camera, tick=0.05, gain=2.0, landing_speed=0.3, tolerance=0.002):
+    """
+    :param tick: period of the velocity commands in seconds
+    :param gain: feedback gain in 1/s, the position error that is corrected per second
+    :param landing_speed: speed in [0,1] of the absolute moves that remove the remaining error
+    :param tolerance: remaining error up to which no absolute moves are sent
+    """
+    self.camera = camera
+    self.tick = tick
+    self.gain = gain
+    self.landing_speed = landing_speed
+    self.tolerance = tolerance
+    self.lock = threading.Lock()
+    self.current_move = None
+
+  def move(self, target, duration):
+    """
+    Start a move to the target in the background, a running move is cancelled.
+    The duration is extended if the camera can not reach the target in time.
+    :param target: pose (x, y, zoom) with x,y in [-1,1] and zoom in [0,1]
+    :param duration: duration of the move in seconds
+    :return: TrajectoryMove
+    """
+    trajectory_move = TrajectoryMove(target, duration)
+    with self.lock:
+      if self.current_move is not None:
+        self.current_move.cancel()
+      self.current_move = trajectory_move
+    threading.Thread(target=self.run, args=(trajectory_move,), daemon=True).start()
+    return trajectory_move
+
+  def cancel(self):
+    """
+    Cancel the running move, the camera stops where it is. No command of the move is sent after this returns.
+    """
+    with self.lock:
+      if self.current_move is not None:
+        self.current_move.cancel()
+        self.current_move = None
+        self.send_stop()
+
+  def is_moving(self):
+    trajectory_move = self.current_move
+    return trajectory_move is not None and not trajectory_move.finished.is_set()
+
+  def run(self, trajectory_move):
+    try:
+      trajectory_move.result = self.follow(trajectory_move)
+    except:
+      logger.exception("Trajectory to %s failed", trajectory_move.target)
+      self.send_stop()
+    finally:
+      with self.lock:
+        if self.current_move is trajectory_move:
+          self.current_move = None
+      trajectory_move.finished.set()
+
+  def follow(self, trajectory_move):
+    camera = self.camera
+    target = trajectory_move.target
+
+    start = camera.get_pose(timeout=1.0)
+    if start is None:
+      logger.warning("Trajectory to %s not started, the camera did not reply.", target)
+      return False
+
+    duration = max(trajectory_move.duration, minimum_duration(start, target))
+    if duration > trajectory_move.duration:
+      logger.info("Trajectory to %s takes %.2f s instead of %.2f s", target, duration, trajectory_move.duration)
+    times, positions, velocities = plan(start, target, duration, self.tick)
+
+    sent_commands = {}
+    start_time = time.monotonic()
+    tick_no = 0
+    while not trajectory_move.cancelled.is_set():
+      elapsed = time.monotonic() - start_time
+      if elapsed >= duration:
+        break
+      index = min(int(elapsed / self.tick + 0.5), len(times) - 1)
+      velocity = velocities[index].copy()
+
+      # correct the error to the path at the time of the pose inquiry
+      pose = camera.get_pose(max_age=self.tick/2, timeout=self.tick)
+      if pose is not None:
+        pose_elapsed = min(max(camera.pose_time - start_time, 0.0), duration)
+        planned = [np.interp(pose_elapsed, times, positions[:,axis]) for axis in range(3)]
+        velocity += self.gain * (np.array(planned) - pose)
+
+      with self.lock:
+        if trajectory_move.cancelled.is_set():
+          break
+        for axis_group, command in drive_commands(velocity).items():
+          if command != sent_commands.get(axis_group):
+            # the drives yield the sockets of the camera to the operator, the stops keep the priority of stops
+            priority = PRIORITY_AUTOMATION if command_classes.get(command[0]) == "drive" else None
+            camera.send_command(command[0], *command[1], priority=priority)
+            sent_commands[axis_group] = command
+
+      # next tick on the absolute schedule, skip the ticks that have already passed
+      tick_no += 1
+      now = time.monotonic()
+      next_tick_no = max(tick_no, math.ceil((now - start_time) / self.tick))
+      if next_tick_no > tick_no:
+        missed_ticks.inc(amount=next_tick_no - tick_no)
+        tick_no = next_tick_no
+      trajectory_move.cancelled.wait(start_time + tick_no * self.tick - now)
+
+    # a cancelled move leaves the camera to the next move or to whoever cancelled it
+    with self.lock:
+      if trajectory_move.cancelled.is_set():
+        return False
+      self.send_stop()
+
+    # land on the target
+    pose = camera.get_pose(timeout=1.0)
+    if pose is None:
+      return False
+    error = np.abs(target - pose)
+    trajectory_move.error = float(error.max())
+    landing_error.observe(trajectory_move.error)
+    logger.debug("Trajectory to %s ended with error %s after %.3f s", target, error, time.monotonic() - start_time)
+    if trajectory_move.error <= self.tolerance:
+      return True
+
+    with self.lock:
+      if trajectory_move.cancelled.is_set():
+        return False
+      pan_tilt_sequence_no = camera.send_command("Pan-tiltDrive_absolute", target[0], target[1], self.landing_speed, self.landing_speed)
+      zoom_sequence_no = camera.send_command("CAM_Zoom_Direct_Speed", target[2], self.landing_speed)
+    return bool(camera.wait_for_result(pan_tilt_sequence_no)) and bool(camera.wait_for_result(zoom_sequence_no))
+
+  def send_stop(self):
+    self.camera.send_command("Pan-tiltDrive_Stop")
+    self.camera.send_command("CAM_Zoom_Stop")
@@ -1,3 +1,46 @@
 # This script contains the namespace for global variables.
 
 ptz_camera_ip_address = "172.17.1.103"
+
+# all PTZ cameras, driven by camera_group.CameraGroup
+ptz_camera_ip_addresses = [ptz_camera_ip_address]
+
+# level of the log records that are written, and levels of single subsystems, see log.py,
+# e.g. {"camera.packets": "DEBUG"} writes every sent and received VISCA message
+log_level = "INFO"
+log_levels = {}
+
+# port of the local HTTP server that serves the metrics in the Prometheus text format, None disables it
+metrics_port = 9101
+
+# time in seconds between two health checks of the components by runtime.Runtime, a component that fails
+# is restarted at once, see runtime.py, the health is served on /health of the metrics server
+health_check_interval = 1.0
+
+# show the Gtk user interface of web_interface/web_interface.py
+web_interface_enabled = False
+
+# maximum rate of the drive commands of the mouse per axis group in commands per second,
+# and time in seconds after which the current drive command is sent again while the camera moves
+mouse_max_command_rate = 20.0
+mouse_keepalive = 1.0
+
+# input shaping of the mouse per axis (pan, tilt, zoom), see mouse/input_shaping.py: deflections up to the dead zone
+# are zero, expo 0 is a linear and 1 a cubic response, smoothing is the time constant of the filter in seconds
+mouse_dead_zone = (0.05, 0.05, 0.1)
+mouse_expo = (0.4, 0.4, 0.0)
+mouse_smoothing = 0.05
+
+# file and number of the preset slots of the camera pose, see camera/preset_bank.py, every camera has its own file,
+# {} is replaced with the IP address of the camera (and its port, if it is not the VISCA-over-IP port 52381)
+preset_file = "presets-{}.bin"
+preset_slots = 16
+
+# duration in seconds of the trajectory of a preset recall, see camera/trajectory.py,
+# None moves pan/tilt and zoom with absolute moves at a fixed speed instead
+preset_move_duration = 3.0
+
+# SpaceMouse of each camera by the IP address of the camera: its serial number or its USB port,
+# e.g. "usb-0000:00:14.0-2/input0", as listed by mouse/hid_devices.py, cameras without entry get the
+# remaining SpaceMice in the order they are plugged in
+mouse_bindings = {}
@@ -2,14 +2,52 @@
 
 # source: https://unix.stackexchange.com/a/144735
 # by phemmer
+#
+# reads the device names and the serials from sysfs instead of calling udevadm twice per device,
+# mouse/hid_devices.py lists the SpaceMouse devices with their ports
+#
+# the serial is built like ID_SERIAL of the usb_id builtin of udev: vendor_model_serial, with the vendor and
+# product id if the device has no manufacturer or product string, and without the serial if it has none
+
+shopt -s extglob
+
+# like udev: strip the whitespace at the ends, replace inner whitespace and characters that are not allowed by "_",
+# the result is assigned to the variable with the name $1
+udev_string() {
+    local s="$2"
+    s="${s##+([[:space:]])}"
+    s="${s%%+([[:space:]])}"
+    s="${s//+([[:space:]])/_}"
+    printf -v "$1" "%s" "${s//[^[:alnum:]#+.:=@_-]/_}"
+}
+
+# udev ignores serials with characters outside of printable ASCII or with a comma
+is_valid_serial() {
+    local LC_ALL=C
+    [[ "$1" != *[^\ -~]* && "$1" != *,* ]]
+}
 
 for sysdevpath in $(find /sys/bus/usb/devices/usb*/ -name dev); do
-    (
-        syspath="${sysdevpath%/dev}"
-        devname="$(udevadm info -q name -p $syspath)"
-        [[ "$devname" == "bus/"* ]] && exit
-        eval "$(udevadm info -q property --export -p $syspath)"
-        [[ -z "$ID_SERIAL" ]] && exit
-        echo "/dev/$devname - $ID_SERIAL"
-    )
+    syspath="${sysdevpath%/dev}"
+    devname=""
+    while IFS="=" read -r key value; do
+        [[ "$key" == "DEVNAME" ]] && devname="$value"
+    done < "$syspath/uevent"
+    [[ -z "$devname" || "$devname" == "bus/"* ]] && continue
+
+    # the USB device is the nearest parent with a vendor id
+    usbpath="$syspath"
+    while [[ "$usbpath" == /sys/* && ! -e "$usbpath/idVendor" ]]; do
+        usbpath="${usbpath%/*}"
+    done
+    [[ -e "$usbpath/idVendor" ]] || continue
+    vendor="$(< "$usbpath/idVendor")" model="$(< "$usbpath/idProduct")" serial=""
+    [[ -e "$usbpath/manufacturer" ]] && vendor="$(< "$usbpath/manufacturer")"
+    [[ -e "$usbpath/product" ]] && model="$(< "$usbpath/product")"
+    [[ -e "$usbpath/serial" ]] && serial="$(< "$usbpath/serial")"
+    is_valid_serial "$serial" || serial=""
+    udev_string vendor "$vendor"
+    udev_string model "$model"
+    udev_string serial "$serial"
+    echo "/dev/$devname - ${vendor}_${model}${serial:+_$serial}"
 done
@@ -0,0 +1,117 @@
+# This script contains the logging of all modules.
+#
+# Every subsystem logs to its own logger, e.g. "camera", "camera.packets", "mouse" or "spacemouse",
+# whose level can be set separately in globals.log_levels or with set_level(). The records are handed
+# through a queue to a background thread that formats and writes them, so a blocking stdout never
+# blocks the control threads. Messages are formatted lazily with %-style arguments, which must not be
+# changed after the logging call.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+import globals
+
+# formats of the written records
+log_format = "[%(asctime)s.%(msecs)03d] %(name)s %(levelname)s: %(message)s"
+date_format = "%H:%M:%S"
+
+queue_listener = None
+setup_lock = threading.Lock()
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+  """
+  Queue handler that leaves the formatting of the message to the writer thread.
+  """
+  def prepare(self, record):
+    return record
+
+class RateLimitedLogger(logging.LoggerAdapter):
+  """
+  Logger that lets at most one record of each message per interval pass, for messages on hot paths.
+  The check is done before a record is created, so suppressed messages cost almost nothing.
+  The next record that passes reports how many records of the message were suppressed.
+  """
+  def __init__(self, logger, interval):
+    super().__init__(logger, {})
+    self.interval = interval
+    self.last = {}
+
+  def log(self, level, msg, *args, **kwargs):
+    if not self.logger.isEnabledFor(level):
+      return
+    now = time.monotonic()
+    last_time, suppressed = self.last.get(msg, (None, 0))
+    if last_time is not None and now - last_time < self.interval:
+      self.last[msg] = (last_time, suppressed + 1)
+      return
+
+    self.last[msg] = (now, 0)
+    if suppressed:
+      msg = "{} ({} similar messages suppressed)".format(msg, suppressed)
+    self.logger.log(level, msg, *args, **kwargs)
+
+def setup(level=None, levels=None, stream=None):
+  """
+  Start the writer thread and set the levels of the subsystems. Called by get_logger() if it was not called before.
+  :param level: level of all subsystems without their own level, None uses globals.log_level
+  :param levels: dict of subsystem name to level, None uses globals.log_levels
+  :param stream: stream that the records are written to, None uses stdout
+  """
+  global queue_listener
+  with setup_lock:
+    if queue_listener is not None:
+      return
+
+    stream_handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+    stream_handler.setFormatter(logging.Formatter(log_format, date_format))
+
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(DeferredQueueHandler(log_queue))
+    root_logger.setLevel(getattr(globals, "log_level", "INFO") if level is None else level)
+    for subsystem, subsystem_level in (getattr(globals, "log_levels", {}) if levels is None else levels).items():
+      set_level(subsystem, subsystem_level)
+
+    queue_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    queue_listener.start()
+    atexit.register(shutdown)
+
+def shutdown():
+  """
+  Write the queued records and stop the writer thread.
+  """
+  global queue_listener
+  with setup_lock:
+    if queue_listener is not None:
+      queue_listener.stop()
+      logging.getLogger().handlers = [handler for handler in logging.getLogger().handlers
+                                      if not isinstance(handler, DeferredQueueHandler)]
+      queue_listener = None
+
+def get_logger(subsystem, rate_limit=None):
+  """
+  Get the logger of a subsystem.
+  :param rate_limit: minimum time in seconds between two records of the same message, None does not limit the rate
+  """
+  if queue_listener is None:
+    setup()
+  logger = logging.getLogger(subsystem)
+  if rate_limit is not None:
+    return RateLimitedLogger(logger, rate_limit)
+  return logger
+
+def set_level(subsystem, level):
+  """
+  Switch the records of a subsystem (and its children) below the given level off, e.g. set_level("camera.packets", "DEBUG").
+  """
+  logging.getLogger(subsystem).setLevel(level)
+
+def disable(subsystem):
+  """
+  Switch all records of a subsystem (and its children) off.
+  """
+  logging.getLogger(subsystem).setLevel(logging.CRITICAL + 1)
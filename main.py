@@ -2,14 +2,16 @@
 
 # This is the main module which starts all functionality of the streaming software.
 if __name__ == "__main__":
-  import sys, os
   import time
-  import datetime
-  import threading
-  import traceback
+  start_time = time.perf_counter()
+  import sys
   import globals    # global variables
+  import log        # logging of all modules
+  import metrics    # metrics of all modules
+  import runtime    # lifecycle of all components
   
-  print("main.py started at {}".format(time.strftime("%d.%m.%Y %H:%M:%S")))
+  logger = log.get_logger("main")
+  logger.info("main.py started at %s", time.strftime("%d.%m.%Y %H:%M:%S"))
   
   # global catch block
   try:
@@ -20,30 +22,47 @@ if __name__ == "__main__":
     sys.path.insert(0, 'mouse')
     sys.path.insert(0, 'web_interface')
     
-    # import scripts from subdirectories
-    import camera
-    import mouse
-    import video
-    import web_interface
+    # import scripts from subdirectories, the mouse (numpy, hid) and the web interface (gi)
+    # are imported by their components when they start, see runtime.LazyComponent
+    import camera_group
+    logger.info("Startup: imports done after %.1f ms", (time.perf_counter() - start_time) * 1000)
     
-    # initialize camera
-    camera = camera.Camera(ip_address=globals.ptz_camera_ip_address)
-    #camera.command("debug")
+    # all components with their threads and sockets, started at the same time, supervised and stopped by the runtime
+    supervisor = runtime.Runtime(globals.health_check_interval)
+    
+    # serve the metrics for Prometheus and the health of the components
+    if globals.metrics_port is not None:
+      supervisor.add(runtime.MetricsServerComponent(globals.metrics_port))
+      metrics.health_check = supervisor.health
     
-    # start main loop for mouse in separate thread
-    def mouse_thread(camera):
-      mouse.loop(camera)
+    # initialize cameras, they do not wait for the mouse
+    cameras = supervisor.add(camera_group.CameraGroupComponent(globals.ptz_camera_ip_addresses))
+    #camera.command("debug")
     
-    thread = threading.Thread(group=None, target=mouse_thread, args=[camera])
-    thread.start()
+    # main loop for mouse, one per camera with the SpaceMouse bound to it
+    input_devices = supervisor.add(runtime.LazyComponent("input devices", "mouse",
+      lambda mouse: mouse.InputDevicesComponent()))
+    for index, ip_address in enumerate(globals.ptz_camera_ip_addresses):
+      if isinstance(ip_address, tuple):
+        ip_address = ip_address[0]
+      mouse_key = globals.mouse_bindings.get(ip_address)
+      supervisor.add(runtime.LazyComponent("mouse {}".format(ip_address), "mouse",
+        lambda mouse, index=index, mouse_key=mouse_key: mouse.MouseComponent(cameras, input_devices, index, mouse_key),
+        requires=[cameras, input_devices]))
 
     # initialize video module
+    #import video
     #video.debug()
     
     # initialize web interface
-    #web_interface.main_loop()
-    print("main.py ended at {}".format(time.strftime("%d.%m.%Y %H:%M:%S")))
+    if globals.web_interface_enabled:
+      supervisor.add(runtime.LazyComponent("web interface", "web_interface",
+        lambda web_interface: web_interface.WebInterfaceComponent()))
+    
+    # run until Ctrl+C or SIGTERM, then stop all components
+    supervisor.install_signal_handlers()
+    supervisor.run(start_time)
+    logger.info("main.py ended at %s", time.strftime("%d.%m.%Y %H:%M:%S"))
     
   except:
-    print("An error occured at {}".format(time.strftime("%d.%m.%Y %H:%M:%S")))
-    traceback.print_exc()
+    logger.exception("An error occured at %s", time.strftime("%d.%m.%Y %H:%M:%S"))
@@ -0,0 +1,147 @@
+# This script contains the metrics of all modules.
+#
+# Counters and histograms are registered once at import time of the modules that record them and are
+# served in the Prometheus text format by a small HTTP server, see start_server(). Recording a value is
+# a dict lookup of the labels and an increment under a lock, so it can be done on every message.
+
+import bisect
+import json
+import threading
+import http.server
+import log
+
+logger = log.get_logger("metrics")
+
+# default buckets of the latency histograms in seconds
+latency_buckets = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+# all registered metrics, in the order they are rendered
+registry = []
+
+# function that returns a dict with a "healthy" flag, served as JSON on /health, e.g. runtime.Runtime.health
+health_check = None
+
+def escape(value):
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(label_names, label_values, extra=""):
+  labels = ",".join("{}=\"{}\"".format(name, escape(value)) for name, value in zip(label_names, label_values))
+  if extra:
+    labels = labels + "," + extra if labels else extra
+  return "{" + labels + "}" if labels else ""
+
+class Counter:
+  """
+  Monotonically increasing count, e.g. of sent messages, one value per combination of label values.
+  """
+  def __init__(self, name, help_text, label_names=()):
+    self.name = name
+    self.help_text = help_text
+    self.label_names = label_names
+    self.values = {}
+    self.lock = threading.Lock()
+    registry.append(self)
+
+  def inc(self, *label_values, amount=1):
+    with self.lock:
+      self.values[label_values] = self.values.get(label_values, 0) + amount
+
+  def render(self):
+    lines = ["# HELP {} {}".format(self.name, self.help_text), "# TYPE {} counter".format(self.name)]
+    with self.lock:
+      values = list(self.values.items())
+    for label_values, value in values:
+      lines.append("{}{} {}".format(self.name, format_labels(self.label_names, label_values), value))
+    return lines
+
+class Histogram:
+  """
+  Distribution of observed values, e.g. round trip times, in fixed buckets per combination of label values.
+  """
+  def __init__(self, name, help_text, label_names=(), buckets=latency_buckets):
+    self.name = name
+    self.help_text = help_text
+    self.label_names = label_names
+    self.buckets = tuple(buckets)
+    self.values = {}
+    self.lock = threading.Lock()
+    registry.append(self)
+
+  def observe(self, value, *label_values):
+    index = bisect.bisect_left(self.buckets, value)
+    with self.lock:
+      entry = self.values.get(label_values)
+      if entry is None:
+        # counts per bucket (the last one is +Inf), sum of the values
+        entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+      entry[0][index] += 1
+      entry[1] += value
+
+  def render(self):
+    lines = ["# HELP {} {}".format(self.name, self.help_text), "# TYPE {} histogram".format(self.name)]
+    with self.lock:
+      values = [(label_values, list(counts), total) for label_values, (counts, total) in self.values.items()]
+    for label_values, counts, total in values:
+      cumulative = 0
+      for bound, count in zip(self.buckets + ("+Inf",), counts):
+        cumulative += count
+        lines.append("{}_bucket{} {}".format(self.name, format_labels(self.label_names, label_values, "le=\"{}\"".format(bound)), cumulative))
+      lines.append("{}_sum{} {}".format(self.name, format_labels(self.label_names, label_values), total))
+      lines.append("{}_count{} {}".format(self.name, format_labels(self.label_names, label_values), cumulative))
+    return lines
+
+def percentiles(samples):
+  """
+  Summary of the latencies of a benchmark, unlike the histograms with exact percentiles.
+  :param samples: durations in seconds
+  :return: dict of the count, percentiles and maximum of the samples in milliseconds
+  """
+  samples = sorted(samples)
+  if not samples:
+    return {"count": 0}
+  def percentile(p):
+    return samples[min((int)(p / 100 * len(samples)), len(samples)-1)] * 1e3
+  return {"count": len(samples), "p50_ms": percentile(50), "p90_ms": percentile(90), "p99_ms": percentile(99),
+          "max_ms": samples[-1] * 1e3}
+
+def render():
+  """
+  :return: all metrics in the Prometheus text format
+  """
+  lines = []
+  for metric in registry:
+    lines.extend(metric.render())
+  return "\n".join(lines) + "\n"
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path == "/health" and health_check is not None:
+      health = health_check()
+      body = json.dumps(health, indent=2).encode()
+      self.send_response(200 if health["healthy"] else 503)
+      self.send_header("Content-Type", "application/json")
+    elif self.path in ("/metrics", "/"):
+      body = render().encode()
+      self.send_response(200)
+      self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    else:
+      self.send_error(404)
+      return
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    logger.debug(format, *args)
+
+def start_server(port=9101, host="127.0.0.1"):
+  """
+  Serve the metrics on http://host:port/metrics, and health_check on /health, in a background thread.
+  :return: the server, server.shutdown() stops it, server.thread is its thread
+  """
+  server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+  server.daemon_threads = True
+  server.thread = threading.Thread(target=server.serve_forever, daemon=True)
+  server.thread.start()
+  logger.info("serving metrics on http://%s:%s/metrics", host, server.server_address[1])
+  return server
@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+# module that records the raw HID reports of a SpaceMouse to a capture file and replays them
+
+import collections
+import datetime
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+sys.path.append('..')
+import log
+
+# the file starts with the magic, the format version, the wall clock time and the monotonic time at its creation
+file_magic = b"HIDCAPTR"
+file_header_struct = struct.Struct("<8sBdd")
+file_version = 1
+
+# each record: monotonic time and length of the report, followed by the report
+record_header_struct = struct.Struct("<dB")
+
+Record = collections.namedtuple("Record", ["time", "report"])
+
+class CaptureWriter:
+  """
+  Writer of a capture file of HID reports, buffered and locked like capture.CaptureWriter of the camera,
+  an existing file is replaced.
+  """
+  def __init__(self, path, buffer_size=1 << 16):
+    self.path = path
+    self.lock = threading.Lock()
+    self.file = open(path, "wb", buffering=buffer_size)
+    self.file.write(file_header_struct.pack(file_magic, file_version, time.time(), time.monotonic()))
+
+  def record(self, report):
+    """
+    Append a report as read from the device, a list of ints or bytes.
+    """
+    report = bytes(report)
+    record = record_header_struct.pack(time.monotonic(), len(report)) + report
+    with self.lock:
+      if not self.file.closed:
+        self.file.write(record)
+
+  def flush(self):
+    with self.lock:
+      if not self.file.closed:
+        self.file.flush()
+
+  def close(self):
+    with self.lock:
+      self.file.close()
+
+def read_capture(path):
+  """
+  Read the records of a capture file.
+  :return: tuple (wall clock time of the start of the capture, list of Record), the record times are in seconds since the first report
+  """
+  with open(path, "rb") as f:
+    data = f.read()
+  magic, version, start_wall_time, start_time = file_header_struct.unpack_from(data)
+  if magic != file_magic or version != file_version:
+    raise ValueError("{} is not a HID capture file of version {}".format(path, file_version))
+
+  records = []
+  position = file_header_struct.size
+  while position + record_header_struct.size <= len(data):
+    t, length = record_header_struct.unpack_from(data, position)
+    position += record_header_struct.size
+    records.append(Record(t, data[position:position+length]))
+    position += length
+
+  first_time = records[0].time if records else start_time
+  return start_wall_time + first_time - start_time, [Record(t - first_time, report) for t, report in records]
+
+class ReplayDevice:
+  """
+  Replacement of hid.device that returns the reports of a capture, with their recorded timing divided by
+  speed, or as fast as they are read if speed is None. As fast as possible, a blocking read waits for the
+  event handled if it is not None, so the reader can be paced by the consumer of the reports.
+  After the last report, reads block until their timeout, like a device that is not touched anymore, and finished is set.
+  """
+  def __init__(self, records, speed=1.0):
+    self.records = records
+    self.speed = speed
+    self.position = 0
+    self.is_nonblocking = False
+    self.start_time = None
+    self.finished = threading.Event()
+    self.handled = None
+
+    # time.perf_counter() at which each report was returned by read()
+    self.delivery_times = []
+
+  def open(self, vendor_id=None, product_id=None):
+    pass
+
+  def open_path(self, path):
+    pass
+
+  def close(self):
+    pass
+
+  def get_manufacturer_string(self):
+    return "replay"
+
+  def get_product_string(self):
+    return "{} reports".format(len(self.records))
+
+  def set_nonblocking(self, value):
+    self.is_nonblocking = bool(value)
+
+  def read(self, max_length, timeout_ms=0):
+    if self.start_time is None:
+      self.start_time = time.monotonic()
+
+    timeout = timeout_ms / 1000 if timeout_ms > 0 else None
+    if self.position >= len(self.records):
+      self.finished.set()
+      if not self.is_nonblocking:
+        threading.Event().wait(timeout)
+      return []
+
+    # as fast as possible, every report is read on its own as if it arrived after the previous one was handled
+    record = self.records[self.position]
+    if self.speed is None:
+      if self.is_nonblocking:
+        return []
+      if self.handled is not None:
+        if not self.handled.wait(timeout):
+          return []
+        self.handled.clear()
+    else:
+      delay = self.start_time + record.time / self.speed - time.monotonic()
+      if delay > 0:
+        if self.is_nonblocking:
+          return []
+        if timeout is not None and delay > timeout:
+          time.sleep(timeout)
+          return []
+        time.sleep(delay)
+
+    self.position += 1
+    self.delivery_times.append(time.perf_counter())
+    return list(record.report[:max_length])
+
+class CountingCamera:
+  """
+  Fake camera for the replay, which records the time of each command instead of sending it.
+  """
+  def __init__(self, pose=(0.0, 0.0, 0.0)):
+    # the address names the preset file of the replay, see mouse.preset_path
+    self.ip_address = "replay"
+    self.port = 52381
+    self.pose = pose
+    self.pose_time = None
+    self.commands = []
+    self.lock = threading.Lock()
+
+  def send_command(self, command_name, *args, **kwargs):
+    with self.lock:
+      self.commands.append((time.perf_counter(), command_name, args))
+      return len(self.commands)
+
+  def wait_for_result(self, sequence_no, timeout=None):
+    return True
+
+  def get_pose(self, max_age=0.0, timeout=None):
+    self.pose_time = time.monotonic()
+    return self.pose
+
+def replay_loop(records, speed=None, settle=0.2):
+  """
+  Feed the reports of a capture through SpaceMouse and mouse.loop into a CountingCamera.
+  :param settle: time in seconds that the loop may react to the last report
+  :return: dict with the number of reports and commands, the commands per second of the capture
+           and the latency from each report to the first command that followed it
+  """
+  # mouse.loop uses the presets and trajectories of the camera module
+  sys.path.append('../camera')
+  import spacemouse
+  import mouse
+  import metrics
+
+  device = ReplayDevice(records, speed)
+  camera = CountingCamera()
+  space_mouse = spacemouse.SpaceMouse(device=device)
+
+  # as fast as possible, the next report is read when the loop waits again, i.e. has handled the previous one
+  if speed is None:
+    device.handled = threading.Event()
+    wait_for_change = space_mouse.wait_for_change
+    def paced_wait_for_change(*args, **kwargs):
+      device.handled.set()
+      return wait_for_change(*args, **kwargs)
+    space_mouse.wait_for_change = paced_wait_for_change
+  # the presets of the replay are not mixed up with those of a camera
+  with tempfile.TemporaryDirectory() as directory:
+    start = time.perf_counter()
+    loop_thread = threading.Thread(target=mouse.loop, args=(camera, None, space_mouse, os.path.join(directory, "presets.bin")))
+    loop_thread.start()
+    try:
+      device.finished.wait()
+      time.sleep(settle)
+      replay_seconds = time.perf_counter() - start
+      with camera.lock:
+        sent = list(camera.commands)
+    finally:
+      # closing the SpaceMouse closes the device and ends the loop
+      space_mouse.close()
+      loop_thread.join()
+
+  # latency of the reactions: the first command after a report, before the next report
+  latencies = []
+  delivery_times = device.delivery_times
+  index = 0
+  for send_time, command_name, args in sent:
+    while index + 1 < len(delivery_times) and delivery_times[index + 1] <= send_time:
+      index += 1
+    if index < len(delivery_times) and delivery_times[index] <= send_time:
+      latencies.append(send_time - delivery_times[index])
+      index += 1
+
+  capture_seconds = records[-1].time if records else 0.0
+  return {
+    "reports": len(records),
+    "capture_seconds": capture_seconds,
+    "replay_seconds": replay_seconds,
+    "commands": len(sent),
+    "commands_per_capture_second": len(sent) / capture_seconds if capture_seconds else None,
+    "commands_by_name": dict(collections.Counter(command_name for send_time, command_name, args in sent)),
+    "input_to_command": metrics.percentiles(latencies),
+  }
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="Replay of SpaceMouse capture files")
+  parser.add_argument("mode", choices=["info", "run"],
+                      help="info: summary of the capture, run: replay through mouse.loop into a fake camera and print the results as JSON")
+  parser.add_argument("path", help="capture file written by SpaceMouse.start_capture")
+  parser.add_argument("--speed", type=float, default=None, help="replay speed, 1 is the recorded timing, default is as fast as possible; "
+                      "the rate limit of mouse.loop works in real time, so only speed 1 gives the command volume of the session")
+  args = parser.parse_args()
+
+  # log to stderr, the results are written to stdout
+  log.setup(stream=sys.stderr)
+
+  start_wall_time, records = read_capture(args.path)
+  print("capture of {:%Y-%m-%d %H:%M:%S} with {} reports over {:.1f} s".format(
+    datetime.datetime.fromtimestamp(start_wall_time), len(records), records[-1].time if records else 0.0), file=sys.stderr)
+
+  if args.mode == "info":
+    print(json.dumps(dict(collections.Counter("type {}".format(record.report[0]) for record in records if record.report)), indent=2))
+  else:
+    print(json.dumps(replay_loop(records, args.speed), indent=2))
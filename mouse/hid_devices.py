@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+# module that finds HID devices and watches them being plugged in and out
+
+import collections
+import os
+import selectors
+import socket
+import sys
+import threading
+sys.path.append('..')
+import log
+
+logger = log.get_logger("hid")
+
+# a HID device: the device node, or the path of hid.enumerate() on systems without sysfs, see hidapi_path() for
+# the path to open it with hid.device().open_path(), the serial number (empty if the device has none)
+# and the physical port, e.g. "usb-0000:00:14.0-2/input0", which stays the same when the device is plugged in again
+HidDevice = collections.namedtuple("HidDevice", ["path", "vendor_id", "product_id", "serial_number", "port", "name"])
+
+# vendor id of 3Dconnexion and the product ids of older 3Dconnexion devices with the vendor id of Logitech
+vendor_id_3dconnexion = 0x256f
+vendor_id_logitech = 0x046d
+product_ids_logitech = {0xc603, 0xc605, 0xc606, 0xc621, 0xc623, 0xc625, 0xc626, 0xc627, 0xc628, 0xc629, 0xc62b}
+
+sysfs_hidraw = "/sys/class/hidraw"
+
+def is_space_mouse(device):
+  """
+  Check if a HidDevice is a 3Dconnexion device.
+  """
+  return device.vendor_id == vendor_id_3dconnexion or (device.vendor_id == vendor_id_logitech and device.product_id in product_ids_logitech)
+
+def read_hidraw(name):
+  """
+  Read the HID properties of the hidraw device with the given name, e.g. "hidraw3", from sysfs.
+  :return: HidDevice, None if the device is gone
+  """
+  try:
+    with open(os.path.join(sysfs_hidraw, name, "device", "uevent")) as f:
+      properties = dict(line.split("=", 1) for line in f.read().splitlines() if "=" in line)
+  except OSError:
+    return None
+
+  # HID_ID=<bus>:<vendor id>:<product id>
+  try:
+    bus, vendor_id, product_id = properties["HID_ID"].split(":")
+    vendor_id, product_id = int(vendor_id, 16), int(product_id, 16)
+  except (KeyError, ValueError):
+    return None
+  return HidDevice(os.path.join("/dev", name).encode(), vendor_id, product_id, properties.get("HID_UNIQ", ""),
+                   properties.get("HID_PHYS", ""), properties.get("HID_NAME", ""))
+
+def scan(match=is_space_mouse):
+  """
+  Find the HID devices in one pass over sysfs, or with hid.enumerate() on systems without sysfs.
+  :param match: function that selects the devices, None returns all devices
+  :return: list of HidDevice, sorted by path
+  """
+  if os.path.isdir(sysfs_hidraw):
+    devices = [read_hidraw(name) for name in os.listdir(sysfs_hidraw)]
+  else:
+    import hid
+    devices = [HidDevice(info["path"], info["vendor_id"], info["product_id"], info.get("serial_number") or "",
+                         info["path"].decode(errors="replace"), info.get("product_string") or "")
+               for info in hid.enumerate()]
+  return sorted((device for device in devices if device is not None and (match is None or match(device))),
+                key=lambda device: device.path)
+
+def libusb_path(device):
+  """
+  Path of a hidraw device in the libusb backend of hidapi, "<bus>:<address>:<interface>" as hex numbers.
+  :return: the path, None if sysfs does not have the USB device of the hidraw device
+  """
+  name = os.path.basename(device.path.decode())
+  try:
+    # the hidraw device belongs to a HID device below the USB interface, which is below the USB device
+    interface_path = os.path.dirname(os.path.realpath(os.path.join(sysfs_hidraw, name, "device")))
+    usb_path = os.path.dirname(interface_path)
+    with open(os.path.join(interface_path, "bInterfaceNumber")) as f:
+      interface_number = int(f.read(), 16)
+    with open(os.path.join(usb_path, "busnum")) as f:
+      bus_number = int(f.read())
+    with open(os.path.join(usb_path, "devnum")) as f:
+      device_address = int(f.read())
+  except (OSError, ValueError):
+    return None
+  return "{:04x}:{:04x}:{:02x}".format(bus_number, device_address, interface_number).encode()
+
+def hidapi_path(device):
+  """
+  Find the path with which hid.device().open_path() opens a HidDevice. The hidraw backend of hidapi opens the
+  device node, which is the path of the devices from sysfs, the libusb backend, the default of the hid module
+  on Linux, its own path, see libusb_path().
+  :return: the path of the matching entry of hid.enumerate(), None if there is no unique match
+  """
+  import hid
+  infos = hid.enumerate(device.vendor_id, device.product_id)
+  for path in (device.path, libusb_path(device)):
+    for info in infos:
+      if info["path"] == path:
+        return path
+
+  # e.g. another backend, the serial number tells the devices apart
+  infos = [info for info in infos if (info.get("serial_number") or "") == device.serial_number]
+  if len(infos) == 1:
+    return infos[0]["path"]
+  return None
+
+class HotplugWatcher:
+  """
+  Reports the matching HID devices that are present when it starts and all that are plugged in or out later.
+  On Linux it listens to the uevents of the kernel on a netlink socket, so a device is reported as soon
+  as it appears, elsewhere it scans the devices every poll_interval seconds.
+  The callbacks are called from the thread of the watcher.
+  """
+  def __init__(self, on_added, on_removed, match=is_space_mouse, poll_interval=1.0):
+    """
+    :param on_added: function that is called with the HidDevice that has been plugged in
+    :param on_removed: function that is called with the path of the device that has been unplugged
+    """
+    self.on_added = on_added
+    self.on_removed = on_removed
+    self.match = match
+    self.poll_interval = poll_interval
+    self.devices = {}
+    self.thread = None
+
+    # the netlink socket, None if it is not available
+    try:
+      self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, socket.NETLINK_KOBJECT_UEVENT)
+      self.socket.bind((0, 1))
+    except (AttributeError, OSError):
+      logger.info("No netlink uevents, scanning for HID devices every %s s", poll_interval)
+      self.socket = None
+
+    self.selector = selectors.DefaultSelector()
+    self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+    self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+    if self.socket is not None:
+      self.selector.register(self.socket, selectors.EVENT_READ)
+    self.is_running = False
+
+  def start(self):
+    self.is_running = True
+    self.update(scan(self.match))
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.is_running = False
+    self.wakeup_sender.send(b"\0")
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def update(self, devices):
+    """
+    Report the differences between the known devices and the given list of present devices.
+    """
+    paths = {device.path for device in devices}
+    for path in [path for path in self.devices if path not in paths]:
+      del self.devices[path]
+      self.on_removed(path)
+    for device in devices:
+      if device.path not in self.devices:
+        self.devices[device.path] = device
+        self.on_added(device)
+
+  def handle_uevent(self, data):
+    """
+    Handle one uevent of the kernel: "action@devpath" followed by KEY=VALUE, separated by zero bytes.
+    """
+    properties = dict(item.split(b"=", 1) for item in data.split(b"\0")[1:] if b"=" in item)
+    if properties.get(b"SUBSYSTEM") != b"hidraw" or b"DEVNAME" not in properties:
+      return
+    name = os.path.basename(properties[b"DEVNAME"].decode())
+    path = os.path.join("/dev", name).encode()
+    action = properties.get(b"ACTION")
+
+    if action == b"add":
+      device = read_hidraw(name)
+      if device is not None and (self.match is None or self.match(device)) and path not in self.devices:
+        self.devices[path] = device
+        self.on_added(device)
+    elif action == b"remove" and path in self.devices:
+      del self.devices[path]
+      self.on_removed(path)
+
+  def run(self):
+    while self.is_running:
+      events = self.selector.select(None if self.socket is not None else self.poll_interval)
+      for key, mask in events:
+        if key.fileobj is self.wakeup_receiver:
+          self.wakeup_receiver.recv(64)
+        else:
+          self.handle_uevent(self.socket.recv(65536))
+      if self.socket is None and self.is_running:
+        self.update(scan(self.match))
+
+if __name__ == "__main__":
+  import argparse
+  import time
+
+  parser = argparse.ArgumentParser(description="List the HID devices, replaces one udevadm call per device")
+  parser.add_argument("--all", action="store_true", help="list all HID devices, not only the 3Dconnexion devices")
+  parser.add_argument("--watch", action="store_true", help="report the devices that are plugged in or out")
+  args = parser.parse_args()
+  match = None if args.all else is_space_mouse
+
+  def print_device(device, event=""):
+    print("{}{} - {:04x}:{:04x} {} (serial: {}, port: {})".format(event, device.path.decode(), device.vendor_id,
+      device.product_id, device.name, device.serial_number or "-", device.port))
+
+  if args.watch:
+    # the devices that are present are reported first
+    watcher = HotplugWatcher(lambda device: print_device(device, "added "), lambda path: print("removed {}".format(path.decode())), match)
+    watcher.start()
+    while True:
+      time.sleep(1)
+  else:
+    for device in scan(match):
+      print_device(device)
@@ -0,0 +1,81 @@
+# module that shapes the SpaceMouse control before it is turned into camera commands
+
+import math
+import time
+import numpy as np
+
+# quantization of the pan/tilt speeds of Pan-tiltDrive (vx*0x18) and number of the zoom speeds (0 to 7)
+pan_tilt_steps = 0x18
+zoom_speeds = 8
+
+class InputShaper:
+  """
+  Dead zone, expo curve and exponential smoothing of the pan, tilt and zoom axis of the mouse, followed by the
+  quantization of the camera commands. The three axes are processed together as one numpy vector.
+  The quantized output only changes when the command that is sent to the camera changes, so the mouse loop
+  can suppress every update whose output equals the last sent one.
+  """
+  def __init__(self, dead_zone=(0.05, 0.05, 0.1), expo=(0.4, 0.4, 0.0), smoothing=0.05):
+    """
+    :param dead_zone: per axis, deflections up to this value are zero, the rest is rescaled to [0,1]
+    :param expo: per axis, 0 is linear, 1 is cubic, values in between give fine control around the center
+    :param smoothing: time constant of the smoothing filter in seconds, 0 disables it
+    """
+    self.dead_zone = np.array(dead_zone, dtype=float)
+    self.expo = np.array(expo, dtype=float)
+    self.smoothing = smoothing
+    self.steps = np.array([pan_tilt_steps, pan_tilt_steps, zoom_speeds], dtype=float)
+
+    self.target = np.zeros(3)
+    self.state = np.zeros(3)
+    self.last_time = None
+
+  def shape(self, values):
+    """
+    Apply dead zone and expo curve.
+    :param values: (x,y,z) in [-1,1]
+    :return: numpy array of the shaped (x,y,z) in [-1,1]
+    """
+    values = np.clip(np.asarray(values, dtype=float), -1.0, 1.0)
+    magnitude = np.maximum(np.abs(values) - self.dead_zone, 0.0) / (1.0 - self.dead_zone)
+    magnitude = (1.0 - self.expo) * magnitude + self.expo * magnitude**3
+    return np.copysign(magnitude, values)
+
+  def quantize(self, values):
+    """
+    :return: tuple of ints (x,y,z): x and y in [-0x18,0x18] are the signed pan/tilt speeds of Pan-tiltDrive,
+             z in [-8,8] is 0 for no zoom or the signed zoom speed plus one
+    """
+    steps = np.abs(values) * self.steps
+    # the slowest zoom speed starts right after the dead zone
+    steps[2] = math.ceil(steps[2])
+    steps = np.minimum(steps, self.steps).astype(int) * np.sign(values).astype(int)
+    return tuple(steps.tolist())
+
+  def update(self, values, now=None):
+    """
+    Feed a new mouse control into the filter.
+    :param values: (x,y,z) in [-1,1]
+    :param now: time.perf_counter() of the control, None uses the current time
+    :return: the quantized output, see quantize()
+    """
+    if now is None:
+      now = time.perf_counter()
+    self.target = self.shape(values)
+
+    if self.smoothing > 0 and self.last_time is not None:
+      alpha = 1.0 - math.exp(-(now - self.last_time) / self.smoothing)
+      self.state += alpha * (self.target - self.state)
+    else:
+      self.state[:] = self.target
+    self.last_time = now
+
+    # released axes stop at once, a smoothed tail would let the camera creep on
+    self.state[self.target == 0] = 0.0
+    return self.quantize(self.state)
+
+  def is_settled(self):
+    """
+    :return: True if the filter output does not change anymore without a new mouse control
+    """
+    return self.quantize(self.state) == self.quantize(self.target)
@@ -2,17 +2,125 @@
 
 import time
 import spacemouse
+import input_shaping
+import preset_bank
+import trajectory
 import numpy as np
-import pickle
+import sys
+sys.path.append('..')
+import globals
+import log
+import metrics
+import runtime
 
-def loop(camera):
+logger = log.get_logger("mouse")
+
+# the mouse vector of every loop iteration, at most once per second
+control_logger = log.get_logger("mouse.control", rate_limit=1.0)
+
+loop_tick_seconds = metrics.Histogram("mouse_loop_tick_seconds", "Time of one iteration of the mouse loop, without its wait")
+input_to_send_seconds = metrics.Histogram("mouse_input_to_send_seconds", "Time from the HID report to the sent drive or stop command", ("axis_group",))
+
+# stop command of each axis group
+stop_commands = {
+  "pan_tilt": "Pan-tiltDrive_Stop",
+  "zoom": "CAM_Zoom_Stop",
+}
+
+def control_commands(x, y, z, sent_commands):
+  """
+  Map the quantized mouse control of input_shaping.InputShaper to the drive command of each axis group.
+  Zooming has precedence, while the mouse zooms the pan-tilt command is not changed.
+  :param sent_commands: the last sent command of each axis group
+  :return: dict of axis group to (command name, args), None stops the axis group
+  """
+  commands = dict(sent_commands)
+
+  if z > 0:
+    commands["zoom"] = ("CAM_Zoom_Tele_Variable", (z-1,))
+  elif z < 0:
+    commands["zoom"] = ("CAM_Zoom_Wide_Variable", (-z-1,))
+  else:
+    commands["zoom"] = None
+
+  direction_x = 0
+  direction_y = 0
+
+  if x < 0:
+    direction_x = -1
+  elif x > 0:
+    direction_x = 1
+
+  if y < 0:
+    direction_y = -1
+  elif y > 0:
+    direction_y = 1
+
+  if x == 0 and y == 0:
+    commands["pan_tilt"] = None
+  elif z == 0:
+    commands["pan_tilt"] = ("Pan-tiltDrive", (direction_x, direction_y,
+      abs(x) / input_shaping.pan_tilt_steps, abs(y) / input_shaping.pan_tilt_steps))
+
+  return commands
+
+def handle_preset_button(camera, presets, trajectories, slot, press_duration):
+  """
+  A long press of a button stores the current pose of the camera in the preset slot of the button,
+  a short press recalls it without waiting for the camera, along a trajectory of globals.preset_move_duration
+  seconds if trajectories is a trajectory.TrajectoryEngine.
+  """
+  # long press
+  if press_duration >= 2:
+
+    # get current absolute position
+    pose = camera.get_pose()
+
+    if pose is None:
+      logger.warning("Save position %s failed, the camera did not reply.", slot+1)
+    else:
+      logger.info("Save position %s (x,y,zoom) = (%s,%s,%s)", slot+1, *pose)
+      presets.store(slot, pose)
+
+  # short press
+  else:
+    pose = presets.get(slot)
+    if pose is None:
+      logger.warning("Position %s has not been saved yet.", slot+1)
+      return
+
+    logger.info("Load position %s (x,y,zoom) = (%s,%s,%s)", slot+1, *pose)
+    if trajectories is not None:
+      trajectories.move(pose, globals.preset_move_duration)
+    else:
+      presets.recall(camera, slot)
+
+def preset_path(camera):
+  """
+  :return: the preset file of the camera, globals.preset_file with the address of the camera
+  """
+  address = camera.ip_address if camera.port == 52381 else "{}_{}".format(camera.ip_address, camera.port)
+  return globals.preset_file.format(address)
+
+def loop(camera, mouse_key=None, space_mouse=None, preset_file=None):
   """
   Main loop to handle mouse input and apply it to the camera.
+  The loop wakes up on every report of the SpaceMouse instead of polling it. The control goes through
+  dead zone, expo curve and smoothing of input_shaping.InputShaper, a drive command is only sent when
+  its quantized speeds change, at most globals.mouse_max_command_rate times per second per axis group, stop commands
+  are sent at once. While an axis group moves, its drive command is sent again every globals.mouse_keepalive seconds.
+  The two buttons store (long press) and recall (short press) the preset slots 0 and 1 of the preset file of the camera,
+  moving the mouse cancels a running recall. The loop ends when the SpaceMouse is closed and stops the camera.
   :param camera: the camera object as defined in camera.py, used to control the PTZ camera.
+  :param mouse_key: serial number or port of the SpaceMouse of the camera, None takes any free SpaceMouse
+  :param space_mouse: SpaceMouse to use instead of one for mouse_key, e.g. with a hid_capture.ReplayDevice
+  :param preset_file: file of the presets of the camera, None uses preset_path(camera)
   """
-  
+
   # get handle to space mouse
-  space_mouse = spacemouse.SpaceMouse()
+  owns_space_mouse = space_mouse is None
+  if owns_space_mouse:
+    space_mouse = spacemouse.SpaceMouse(mouse_key)
 
   #camera.send_command("Tally", True)
   #time.sleep(5.0)
@@ -21,137 +129,158 @@ def loop(camera):
   #camera.send_command("Tally_Mode")
   #time.sleep(5.0)
   #camera.send_command("Tally", False)
-  
+
+  # the position files of older versions belong to the camera of the single camera setup
+  is_default_camera = camera.ip_address == globals.ptz_camera_ip_address and camera.port == 52381
+  legacy_paths = ("pos1", "pos2") if preset_file is None and is_default_camera else ()
+  presets = preset_bank.PresetBank(preset_file or preset_path(camera), globals.preset_slots, legacy_paths=legacy_paths)
+  trajectories = trajectory.TrajectoryEngine(camera) if globals.preset_move_duration else None
+  shaper = input_shaping.InputShaper(globals.mouse_dead_zone, globals.mouse_expo, globals.mouse_smoothing)
+  min_interval = 1.0 / globals.mouse_max_command_rate
+  keepalive = globals.mouse_keepalive
+
+  # last sent drive command of each axis group, None if it is stopped, and the time it was sent
+  sent_commands = {"pan_tilt": None, "zoom": None}
+  send_times = {"pan_tilt": 0.0, "zoom": 0.0}
+
   button_pressed = [False, False]
   time_button_press = [0,0]
-  is_pan_tilt_in_progress = False
-  is_zoom_in_progress = False
-  
-  while True:
-    # control contains: [x,y,z,roll,pitch,yaw]
-    
-    current_vector = np.array(space_mouse.control)
-    #current_control = current_vector - initial_vector
-    
-    x = -current_vector[4]
-    y = -current_vector[3]
-    z = current_vector[5]
-
-    print("mouse control: {} (left button: {}, right button: {})".format(
-      (x,y,z), space_mouse.is_left_button_pressed, space_mouse.is_right_button_pressed))
-        
-    if x == 0 and y == 0 and is_pan_tilt_in_progress:
-      is_pan_tilt_in_progress = False
-      sequence_no = camera.send_command("Pan-tiltDrive_Stop")
-      camera.wait_for_result(sequence_no)
-      
-    if z == 0 and is_zoom_in_progress:
-      is_zoom_in_progress = False
-      sequence_no = camera.send_command("CAM_Zoom_Stop")
-      camera.wait_for_result(sequence_no)
-        
-    direction_x = 0
-    direction_y = 0
-    
-    if x < 0:
-      direction_x = -1
-    elif x > 0:
-      direction_x = 1
-      
-    if y < 0:
-      direction_y = -1
-    elif y > 0:
-      direction_y = 1
-      
-    velocity_x = abs(x)
-    velocity_y = abs(y)
-      
-    if z > 0:
-      zoom_speed = (int)(z*7)
-      sequence_no = camera.send_command("CAM_Zoom_Tele_Variable", zoom_speed)
-      is_zoom_in_progress = True
-    elif z < 0:
-      zoom_speed = (int)(-z*7)
-      sequence_no = camera.send_command("CAM_Zoom_Wide_Variable", zoom_speed)
-      is_zoom_in_progress = True
-    elif x != 0 or y != 0:
-      sequence_no = camera.send_command("Pan-tiltDrive", direction_x, direction_y, velocity_x, velocity_y)
-      is_pan_tilt_in_progress = True
-    
-    time.sleep(0.2)
-    
-    # left button pressed
-    if not button_pressed[0] and space_mouse.is_left_button_pressed:
-      button_pressed[0] = True
-      time_button_press[0] = time.time()
-      
-    # right button pressed
-    elif not button_pressed[1] and space_mouse.is_right_button_pressed:
-      button_pressed[1] = True
-      time_button_press[1] = time.time()
-      
-    # left button released
-    elif button_pressed[0] and not space_mouse.is_left_button_pressed:
-      press_duration = time.time() - time_button_press[0]
-      
-      # long press
-      if press_duration >= 2:
-        
-        # get current absolute position
-        sequence_no = camera.send_command("Pan-tiltPosInq")
-        pos_xy = camera.wait_for_result(sequence_no)
-        
-        sequence_no = camera.send_command("CAM_OpticalZoomPosInq")
-        pos_zoom = camera.wait_for_result(sequence_no)
-        
-        print("Save position 1 (x,y,zoom) = ({},{},{})".format(pos_xy[0], pos_xy[1], pos_zoom))
-        
-        with open("pos1", "wb") as f:
-          pickle.dump((pos_xy, pos_zoom), f)
-      
-      # short press
-      else:
-        with open("pos1", "rb") as f:
-          (pos_xy, pos_zoom) = pickle.load(f)
-        
-        print("Load position 1 (x,y,zoom) = ({},{},{})".format(pos_xy[0], pos_xy[1], pos_zoom))
-        
-        # Pan-tiltDrive_absolute(x,y,vx,vy)
-        sequence_no = camera.send_command("Pan-tiltDrive_absolute", pos_xy[0], pos_xy[1], 0.8, 0.8)
-        camera.wait_for_result(sequence_no)
-    
-        # CAM_Zoom_Direct_Speed(float f, int speed)
-        sequence_no = camera.send_command("CAM_Zoom_Direct_Speed", pos_zoom, 0.8)
-      
-    # right button released
-    elif button_pressed[1] and not space_mouse.is_right_button_pressed:
-      press_duration = time.time() - time_button_press[1]
-      
-      if press_duration >= 2:
-        
-        # get current absolute position
-        sequence_no = camera.send_command("Pan-tiltPosInq")
-        pos_xy = camera.wait_for_result(sequence_no)
-        
-        sequence_no = camera.send_command("CAM_OpticalZoomPosInq")
-        pos_zoom = camera.wait_for_result(sequence_no)
-        
-        print("Save position 2 (x,y,zoom) = ({},{},{})".format(pos_xy[0], pos_xy[1], pos_zoom))
-        
-        with open("pos2", "wb") as f:
-          pickle.dump((pos_xy, pos_zoom), f)
-          
-      # short press
-      else:
-        with open("pos2", "rb") as f:
-          (pos_xy, pos_zoom) = pickle.load(f)
-          
-        print("Load position 2 (x,y,zoom) = ({},{},{})".format(pos_xy[0], pos_xy[1], pos_zoom))
-        
-        # Pan-tiltDrive_absolute(x,y,vx,vy)
-        sequence_no = camera.send_command("Pan-tiltDrive_absolute", pos_xy[0], pos_xy[1], 0.8, 0.8)
-        camera.wait_for_result(sequence_no)
-    
-        # CAM_Zoom_Direct_Speed(float f, int speed)
-        sequence_no = camera.send_command("CAM_Zoom_Direct_Speed", pos_zoom, 0.8)
-        
+  version = 0
+  timeout = None
+  state = np.zeros(spacemouse.state_size)
+
+  try:
+    while not space_mouse.is_closed:
+      # state contains: [x,y,z,roll,pitch,yaw,left button,right button,report time]
+      version, state = space_mouse.wait_for_change(version, timeout, state)
+      tick_start = time.perf_counter()
+      is_left_button_pressed = state[spacemouse.LEFT_BUTTON] != 0
+      is_right_button_pressed = state[spacemouse.RIGHT_BUTTON] != 0
+      report_time = state[spacemouse.REPORT_TIME] if version else None
+
+      x, y, z = shaper.update((-state[4], -state[3], state[5]))
+
+      control_logger.debug("mouse control: %s, quantized: %s (left button: %s, right button: %s)",
+        (-state[4], -state[3], state[5]), (x,y,z), is_left_button_pressed, is_right_button_pressed)
+
+      # send the changed commands, hold back drive commands that exceed the maximum rate
+      timeout = None
+      for axis_group, command in control_commands(x, y, z, sent_commands).items():
+        now = time.perf_counter()
+        deadline = None
+
+        if command == sent_commands[axis_group]:
+          # keep the camera moving
+          if command is not None and now - send_times[axis_group] >= keepalive:
+            camera.send_command(command[0], *command[1])
+            send_times[axis_group] = now
+          if command is not None:
+            deadline = send_times[axis_group] + keepalive
+
+        elif command is not None and now - send_times[axis_group] < min_interval:
+          deadline = send_times[axis_group] + min_interval
+
+        else:
+          # the operator takes over from a running preset move
+          if command is not None and trajectories is not None and trajectories.is_moving():
+            trajectories.cancel()
+          if command is None:
+            camera.send_command(stop_commands[axis_group])
+          else:
+            camera.send_command(command[0], *command[1])
+            deadline = now + min_interval
+          sent_commands[axis_group] = command
+          send_times[axis_group] = now
+          if report_time is not None:
+            input_to_send_seconds.observe(time.perf_counter() - report_time, axis_group)
+
+        if deadline is not None and (timeout is None or deadline - now < timeout):
+          timeout = max(deadline - now, 0)
+
+      # let the smoothing filter converge when no new report comes
+      if not shaper.is_settled() and (timeout is None or shaper.smoothing < timeout):
+        timeout = shaper.smoothing
+
+      loop_tick_seconds.observe(time.perf_counter() - tick_start)
+
+      # left button pressed
+      if not button_pressed[0] and is_left_button_pressed:
+        button_pressed[0] = True
+        time_button_press[0] = time.time()
+
+      # right button pressed
+      elif not button_pressed[1] and is_right_button_pressed:
+        button_pressed[1] = True
+        time_button_press[1] = time.time()
+
+      # left button released
+      elif button_pressed[0] and not is_left_button_pressed:
+        button_pressed[0] = False
+        handle_preset_button(camera, presets, trajectories, 0, time.time() - time_button_press[0])
+
+      # right button released
+      elif button_pressed[1] and not is_right_button_pressed:
+        button_pressed[1] = False
+        handle_preset_button(camera, presets, trajectories, 1, time.time() - time_button_press[1])
+  finally:
+    presets.close()
+    if trajectories is not None:
+      trajectories.cancel()
+    if owns_space_mouse:
+      space_mouse.close()
+
+  # leave the camera standing
+  for axis_group, command in sent_commands.items():
+    if command is not None:
+      camera.send_command(stop_commands[axis_group])
+
+class InputDevicesComponent(runtime.Component):
+  """
+  The pool of the SpaceMouse devices with its hotplug watcher, for runtime.Runtime.
+  """
+  def __init__(self):
+    super().__init__("input devices")
+
+  def start(self):
+    spacemouse.get_pool()
+
+  def stop(self):
+    spacemouse.close_pool()
+
+  def is_healthy(self):
+    pool = spacemouse.pool
+    return pool is not None and pool.watcher.thread is not None and pool.watcher.thread.is_alive()
+
+class MouseComponent(runtime.ThreadComponent):
+  """
+  The loop of one camera of a camera_group.CameraGroupComponent with its SpaceMouse, for runtime.Runtime.
+  Stopping closes the SpaceMouse, which ends the loop and frees the device for the next start.
+  """
+  def __init__(self, cameras, input_devices, index, mouse_key=None):
+    """
+    :param cameras: camera_group.CameraGroupComponent with the camera
+    :param input_devices: InputDevicesComponent
+    :param index: index of the camera in the group
+    :param mouse_key: serial number or port of the SpaceMouse of the camera, None takes any free SpaceMouse
+    """
+    ip_address = cameras.ip_addresses[index]
+    if isinstance(ip_address, tuple):
+      ip_address = "{}:{}".format(*ip_address)
+    super().__init__("mouse {}".format(ip_address), self.run_loop, requires=[cameras, input_devices], interrupt=self.close)
+    self.cameras = cameras
+    self.index = index
+    self.mouse_key = mouse_key
+    self.space_mouse = None
+
+  def start(self):
+    self.space_mouse = spacemouse.SpaceMouse(self.mouse_key)
+    super().start()
+
+  def run_loop(self, stop_event):
+    loop(self.cameras.group[self.index], space_mouse=self.space_mouse)
+
+  def close(self):
+    self.space_mouse.close()
+
+  def is_healthy(self):
+    return super().is_healthy() and self.space_mouse.thread.is_alive()
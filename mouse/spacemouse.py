@@ -25,143 +25,401 @@ For Linux support, you can find open-source Linux drivers and SDKs online.
 import time
 import threading
 import numpy as np
+import sys
+sys.path.append('..')
+import log
+import metrics
+import hid_devices
+import hid_capture
 
-try:
-  import hid
-except ModuleNotFoundError as exc:
-  raise ImportError("Unable to load module hid, required to interface with SpaceMouse. You need root privileges.") from exc
+logger = log.get_logger("spacemouse")
 
-def to_int16(y1, y2):
-  """
-  Convert two 8 bit bytes to a signed 16 bit integer.
-
-  Args:
-    y1 (int): 8-bit byte
-    y2 (int): 8-bit byte
+# rate of the HID reports, by report type
+reports = metrics.Counter("spacemouse_reports_total", "HID reports read from the SpaceMouse", ("type",))
+connections = metrics.Counter("spacemouse_connections_total", "SpaceMouse devices that were opened or lost", ("event",))
 
-  Returns:
-    int: 16-bit integer
+# hid is only needed for real devices, replays (see hid_capture.py) work without it
+try:
+  import hid
+except ModuleNotFoundError:
+  hid = None
+
+# layout of the state array of a SpaceMouse: the 6 axes of the control (x,y,z,roll,pitch,yaw),
+# the left and the right button (0 or 1) and the time.perf_counter() of the last report
+state_size = 9
+LEFT_BUTTON = 6
+RIGHT_BUTTON = 7
+REPORT_TIME = 8
+
+# length of the HID reports and the report types
+report_length = 13
+MOTION_REPORT = 1
+BUTTON_REPORT = 3
+
+# a blocking read returns after this time without a report, so the listener thread notices close()
+read_timeout_ms = 50
+
+# the motion report holds the six axes as little endian int16 in the order y, x, z, roll, pitch, yaw,
+# axis_scales maps the raw readings of the report to [-1,1] (z is inverted), control_order[i] is
+# the index in the control of the i-th axis of the report
+axis_scales = np.array([1., 1., -1., 1., 1., 1.]) / 350.
+control_order = np.array([1, 0, 2, 3, 4, 5])
+
+class SpaceMousePool:
   """
-  x = (y1) | (y2 << 8)
-  if x >= 32768:
-    x = -(65536 - x)
-  return x
-
-
-def scale_to_control(x, axis_scale=350., min_v=-1.0, max_v=1.0):
+  Binds the SpaceMouse devices that are plugged in to the SpaceMouse objects, using a hid_devices.HotplugWatcher.
+  A device goes to the object whose key is the serial number or the port of the device, otherwise to the
+  first object without a key that has no device. A device that is plugged in again is bound again.
   """
-  Normalize raw HID readings to target range.
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.space_mice = []
+    self.devices = {}
+    self.watcher = hid_devices.HotplugWatcher(self.on_added, self.on_removed)
+    self.watcher.start()
+
+  def add(self, space_mouse):
+    with self.lock:
+      self.space_mice.append(space_mouse)
+      self.bind()
+
+  def on_added(self, device):
+    logger.info("SpaceMouse %s plugged in at %s (serial: %s)", device.name, device.port, device.serial_number or "-")
+    with self.lock:
+      self.devices[device.path] = device
+      self.bind()
+
+  def on_removed(self, path):
+    logger.info("SpaceMouse %s unplugged", path.decode())
+    with self.lock:
+      self.devices.pop(path, None)
+
+  def remove(self, space_mouse):
+    """
+    Called by a closed SpaceMouse, its device is bound to another SpaceMouse object.
+    """
+    with self.lock:
+      if space_mouse in self.space_mice:
+        self.space_mice.remove(space_mouse)
+      space_mouse.attach(None)
+      self.bind()
 
-  Args:
-    x (int): Raw reading from HID
-    axis_scale (float): (Inverted) scaling factor for mapping raw input value
-    min_v (float): Minimum limit after scaling
-    max_v (float): Maximum limit after scaling
+  def release(self, space_mouse):
+    """
+    Called by a SpaceMouse that lost its device, which is bound again if it is still present.
+    """
+    with self.lock:
+      space_mouse.attach(None)
+      self.bind()
 
-  Returns:
-    float: Clipped, scaled input from HID
+  def bind(self):
+    """
+    Bind the free devices, the caller has to hold the lock.
+    """
+    bound_paths = {space_mouse.device_info.path for space_mouse in self.space_mice if space_mouse.device_info is not None}
+    keys = {space_mouse.key for space_mouse in self.space_mice if space_mouse.key is not None}
+    for path, device in sorted(self.devices.items()):
+      if path in bound_paths:
+        continue
+      device_keys = {device.serial_number, device.port} - {""}
+      for space_mouse in self.space_mice:
+        if space_mouse.device_info is not None:
+          continue
+        if space_mouse.key in device_keys or (space_mouse.key is None and not device_keys & keys):
+          space_mouse.attach(device)
+          break
+
+# pool of all SpaceMouse objects, created by the first one
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+  global pool
+  with pool_lock:
+    if pool is None:
+      pool = SpaceMousePool()
+    return pool
+
+def close_pool():
   """
-  x = x / axis_scale
-  x = min(max(x, min_v), max_v)
-  return x
-
-
-def convert(b1, b2):
+  Stop watching the devices, the next SpaceMouse creates a new pool.
   """
-  Converts SpaceMouse message to commands.
-
-  Args:
-    b1 (int): 8-bit byte
-    b2 (int): 8-bit byte
-
-  Returns:
-    float: Scaled value from Spacemouse message
-  """
-  return scale_to_control(to_int16(b1, b2))
-
+  global pool
+  with pool_lock:
+    if pool is not None:
+      pool.watcher.stop()
+      pool = None
 
 class SpaceMouse:
   """
   A minimalistic driver class for SpaceMouse with HID library.
 
-  Note: Use hid.enumerate() to view all USB human interface devices (HID).
-  Make sure SpaceMouse is detected before running the script.
-  You can look up its vendor/product id from this method.
+  The device is found and opened as soon as it is plugged in, see SpaceMousePool. When it is unplugged,
+  the axes fall back to zero and the device is opened again when it is plugged in again.
+  Use hid_devices.py to list the SpaceMouse devices with their serial numbers and ports.
 
   Args:
-    vendor_id (int): HID device vendor id
-    product_id (int): HID device product id
+    key (str): serial number or port of the device, e.g. "usb-0000:00:14.0-2/input0",
+      None takes any SpaceMouse that is not bound to another SpaceMouse object
+    device: object with the interface of hid.device that is used instead of a plugged in device,
+      e.g. a hid_capture.ReplayDevice
   """
 
-  def __init__(self,
-         vendor_id=9583,
-         product_id=50734
-         ):
+  def __init__(self, key=None, device=None):
 
-    print("Waiting until SpaceMouse device is available . . .")
-    while True:
-      try:
-        self.device = hid.device()
-        self.device.open(vendor_id, product_id)  # SpaceMouse
-        break
-      except:
-        time.sleep(0.2)
+    if device is None and hid is None:
+      raise ImportError("Unable to load module hid, required to interface with SpaceMouse. You need root privileges.")
 
-    print("SpaceMouse found.")
-    print("Manufacturer: {}".format(self.device.get_manufacturer_string()))
-    print("Product:      {}".format(self.device.get_product_string()))
+    self.key = key
+    self.device = None
+    self.given_device = device
 
-    # 6-DOF variables
-    self.x, self.y, self.z = 0, 0, 0
-    self.roll, self.pitch, self.yaw = 0, 0, 0
+    # the hid_devices.HidDevice that is bound to this object, set by the pool
+    self.device_info = None
 
-    self.is_left_button_pressed = False
-    self.is_right_button_pressed = False
+    # optional recorder of the raw reports, see start_capture()
+    self.capture = None
 
-    self._control = [0., 0., 0., 0., 0., 0.]
-    self._reset_state = 0
+    # latest state, written by the listener thread as a seqlock: the sequence is odd while the state is
+    # written, readers copy the state and retry if the sequence changed in between
+    self.state = np.zeros(state_size)
+    self.sequence = 0
     self.rotation = np.array([[-1., 0., 0.], [0., 1., 0.], [0., 0., -1.]])
     self._enabled = True
 
+    # preallocated buffers of the decoding of a motion report
+    self.report = np.zeros(report_length, dtype=np.uint8)
+    self.raw_axes = self.report[1:report_length].view("<i2")
+    self.axes = np.zeros(6)
+
+    # notifies the threads in wait_for_change() after each batch of reports, and the listener thread of a bound device
+    self.condition = threading.Condition()
+    self.is_closed = False
+
     # launch a new listener thread to listen to SpaceMouse
     self.thread = threading.Thread(target=self.run)
     self.thread.daemon = True
     self.thread.start()
 
+    if device is not None:
+      self.pool = None
+      self.attach(hid_devices.HidDevice(b"", 0, 0, "", "", device.get_product_string()))
+    else:
+      logger.info("Waiting until SpaceMouse device %s is available . . .", key or "(any)")
+      self.pool = get_pool()
+      self.pool.add(self)
+
+  def start_capture(self, path):
+    """
+    Write every report that is read from the device to a new capture file at path, see hid_capture.py for the replay.
+    """
+    if self.capture is None:
+      self.capture = hid_capture.CaptureWriter(path)
+    return self.capture
+
+  def stop_capture(self):
+    """
+    Stop recording and write the remaining records of the capture file.
+    """
+    capture_writer, self.capture = self.capture, None
+    if capture_writer is not None:
+      capture_writer.close()
+
+  def attach(self, device_info):
+    """
+    Bind a device to this object, None unbinds it. Called by the pool.
+    """
+    with self.condition:
+      self.device_info = device_info
+      self.condition.notify_all()
+
+  def open_device(self, retry_interval=0.005, retry_time=2.0):
+    """
+    Wait until a device is bound and open it. The device node can appear a little later than the
+    uevent of the kernel and get its permissions even later, so opening is retried for retry_time seconds.
+
+    Returns:
+      bool: True if the device is open, False if this object has been closed
+    """
+    while True:
+      with self.condition:
+        self.condition.wait_for(lambda: self.device_info is not None or self.is_closed)
+        if self.is_closed:
+          return False
+        device_info = self.device_info
+
+      if self.given_device is not None:
+        self.device = self.given_device
+        return True
+
+      start = time.monotonic()
+      device = None
+      while device is None and not self.is_closed:
+        try:
+          candidate = hid.device()
+          path = hid_devices.hidapi_path(device_info)
+          if path is not None:
+            candidate.open_path(path)
+          else:
+            candidate.open(device_info.vendor_id, device_info.product_id, device_info.serial_number or None)
+          device = candidate
+        except (OSError, IOError):
+          if time.monotonic() - start > retry_time:
+            logger.warning("Could not open SpaceMouse %s", device_info.path.decode())
+            break
+          time.sleep(retry_interval)
+
+      if device is not None:
+        self.device = device
+        connections.inc("opened")
+        logger.info("SpaceMouse found at %s after %.1f ms.", device_info.path.decode(), (time.monotonic() - start) * 1000)
+        logger.info("Manufacturer: %s", device.get_manufacturer_string())
+        logger.info("Product:      %s", device.get_product_string())
+        return True
+      if self.is_closed:
+        return False
+      self.pool.release(self)
+
+  def write_state(self, axes=None, buttons=None):
+    """
+    Publish new axes (in the order of the report) and buttons (bit 0 left, bit 1 right) to the readers.
+    """
+    self.sequence += 1
+    if axes is not None:
+      self.state.put(control_order, axes)
+    if buttons is not None:
+      self.state[LEFT_BUTTON] = buttons & 1
+      self.state[RIGHT_BUTTON] = (buttons >> 1) & 1
+    self.state[REPORT_TIME] = time.perf_counter()
+    self.sequence += 1
+
+    with self.condition:
+      self.condition.notify_all()
+
+  def read_pending(self):
+    """
+    Block until a report arrives or read_timeout_ms has passed, then drain all reports that are already
+    pending without blocking. Only the latest motion report and the latest button report are decoded.
+
+    Returns:
+      tuple: (latest motion report or None, latest button report or None)
+    """
+    motion = None
+    buttons = None
+    d = self.device.read(report_length, read_timeout_ms)
+    if not d:
+      return motion, buttons
+    self.device.set_nonblocking(1)
+    try:
+      while d:
+        capture_writer = self.capture
+        if capture_writer is not None:
+          capture_writer.record(d)
+        if d[0] == MOTION_REPORT:
+          motion = d
+          reports.inc("motion")
+        elif d[0] == BUTTON_REPORT:
+          buttons = d
+          reports.inc("buttons")
+        d = self.device.read(report_length)
+    finally:
+      self.device.set_nonblocking(0)
+    return motion, buttons
+
   def run(self):
     """Listener method that keeps pulling new messages."""
 
-    t_last_click = -1
+    while self.open_device():
+      try:
+        self.read_loop()
+      except (OSError, IOError, ValueError) as exc:
+        logger.warning("SpaceMouse %s lost: %s", self.device_info.path.decode(), exc)
+
+      # stop the camera, the buttons keep their state until the device is back
+      self.device.close()
+      self.device = None
+      self.write_state(axes=np.zeros(6))
+      if self.is_closed:
+        return
+      connections.inc("lost")
+      if self.pool is None:
+        return
+      self.pool.release(self)
+
+  def read_loop(self):
+    """
+    Read the reports of the open device until it fails or this object is closed.
+    """
+    while not self.is_closed:
+      motion, buttons = self.read_pending()
+      if not self._enabled or (motion is None and buttons is None):
+        continue
+
+      if motion is not None:
+        # readings from 6-DoF sensor, decoded in place
+        self.report[:len(motion)] = motion
+        np.multiply(self.raw_axes, axis_scales, out=self.axes)
+        np.clip(self.axes, -1.0, 1.0, out=self.axes)
+
+      if buttons is not None:
+        logger.debug("buttons: %s", buttons[1])
+
+      self.write_state(self.axes if motion is not None else None, buttons[1] if buttons is not None else None)
+
+  def snapshot(self, out=None):
+    """
+    Copy a consistent state without taking a lock.
+
+    Args:
+      out (np.array): array of state_size floats that receives the state, None allocates one
 
+    Returns:
+      tuple: (version, state), the version is even and changes with every written state
+    """
+    if out is None:
+      out = np.empty(state_size)
     while True:
-      d = self.device.read(13)
-      if d is not None and self._enabled:
-
-        if d[0] == 1:  ## readings from 6-DoF sensor
-          self.y = convert(d[1], d[2])
-          self.x = convert(d[3], d[4])
-          self.z = convert(d[5], d[6]) * -1.0
-
-          self.roll = convert(d[7], d[8])
-          self.pitch = convert(d[9], d[10])
-          self.yaw = convert(d[11], d[12])
-
-          self._control = [
-            self.x,
-            self.y,
-            self.z,
-            self.roll,
-            self.pitch,
-            self.yaw,
-          ]
-
-        elif d[0] == 3:  ## readings from the side buttons
-
-          print("buttons: {}".format(d[1]))
-
-          self.is_left_button_pressed = True if d[1] % 2 == 1 else False
-          self.is_right_button_pressed = True if d[1] // 2 == 1 else False
-          
+      sequence = self.sequence
+      if sequence % 2 == 0:
+        np.copyto(out, self.state)
+        if self.sequence == sequence:
+          return sequence, out
+
+  def wait_for_change(self, version, timeout=None, out=None):
+    """
+    Block until a state newer than the given version has been read.
+
+    Args:
+      version (int): version of the state that the caller has seen
+      timeout (float): maximum time in seconds to wait, None waits forever
+      out (np.array): array of state_size floats that receives the state, None allocates one
+
+    Returns:
+      tuple: (version, state) as of snapshot(), the version is unchanged if the timeout elapsed or
+        this object has been closed
+    """
+    with self.condition:
+      self.condition.wait_for(lambda: self.sequence != version or self.is_closed, timeout)
+    return self.snapshot(out)
+
+  def close(self, timeout=2.0):
+    """
+    Stop the listener thread, close the device and hand it to the pool, which binds it to
+    another SpaceMouse object, e.g. the one that replaces this object. Wakes up wait_for_change().
+
+    Args:
+      timeout (float): maximum time in seconds to wait for the listener thread
+    """
+    with self.condition:
+      self.is_closed = True
+      self.condition.notify_all()
+    self.thread.join(timeout)
+    if self.thread.is_alive():
+      logger.warning("SpaceMouse %s did not stop within %s s", self.key or "(any)", timeout)
+    if self.pool is not None:
+      self.pool.remove(self)
+    self.stop_capture()
+
   @property
   def control(self):
     """
@@ -170,11 +428,24 @@ class SpaceMouse:
     Returns:
       np.array: 6-DoF control value
     """
-    return np.array(self._control)
+    return self.snapshot()[1][:6]
+
+  @property
+  def is_left_button_pressed(self):
+    return self.state[LEFT_BUTTON] != 0
+
+  @property
+  def is_right_button_pressed(self):
+    return self.state[RIGHT_BUTTON] != 0
 
 if __name__ == "__main__":
 
   space_mouse = SpaceMouse()
+
+  # record the reports for hid_capture.py, e.g. of an operator session
+  if len(sys.argv) > 1:
+    space_mouse.start_capture(sys.argv[1])
+
   for i in range(100000):
     print(space_mouse.control, space_mouse.is_left_button_pressed, space_mouse.is_right_button_pressed)
     time.sleep(0.2)
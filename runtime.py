@@ -0,0 +1,371 @@
+# This script contains the runtime that starts, supervises and stops all components.
+#
+# Every part of the streaming software with threads or sockets, e.g. the camera transport, a mouse loop
+# or the metrics server, is a Component. The runtime starts them in the order they were added, restarts
+# a component that has become unhealthy together with the components that require it, and stops all of
+# them in reverse order on shutdown. Components start at the same time, each one as soon as the components
+# it requires run, and LazyComponent imports slow or optional modules in its own start, so e.g. the
+# cameras can be controlled before numpy and hid are loaded for the mouse. The supervisor sleeps until a component reports a fault or the next
+# health check is due, so it costs nothing while everything works.
+
+import importlib
+import signal
+import threading
+import time
+import log
+import metrics
+
+logger = log.get_logger("runtime")
+
+restarts = metrics.Counter("runtime_restarts_total", "Restarts of components after a fault", ("component",))
+restart_seconds = metrics.Histogram("runtime_restart_seconds", "Time to stop and start a component and its dependents", ("component",))
+
+class Component:
+  """
+  A part of the software with a lifecycle. Subclasses override start(), stop() and is_healthy().
+  stop() must release everything that start() acquired, so that the component can be started again.
+  """
+  def __init__(self, name, requires=()):
+    """
+    :param requires: components that have to run before this one, it is restarted when one of them is restarted
+    """
+    self.name = name
+    self.requires = list(requires)
+    self.runtime = None
+    self.is_running = False
+    self.last_error = None
+    self.restarts = 0
+
+    # set when the start failed because a module is missing, e.g. gi, the component is not restarted then
+    self.is_disabled = False
+
+    # duration in seconds of the phases of the last start for the startup report: "start" is the whole start,
+    # including phases like "import" of LazyComponent
+    self.timings = {}
+
+    # time.perf_counter() when the component was started the last time
+    self.ready_time = None
+
+  def start(self):
+    pass
+
+  def stop(self):
+    pass
+
+  def is_healthy(self):
+    return True
+
+  def report_fault(self, error=None):
+    """
+    Called by the component when it stopped working, wakes up the supervisor at once.
+    """
+    if error is not None:
+      self.last_error = repr(error)
+    if self.runtime is not None:
+      self.runtime.wakeup.set()
+
+class ThreadComponent(Component):
+  """
+  Component that runs target(stop_event) in a thread until stop_event is set.
+  A target that returns or raises before that is a fault.
+  """
+  def __init__(self, name, target, requires=(), interrupt=None, join_timeout=2.0):
+    """
+    :param interrupt: function that wakes up the target after stop_event has been set, if it does not wait on the event
+    """
+    super().__init__(name, requires)
+    self.target = target
+    self.interrupt = interrupt
+    self.join_timeout = join_timeout
+    self.thread = None
+    self.stop_event = None
+
+  def start(self):
+    self.stop_event = threading.Event()
+    self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+    self.thread.start()
+
+  def run(self):
+    try:
+      self.target(self.stop_event)
+      if not self.stop_event.is_set():
+        self.report_fault("returned")
+    except Exception as exc:
+      logger.exception("%s failed", self.name)
+      self.report_fault(exc)
+
+  def stop(self):
+    self.stop_event.set()
+    if self.interrupt is not None:
+      self.interrupt()
+    self.thread.join(self.join_timeout)
+    if self.thread.is_alive():
+      logger.warning("%s did not stop within %s s", self.name, self.join_timeout)
+
+  def is_healthy(self):
+    return self.thread is not None and self.thread.is_alive()
+
+class LazyComponent(Component):
+  """
+  Component whose module is imported when it starts the first time, so that slow or optional imports,
+  e.g. numpy, hid or gi, neither delay the other components nor fail if the component is not used.
+  The component that does the work is created by create(module).
+  """
+  def __init__(self, name, module_name, create, requires=()):
+    super().__init__(name, requires)
+    self.module_name = module_name
+    self.create = create
+    self.component = None
+
+  def start(self):
+    if self.component is None:
+      start_time = time.perf_counter()
+      module = importlib.import_module(self.module_name)
+      self.timings["import"] = time.perf_counter() - start_time
+      self.component = self.create(module)
+      self.component.runtime = self.runtime
+      # faults of the component are reported as faults of this one
+      self.component.report_fault = self.report_fault
+    self.component.start()
+
+  def stop(self):
+    self.component.stop()
+
+  def is_healthy(self):
+    return self.component is not None and self.component.is_healthy()
+
+class MetricsServerComponent(Component):
+  """
+  The HTTP server of the metrics and of the health check of the runtime.
+  """
+  def __init__(self, port, host="127.0.0.1"):
+    super().__init__("metrics server")
+    self.port = port
+    self.host = host
+    self.server = None
+
+  def start(self):
+    self.server = metrics.start_server(self.port, self.host)
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.server = None
+
+  def is_healthy(self):
+    return self.server is not None and self.server.thread.is_alive()
+
+class Runtime:
+  """
+  Starts, supervises and stops the components.
+  """
+  def __init__(self, health_interval=1.0, max_restart_delay=5.0):
+    """
+    :param health_interval: time in seconds between two health checks
+    :param max_restart_delay: longest delay in seconds before a component that keeps failing is restarted
+    """
+    self.health_interval = health_interval
+    self.max_restart_delay = max_restart_delay
+    self.components = []
+    self.lock = threading.RLock()
+    self.wakeup = threading.Event()
+    self.shutdown_event = threading.Event()
+
+    # per component: number of restarts in a row and the time of the last one
+    self.failures = {}
+
+  def add(self, component):
+    component.runtime = self
+    self.components.append(component)
+    return component
+
+  def dependents(self, component):
+    """
+    :return: the components that require the component, directly or indirectly, in the order they were added
+    """
+    affected = {component}
+    result = []
+    for other in self.components:
+      if any(required in affected for required in other.requires):
+        affected.add(other)
+        result.append(other)
+    return result
+
+  def start_component(self, component):
+    start_time = time.perf_counter()
+    try:
+      component.start()
+      component.is_running = True
+      return True
+    except ImportError as exc:
+      logger.error("Could not start %s, it is disabled: %s", component.name, exc)
+      component.last_error = repr(exc)
+      component.is_disabled = True
+      return False
+    except Exception as exc:
+      logger.exception("Could not start %s", component.name)
+      component.last_error = repr(exc)
+      return False
+    finally:
+      component.ready_time = time.perf_counter()
+      component.timings["start"] = component.ready_time - start_time
+
+  def stop_component(self, component):
+    if not component.is_running:
+      return
+    component.is_running = False
+    try:
+      component.stop()
+    except Exception:
+      logger.exception("Could not stop %s", component.name)
+
+  def start(self):
+    """
+    Start all components at the same time, each one as soon as the components that it requires run.
+    A component whose requirement could not be started is started by the supervisor together with it.
+    """
+    with self.lock:
+      started = {component: threading.Event() for component in self.components}
+
+      def start_when_ready(component):
+        for required in component.requires:
+          started[required].wait()
+        if all(required.is_running for required in component.requires):
+          self.start_component(component)
+        started[component].set()
+
+      threads = [threading.Thread(target=start_when_ready, args=(component,), name="start " + component.name)
+                 for component in self.components]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+  def stop(self):
+    with self.lock:
+      for component in reversed(self.components):
+        self.stop_component(component)
+
+  def restart(self, component):
+    """
+    Stop the component and its dependents, and start them again.
+    """
+    start_time = time.perf_counter()
+    dependents = self.dependents(component)
+    with self.lock:
+      for other in reversed(dependents):
+        self.stop_component(other)
+      self.stop_component(component)
+      component.restarts += 1
+      restarts.inc(component.name)
+      is_started = self.start_component(component)
+      for other in dependents:
+        if is_started:
+          self.start_component(other)
+    restart_seconds.observe(time.perf_counter() - start_time, component.name)
+    logger.warning("Restarted %s and %s dependent components in %.1f ms (%s)", component.name, len(dependents),
+                   (time.perf_counter() - start_time) * 1000, component.last_error)
+    return is_started
+
+  def check(self):
+    """
+    Restart the unhealthy components, with a growing delay for components that keep failing.
+    :return: time in seconds until a delayed restart is due, None if there is none
+    """
+    now = time.monotonic()
+    next_restart = None
+    for component in list(self.components):
+      if component.is_disabled or (component.is_running and component.is_healthy()):
+        continue
+
+      # a component whose requirement is down is restarted together with it
+      if any(not required.is_running or not required.is_healthy() for required in component.requires):
+        continue
+
+      failures, last_restart = self.failures.get(component, (0, 0.0))
+
+      # the first restart is immediate, the following ones after 50 ms, 100 ms, ... up to max_restart_delay
+      delay = 0.0 if failures == 0 else min(0.05 * 2 ** (failures - 1), self.max_restart_delay)
+      if now < last_restart + delay:
+        next_restart = last_restart + delay - now if next_restart is None else min(next_restart, last_restart + delay - now)
+        continue
+      self.failures[component] = (failures + 1, now)
+      self.restart(component)
+
+    # components that have been healthy for a while start again with an immediate restart
+    for component, (failures, last_restart) in list(self.failures.items()):
+      if now - last_restart > 10 * self.health_interval + self.max_restart_delay:
+        del self.failures[component]
+    return next_restart
+
+  def log_startup(self, start_time):
+    """
+    Log when each component was ready and how long the phases of its start took.
+    :param start_time: time.perf_counter() at the start of the process
+    """
+    for component in sorted(self.components, key=lambda component: component.ready_time or float("inf")):
+      phases = ", ".join("{} {:.1f} ms".format(phase, seconds * 1000) for phase, seconds in component.timings.items())
+      if component.is_running:
+        logger.info("Startup: %s ready after %.1f ms (%s)", component.name, (component.ready_time - start_time) * 1000, phases)
+      else:
+        logger.warning("Startup: %s not started (%s)", component.name, component.last_error)
+
+  def run(self, start_time=None):
+    """
+    Start all components and supervise them until shutdown() is called, then stop them in reverse order.
+    :param start_time: time.perf_counter() at the start of the process, logs the startup report if given
+    """
+    self.start()
+    logger.info("Started %s components", len(self.components))
+    if start_time is not None:
+      self.log_startup(start_time)
+    try:
+      timeout = self.health_interval
+      while not self.shutdown_event.is_set():
+        self.wakeup.wait(timeout)
+        self.wakeup.clear()
+        if self.shutdown_event.is_set():
+          break
+        next_restart = self.check()
+        timeout = self.health_interval if next_restart is None else min(next_restart, self.health_interval)
+    finally:
+      logger.info("Stopping %s components", len(self.components))
+      self.stop()
+
+  def shutdown(self):
+    """
+    Stop the runtime, can be called from any thread.
+    """
+    self.shutdown_event.set()
+    self.wakeup.set()
+
+  def install_signal_handlers(self, signals=(signal.SIGINT, signal.SIGTERM)):
+    """
+    Shut down on Ctrl+C and on SIGTERM of the service manager, must be called from the main thread.
+    """
+    def shutdown(signum):
+      logger.info("Received %s, shutting down", signal.Signals(signum).name)
+      self.shutdown()
+
+    # the handler can interrupt the main thread while it holds the lock of an event or of the log queue,
+    # so it does nothing but start a thread
+    def handle_signal(signum, frame):
+      threading.Thread(target=shutdown, args=(signum,), daemon=True).start()
+    for signum in signals:
+      signal.signal(signum, handle_signal)
+
+  def health(self):
+    """
+    :return: dict with "healthy" and the state of every component, served on /health of the metrics server
+    """
+    components = {}
+    for component in self.components:
+      components[component.name] = {
+        "running": component.is_running,
+        "disabled": component.is_disabled,
+        "healthy": component.is_running and component.is_healthy(),
+        "restarts": component.restarts,
+        "last_error": component.last_error,
+        "start_ms": {phase: seconds * 1000 for phase, seconds in component.timings.items()},
+      }
+    return {"healthy": all(state["healthy"] for state in components.values()), "components": components}
@@ -8,10 +8,13 @@
 # https://developer.gnome.org/gtk3/stable/gtk-broadway.html
 #
 
+import sys
 import gi
 
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
+from gi.repository import GLib, Gtk
+sys.path.append('..')
+import runtime
 
 def main_loop():
 
@@ -34,6 +37,13 @@ def main_loop():
   win.show_all()
   Gtk.main()
 
+class WebInterfaceComponent(runtime.ThreadComponent):
+  """
+  The Gtk main loop of the user interface in its own thread, for runtime.Runtime.
+  Closing the window ends the main loop, the runtime then opens it again.
+  """
+  def __init__(self):
+    super().__init__("web interface", lambda stop_event: main_loop(), interrupt=lambda: GLib.idle_add(Gtk.main_quit))
 
 if __name__ == "__main__":
   main_loop()